@@ -0,0 +1,242 @@
+"""Batch classification without the web layer:
+
+    python -m app.batch statements/ 'archive/2024-*/*.xlsx' --output-dir month_end [--workers N] [--format xlsx]
+
+Every sheet of every matched file (directories are searched recursively) is
+scored with ``prediction.predict_chunk``, one file per task on a process pool
+of ``--workers`` processes (default: one per core). Results are kept per file
+content hash under OUTPUT_DIR/.results, so a file already classified by the
+same model version (a rerun, a renamed or re-exported copy) is not scored
+again. Each run writes OUTPUT_DIR/predictions.<format> with every row tagged
+with its source file and sheet, and OUTPUT_DIR/summary.json with one entry
+per file.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+from app.models.model import registry
+from app.services.file_service import (
+    CHUNK_SIZE, file_digest, file_format, iter_file_chunks, OUTPUT_FORMATS, sheet_names, StreamingOutput
+)
+from app.services.prediction import predict_chunk, text_columns
+
+INPUT_EXTENSIONS = ("xlsx", "xls", "csv", "parquet")
+REQUIRED_COLUMNS = text_columns + ["Amount"]
+
+# discover, load_manifest, store_results, consolidate, run_batch and summarize are duplicated in
+# expense_classifier_no_target/app/batch.py; keep the copies identical
+# (tests/test_batch.py checks this).
+
+def discover(inputs, exclude=None):
+    """Statement files named by ``inputs`` (files, directories or glob patterns), sorted.
+
+    Files under ``exclude`` (the output directory) and Excel lock files are left out.
+    """
+    exclude = os.path.abspath(exclude) + os.sep if exclude else None
+    paths = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "**", "*")
+        for path in glob.glob(pattern, recursive=True):
+            path = os.path.abspath(path)
+            if (os.path.isfile(path) and file_format(path) in INPUT_EXTENSIONS
+                    and not os.path.basename(path).startswith("~$")
+                    and not (exclude and path.startswith(exclude))):
+                paths.add(path)
+    return sorted(paths)
+
+def load_manifest(results_dir):
+    """Manifest of a file's stored results, or None if it has none"""
+    try:
+        with open(os.path.join(results_dir, "manifest.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def store_results(results_dir, score_sheet, file_path, digest, version):
+    """Score every sheet of ``file_path`` into one Parquet part per sheet under ``results_dir``.
+
+    ``score_sheet(file_path, sheet, output)`` writes a sheet's annotated rows
+    to ``output`` and returns a reason if the sheet was skipped. The parts
+    are written to a temporary directory that replaces ``results_dir`` once
+    the manifest is in place, so an interrupted run leaves no partial results.
+    """
+    start = time.perf_counter()
+    temp_dir = f"{results_dir}.tmp"
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    sheets = []
+    for number, sheet in enumerate(sheet_names(file_path)):
+        part = f"sheet-{number:03d}.parquet"
+        output = StreamingOutput(os.path.join(temp_dir, part))
+        skipped = score_sheet(file_path, sheet, output)
+        if output.rows:
+            output.close()
+        sheets.append({"sheet": sheet, "rows": output.rows, "part": part if output.rows else None,
+                       **({"skipped": skipped} if skipped else {})})
+    manifest = {
+        "sha256": digest,
+        "source": file_path,
+        "version": version,
+        "sheets": sheets,
+        "rows": sum(sheet["rows"] for sheet in sheets),
+        "seconds": round(time.perf_counter() - start, 3)
+    }
+    with open(os.path.join(temp_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    shutil.rmtree(results_dir, ignore_errors=True)
+    os.replace(temp_dir, results_dir)
+    return manifest
+
+def consolidate(entries, output_path, chunk_size):
+    """Write the rows of every ``(file_path, results_dir, manifest)`` entry to one output file.
+
+    Rows get "Source File" and "Sheet" columns; files whose columns differ are
+    aligned on the union of their columns.
+    """
+    import pyarrow.parquet as pq
+
+    parts = [
+        (file_path, sheet["sheet"], os.path.join(results_dir, sheet["part"]))
+        for file_path, results_dir, manifest in entries
+        for sheet in manifest["sheets"] if sheet["part"]
+    ]
+    columns = ["Source File", "Sheet"]
+    for _, _, part_path in parts:
+        columns += [name for name in pq.read_schema(part_path).names if name not in columns]
+
+    output = StreamingOutput(output_path)
+    for file_path, sheet, part_path in parts:
+        for batch in pq.ParquetFile(part_path).iter_batches(batch_size=chunk_size):
+            df = batch.to_pandas()
+            df.insert(0, "Sheet", sheet)
+            df.insert(0, "Source File", file_path)
+            output.write(df.reindex(columns=columns))
+    output.close()
+    return output.rows
+
+def run_batch(inputs, output_dir, output_format, workers, version, classify_file, initializer=None):
+    """Classify every file named by ``inputs`` on a process pool; returns the run summary.
+
+    ``classify_file(file_path, digest, results_dir, version)`` runs in the
+    pool and returns the file's manifest. Stored results are reused when
+    their ``version`` (model or prompt version) matches. ``initializer``, if
+    given, is called in each pool process with the number of processes.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+
+    files = []
+    pending = {}
+    for file_path in discover(inputs, exclude=output_dir):
+        digest = file_digest(file_path)
+        results_dir = os.path.join(output_dir, ".results", digest)
+        manifest = load_manifest(results_dir)
+        reused = manifest is not None and manifest["version"] == version
+        files.append({"file": file_path, "sha256": digest, "results_dir": results_dir,
+                      "status": "reused" if reused else "classified", "manifest": manifest if reused else None})
+        if not reused:
+            # Identical copies in one run are scored once
+            pending.setdefault(digest, (file_path, results_dir))
+
+    manifests = {}
+    errors = {}
+    if pending:
+        processes = min(workers or os.cpu_count() or 1, len(pending))
+        with ProcessPoolExecutor(processes, initializer=initializer,
+                                 initargs=(processes,) if initializer else ()) as pool:
+            futures = {
+                pool.submit(classify_file, file_path, digest, results_dir, version): digest
+                for digest, (file_path, results_dir) in pending.items()
+            }
+            for future in as_completed(futures):
+                digest = futures[future]
+                try:
+                    manifests[digest] = future.result()
+                    print(f"Classified {manifests[digest]['rows']} rows from {pending[digest][0]}")
+                except Exception as e:
+                    errors[digest] = str(e)
+                    print(f"Failed to classify {pending[digest][0]}: {e}", file=sys.stderr)
+
+    for entry in files:
+        if entry["status"] == "classified":
+            if entry["sha256"] in errors:
+                entry.update(status="failed", error=errors[entry["sha256"]])
+            else:
+                entry["manifest"] = manifests[entry["sha256"]]
+
+    output_path = os.path.join(output_dir, f"predictions.{output_format}")
+    done = [entry for entry in files if entry["manifest"]]
+    rows = consolidate([(entry["file"], entry["results_dir"], entry["manifest"]) for entry in done],
+                       output_path, CHUNK_SIZE)
+
+    summary = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "version": version,
+        "output": output_path,
+        "rows": rows,
+        "seconds": round(time.perf_counter() - start, 3),
+        "files": [
+            {
+                "file": entry["file"],
+                "sha256": entry["sha256"],
+                "status": entry["status"],
+                **({"rows": entry["manifest"]["rows"], "sheets": entry["manifest"]["sheets"],
+                    "seconds": entry["manifest"]["seconds"]} if entry["manifest"] else {"error": entry.get("error")})
+            }
+            for entry in files
+        ]
+    }
+    with open(os.path.join(output_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+def summarize(summary):
+    """Print a one-line account of a run; returns the exit code (1 if any file failed)"""
+    counts = Counter(entry["status"] for entry in summary["files"])
+    print(f"{len(summary['files'])} files ({', '.join(f'{n} {status}' for status, n in counts.items()) or 'none'}), "
+          f"{summary['rows']} rows in {summary['seconds']}s -> {summary['output']}")
+    return 1 if counts.get("failed") else 0
+
+def score_sheet(file_path, sheet, output):
+    """Score one sheet with the live model; sheets without the statement columns are skipped"""
+    loaded = registry.current()
+    for chunk in iter_file_chunks(file_path, sheet=sheet):
+        missing = [column for column in REQUIRED_COLUMNS if column not in chunk.columns]
+        if missing:
+            return f"Missing columns: {missing}"
+        output.write(predict_chunk(chunk, loaded))
+    return None
+
+def classify_file(file_path, digest, results_dir, version):
+    """Process-pool task: score and store one file"""
+    return store_results(results_dir, score_sheet, file_path, digest, version)
+
+def run(inputs, output_dir, output_format="xlsx", workers=None):
+    """Classify every file named by ``inputs``; returns the run summary"""
+    # Loaded before the pool starts, so forked workers share the model's pages
+    version = registry.current().version
+    return run_batch(inputs, output_dir, output_format, workers, version, classify_file)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classify statement files in bulk")
+    parser.add_argument("inputs", nargs="+", help="statement files, directories or glob patterns")
+    parser.add_argument("--output-dir", required=True, help="where predictions, summary and stored results go")
+    parser.add_argument("--format", default="xlsx", choices=list(OUTPUT_FORMATS), help="consolidated output format")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    args = parser.parse_args(argv)
+
+    return summarize(run(args.inputs, args.output_dir, args.format, args.workers))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,85 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Header
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from app.services.prediction import predict_gl_account
+from app.schemas.prediction import TopKPrediction, ModelStatus, ExpenseBatch, ExpensePrediction
+from app.models.model import registry
+from app.services.file_service import OUTPUT_FORMATS, CHUNK_SIZE, collect_garbage, save_upload, store_upload
+from app.services.inference_pool import inference_pool, PoolOverloaded
 import os
+import glob
+import hmac
+import json
 import uuid
+import time
+import asyncio
+import hashlib
+import logging
+import shutil
 import tempfile
-from typing import Optional
+import threading
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Optional, List
 
-app = FastAPI()
+# The prediction stack (pandas, the model) is not imported here: the web process loads the
+# model in the background after startup, and handlers import the functions they send to
+# the inference workers, so the app starts serving (and answering /health) right away
+
+logger = logging.getLogger(__name__)
+
+# Directory holding uploads (one file per content hash) and results (one file per
+# content hash and model version)
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "app/static/uploads")
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+# Uploads and results not used for UPLOAD_MAX_AGE_SECONDS are removed, then the least
+# recently used ones until UPLOAD_DIR fits in UPLOAD_MAX_BYTES; checked every UPLOAD_GC_INTERVAL seconds
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(5 << 30)))
+UPLOAD_MAX_AGE_SECONDS = float(os.getenv("UPLOAD_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+UPLOAD_GC_INTERVAL = float(os.getenv("UPLOAD_GC_INTERVAL", "3600"))
+
+# Results being written, by (result key, output format) -> (run, output path)
+_in_flight = {}
+# Paths read or written by running requests; the garbage collector leaves them alone
+_in_use = set()
+_garbage_collector = None
+
+# Token required by the /admin endpoints; they are disabled when it is not set
+ADMIN_TOKEN = os.getenv("GL_ADMIN_TOKEN")
+
+# Warm-up state reported by /ready
+startup = {"status": "starting", "seconds": None, "error": None}
+
+def warm_up():
+    """Start every inference worker and load the active model here while they load theirs"""
+    start = time.perf_counter()
+    try:
+        workers = inference_pool.warm_up()
+        registry.current()
+        for worker in workers:
+            worker.result()
+        startup.update(status="ready", seconds=round(time.perf_counter() - start, 3))
+        logger.info(f"Ready in {startup['seconds']}s")
+    except Exception as e:
+        startup.update(status="failed", error=str(e))
+        logger.error(f"Warm-up failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app):
+    """Start the inference workers, the model watcher and upload garbage collection, and warm up
+    in the background; /ready answers 200 once the model and the workers are loaded.
+
+    Each worker loads the model itself; artifacts are memory-mapped, so the
+    workers still share its pages.
+    """
+    inference_pool.start()
+    registry.watch()
+    collect_garbage_periodically()
+    threading.Thread(target=warm_up, daemon=True).start()
+    yield
+    inference_pool.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
@@ -16,39 +87,123 @@ app.mount("/static", StaticFiles(directory="app/static"), name="static")
 # Setup templates
 templates = Jinja2Templates(directory="app/templates")
 
-# Directory to save uploaded files temporarily
-UPLOAD_DIR = "app/static/uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+def _overloaded(e: PoolOverloaded) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def collect_upload_garbage():
+    """Remove expired and least recently used uploads and results from UPLOAD_DIR"""
+    removed, freed = collect_garbage(UPLOAD_DIR, UPLOAD_MAX_BYTES, UPLOAD_MAX_AGE_SECONDS,
+                                     in_use=lambda path: path.removesuffix(".tmp") in _in_use)
+    if removed:
+        logger.info(f"Removed {removed} uploads and results ({freed / (1 << 20):.1f} MiB)")
+    return removed, freed
+
+def collect_garbage_periodically(interval=UPLOAD_GC_INTERVAL):
+    """Collect upload garbage now and every ``interval`` seconds on a daemon thread"""
+    global _garbage_collector
+    if interval <= 0 or _garbage_collector is not None:
+        return
+
+    def run():
+        while True:
+            try:
+                collect_upload_garbage()
+            except Exception as e:
+                logger.error(f"Upload garbage collection failed: {e}")
+            time.sleep(interval)
+
+    _garbage_collector = threading.Thread(target=run, daemon=True)
+    _garbage_collector.start()
+
+async def classify_upload(file: UploadFile, output_format: str) -> str:
+    """Classify an upload into UPLOAD_DIR; returns the result's filename.
+
+    Uploads are stored by content hash. The result of a byte-identical upload
+    scored by the live model version is returned as is, and an identical
+    upload still being scored is waited for rather than scored again.
+    """
+    input_path, digest = await store_upload(file, UPLOAD_DIR)
+    key = hashlib.sha256(f"{digest}:{registry.current().version}".encode()).hexdigest()[:20]
+    stored = glob.glob(os.path.join(glob.escape(UPLOAD_DIR), f"prediction_*_{key}.{output_format}"))
+    if stored:
+        os.utime(stored[0])  # marks it as recently used
+        return os.path.basename(stored[0])
+
+    running = _in_flight.get((key, output_format))
+    if running is None:
+        from app.services.prediction import predict_gl_account
+
+        # The result is named after the first upload of this content
+        original_filename = os.path.splitext(file.filename)[0]
+        output_filepath = os.path.join(UPLOAD_DIR, f"prediction_{original_filename}_{key}.{output_format}")
+        running = (asyncio.ensure_future(inference_pool.run(predict_gl_account, input_path, output_filepath)),
+                   output_filepath)
+        _in_flight[(key, output_format)] = running
+        _in_use.update((input_path, output_filepath))
+
+        def finished(_):
+            del _in_flight[(key, output_format)]
+            _in_use.difference_update((input_path, output_filepath))
+        running[0].add_done_callback(finished)
+    await asyncio.shield(running[0])
+    return os.path.basename(running[1])
+
+@app.get("/health")
+async def health():
+    """Liveness: the process is up and serving"""
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    """Readiness: 200 once the model and the inference workers are warmed up, 503 until then"""
+    return JSONResponse(startup, status_code=200 if startup["status"] == "ready" else 503)
 
 # Web Interface
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     return templates.TemplateResponse("upload.html", {"request": request})
 
-@app.post("/predict-web/", response_class=HTMLResponse)
-async def predict_web(request: Request, file: UploadFile = File(...)):
+def _check_admin_token(token):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (GL_ADMIN_TOKEN is not set)")
+    if not token or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/admin/model", response_model=ModelStatus)
+async def model_status(x_admin_token: Optional[str] = Header(None)):
+    _check_admin_token(x_admin_token)
+    return {"active_version": registry.current().version, "versions": registry.versions()}
+
+@app.post("/admin/model/activate", response_model=ModelStatus)
+def activate_model(version: Optional[str] = Form(None), x_admin_token: Optional[str] = Header(None)):
+    """Hot-swap to a published version, or reload the active one when no version is given"""
+    _check_admin_token(x_admin_token)
     try:
-        # Save the uploaded file temporarily
-        file_extension = file.filename.split(".")[-1]
-        temp_filename = f"{uuid.uuid4()}.{file_extension}"
-        temp_filepath = os.path.join(UPLOAD_DIR, temp_filename)
-
-        with open(temp_filepath, "wb") as buffer:
-            buffer.write(await file.read())
+        active_version = registry.activate(version)
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"active_version": active_version, "versions": registry.versions()}
 
-        # Define output file path with "prediction_" prefix and original filename
-        original_filename = os.path.splitext(file.filename)[0]
-        output_filename = f"prediction_{original_filename}.xlsx"
-        output_filepath = os.path.join(UPLOAD_DIR, output_filename)
+@app.post("/predict-web/", response_class=HTMLResponse)
+async def predict_web(request: Request, file: UploadFile = File(...), output_format: str = Form("xlsx")):
+    try:
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Invalid output format. Allowed formats: {list(OUTPUT_FORMATS)}")
 
-        # Predict G/L Account No
-        predict_gl_account(temp_filepath, output_filepath)
+        # Predict G/L Account No in a worker process, keeping the event loop free
+        async with inference_pool.reserve():
+            output_filename = await classify_upload(file, output_format)
 
         # Render the download page
         return templates.TemplateResponse("download.html", {
             "request": request,
             "filename": output_filename
         })
+    except PoolOverloaded as e:
+        return templates.TemplateResponse("upload.html", {
+            "request": request,
+            "error": str(e)
+        }, status_code=e.status_code, headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         return templates.TemplateResponse("upload.html", {
             "request": request,
@@ -64,34 +219,142 @@ async def download_file(filename: str):
 
 # API Interface (for Swagger UI)
 @app.post("/predict-api/", response_class=FileResponse)
-async def predict_api(file: UploadFile = File(...)):
+async def predict_api(file: UploadFile = File(...), output_format: str = Form("xlsx")):
     try:
-        # Create a temporary directory
-        temp_dir = tempfile.mkdtemp()
-        file_extension = file.filename.split(".")[-1]
-        temp_filename = f"{uuid.uuid4()}.{file_extension}"
-        temp_filepath = os.path.join(temp_dir, temp_filename)
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Invalid output format. Allowed formats: {list(OUTPUT_FORMATS)}")
 
-        # Save the uploaded file
-        with open(temp_filepath, "wb") as buffer:
-            buffer.write(await file.read())
-
-        # Define output file path with "prediction_" prefix and original filename
-        original_filename = os.path.splitext(file.filename)[0]
-        output_filename = f"prediction_{original_filename}.xlsx"
-        output_filepath = os.path.join(temp_dir, output_filename)
-
-        # Predict G/L Account No
-        predict_gl_account(temp_filepath, output_filepath)
+        # Save the upload and predict G/L Account No in a worker process
+        async with inference_pool.reserve():
+            output_filename = await classify_upload(file, output_format)
 
         # Return the processed file directly with the custom filename
+        original_filename = os.path.splitext(file.filename)[0]
         return FileResponse(
-            path=output_filepath,
-            filename=output_filename,  # Use the custom filename for download
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            path=os.path.join(UPLOAD_DIR, output_filename),
+            filename=f"prediction_{original_filename}.{output_format}",  # Use the custom filename for download
+            media_type=OUTPUT_FORMATS[output_format]
         )
+    except PoolOverloaded as e:
+        raise _overloaded(e)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/predict-topk/", response_model=List[TopKPrediction])
+async def predict_topk(file: UploadFile = File(...), k: int = 3):
+    """Top-k G/L accounts with scores and the top-1/top-2 margin for every row"""
+    from app.services.prediction import predict_top_k_file
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        file_extension = file.filename.split(".")[-1]
+        temp_filepath = os.path.join(temp_dir, f"{uuid.uuid4()}.{file_extension}")
+
+        async with inference_pool.reserve():
+            await save_upload(file, temp_filepath)
+            return await inference_pool.run(predict_top_k_file, temp_filepath, k)
+    except PoolOverloaded as e:
+        raise _overloaded(e)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+# JSON Interface: records in, predictions out, nothing written to disk
+@app.post("/predict-json", response_model=List[ExpensePrediction])
+async def predict_json(batch: ExpenseBatch):
+    """Predict G/L accounts for expense records sent in the request body"""
+    from app.services.prediction import predict_records
+
+    try:
+        async with inference_pool.reserve():
+            return await inference_pool.run(predict_records, batch.expenses)
+    except PoolOverloaded as e:
+        raise _overloaded(e)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/predict-json/upload", response_model=List[ExpensePrediction])
+async def predict_json_upload(file: UploadFile = File(...)):
+    """Predict G/L accounts for an uploaded file parsed in memory"""
+    from app.services.prediction import predict_bytes
+
+    try:
+        extension = file.filename.rsplit(".", 1)[-1].lower()
+        async with inference_pool.reserve():
+            content = await file.read()
+            return await inference_pool.run(predict_bytes, content, extension)
+    except PoolOverloaded as e:
+        raise _overloaded(e)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+class BodyStreamingResponse(StreamingResponse):
+    """StreamingResponse for handlers that keep reading the request body while responding.
+
+    Starlette's StreamingResponse watches ``receive()`` for a disconnect,
+    which would swallow the body messages ``request.stream()`` is waiting for.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+@app.post("/predict-ndjson")
+async def predict_ndjson(request: Request):
+    """Predictions for a newline-delimited JSON body, one output line per input line.
+
+    Lines are scored CHUNK_SIZE at a time while the body is still arriving,
+    and each chunk's results are sent as soon as they are ready; a line that
+    is not a JSON object gets an ``error`` entry instead of failing the batch.
+    """
+    from app.services.prediction import predict_records
+
+    async def score(lines, first_row):
+        records, results = [], {}
+        for offset, line in enumerate(lines):
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("expected a JSON object")
+                records.append((offset, record))
+            except ValueError as e:
+                results[offset] = {"row": first_row + offset, "error": f"Invalid line: {e}"}
+        if records:
+            try:
+                predictions = await inference_pool.run(predict_records, [record for _, record in records])
+                for (offset, _), prediction in zip(records, predictions):
+                    results[offset] = {**prediction, "row": first_row + offset}
+            except Exception as e:
+                # The status line is already sent, so errors are reported per row
+                for offset, _ in records:
+                    results[offset] = {"row": first_row + offset, "error": str(e)}
+        return "".join(json.dumps(results[offset]) + "\n" for offset in range(len(lines)))
+
+    # Take the slot before responding so an overloaded server still answers 429/503
+    slot = AsyncExitStack()
+    try:
+        await slot.enter_async_context(inference_pool.reserve())
+    except PoolOverloaded as e:
+        raise _overloaded(e)
+
+    async def results():
+        async with slot:
+            buffer, lines, row = b"", [], 0
+            async for chunk in request.stream():
+                buffer += chunk
+                *complete, buffer = buffer.split(b"\n")
+                lines.extend(line for line in complete if line.strip())
+                while len(lines) >= CHUNK_SIZE:
+                    yield await score(lines[:CHUNK_SIZE], row)
+                    lines, row = lines[CHUNK_SIZE:], row + CHUNK_SIZE
+            if buffer.strip():
+                lines.append(buffer)
+            if lines:
+                yield await score(lines, row)
+
+    return BodyStreamingResponse(results(), media_type="application/x-ndjson")
 
 
 
@@ -0,0 +1,442 @@
+"""Standalone scoring artifact for the G/L pipeline.
+
+``export`` flattens a fitted pipeline (a ColumnTransformer of a
+TfidfVectorizer on the combined text and a SimpleImputer on Amount, then a
+LightGBM or logistic regression classifier) and its label encoder into
+plain arrays in one ``.npz`` file: the vocabulary, stop words and idf
+weights, the imputer statistics, and the classifier as flattened tree node
+arrays or coefficients. ``CompiledModel`` scores them with NumPy and SciPy
+only, so loading it imports neither scikit-learn nor LightGBM, and small
+requests skip the Pipeline/ColumnTransformer machinery. ``export`` checks
+the artifact against the pipeline before writing it.
+
+The registry serves the artifact saved next to a model pickle (same name,
+``.npz``, see ``model.compiled_path``) when it is newer than the pickle and
+the encoder:
+
+    python -m app.models.compiled MODEL.pkl ENCODER.pkl [OUTPUT.npz]
+"""
+import json
+import os
+import re
+import sys
+import unicodedata
+from types import SimpleNamespace
+
+import numpy as np
+import scipy.sparse as sp
+
+# Largest probability difference from the pipeline that export accepts
+PARITY_TOLERANCE = 1e-6
+
+# Rows scored per block by the tree evaluator; bounds its (rows, trees) arrays
+TREE_BLOCK_ROWS = 4096
+
+# Frames of at least this many rows are scored by LightGBM itself when it is
+# installed (imported on first use); the NumPy tree evaluator is faster below
+NATIVE_MIN_ROWS = int(os.getenv("GL_COMPILED_NATIVE_MIN_ROWS", "64"))
+
+# LightGBM missing value handling of a split, and its zero threshold
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+_MISSING_TYPES = {"None": MISSING_NONE, "Zero": MISSING_ZERO, "NaN": MISSING_NAN}
+_ZERO_THRESHOLD = 1e-35
+
+
+def _softmax(scores):
+    scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+    return scores / scores.sum(axis=1, keepdims=True)
+
+
+def _sigmoid(scores):
+    return 1.0 / (1.0 + np.exp(-scores))
+
+
+def _probabilities(scores, link):
+    """Class probabilities from raw scores, as the classifier's predict_proba computes them"""
+    if link == "binary":
+        positive = _sigmoid(scores[:, 0])
+        return np.column_stack([1.0 - positive, positive])
+    if link == "ovr":
+        proba = _sigmoid(scores)
+        return proba / proba.sum(axis=1, keepdims=True)
+    return _softmax(scores)
+
+
+class _Vectorizer:
+    """TfidfVectorizer.transform over a fixed vocabulary"""
+
+    def __init__(self, meta, idf):
+        self.vocabulary = {term: index for index, term in enumerate(meta["vocabulary"])}
+        self.stop_words = frozenset(meta["stop_words"] or ())
+        self.token_pattern = re.compile(meta["token_pattern"])
+        self.lowercase = meta["lowercase"]
+        self.strip_accents = meta["strip_accents"]
+        self.ngram_range = tuple(meta["ngram_range"])
+        self.binary = meta["binary"]
+        self.sublinear_tf = meta["sublinear_tf"]
+        self.norm = meta["norm"]
+        self.idf = idf
+
+    def _terms(self, doc):
+        if self.strip_accents == "ascii":
+            doc = unicodedata.normalize("NFKD", doc).encode("ASCII", "ignore").decode("ASCII")
+        elif self.strip_accents == "unicode" and not doc.isascii():
+            doc = "".join(c for c in unicodedata.normalize("NFKD", doc) if not unicodedata.combining(c))
+        if self.lowercase:
+            doc = doc.lower()
+        tokens = [token for token in self.token_pattern.findall(doc) if token not in self.stop_words]
+        low, high = self.ngram_range
+        if (low, high) == (1, 1):
+            return tokens
+        return [" ".join(tokens[i:i + n]) for n in range(low, high + 1) for i in range(len(tokens) - n + 1)]
+
+    def transform(self, docs):
+        indptr, indices = [0], []
+        vocabulary = self.vocabulary
+        for doc in docs:
+            indices.extend(index for index in map(vocabulary.get, self._terms(doc)) if index is not None)
+            indptr.append(len(indices))
+        # Duplicate entries are summed into term counts
+        counts = sp.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(indptr) - 1, len(vocabulary)))
+        counts.sum_duplicates()
+        if self.binary:
+            counts.data[:] = 1.0
+        if self.sublinear_tf:
+            counts.data = np.log(counts.data) + 1.0
+        if self.idf is not None:
+            counts.data *= self.idf[counts.indices]
+        if self.norm:
+            row_norms = np.asarray(abs(counts).sum(axis=1) if self.norm == "l1"
+                                   else np.sqrt(counts.multiply(counts).sum(axis=1))).ravel()
+            row_norms[row_norms == 0.0] = 1.0
+            counts.data /= np.repeat(row_norms, np.diff(counts.indptr))
+        return counts
+
+
+class _Trees:
+    """LightGBM trees, flattened into node arrays and evaluated for every tree at once.
+
+    The two children of a split are stored next to each other, so a row moves
+    to ``left[node] + (goes right)``; a leaf is its own left child with an
+    infinite threshold, so rows that reach one early stay there. Trees are
+    walked deepest first, and each level only walks the trees that deep.
+    Large frames go to a LightGBM booster rebuilt from the saved model
+    string instead.
+    """
+
+    def __init__(self, meta, arrays):
+        self.link = meta["link"]
+        self.sigmoid = meta["sigmoid"]
+        self.trees_per_iteration = meta["trees_per_iteration"]
+        self.average_output = meta["average_output"]
+        self.feature = arrays["tree_feature"].astype(np.int32)
+        self.threshold = arrays["tree_threshold"]
+        self.left = arrays["tree_left"].astype(np.int32)
+        self.value = arrays["tree_value"]
+        self.default_left = arrays["tree_default_left"]
+        self.missing = arrays["tree_missing"]
+        self.zero_missing = bool((self.missing == MISSING_ZERO).any())
+        order = np.argsort(-arrays["tree_depth"], kind="stable")
+        self.roots = arrays["tree_roots"][order].astype(np.int32)
+        # Trees still being walked at each level, and which class each tree scores
+        self.walking = [int((arrays["tree_depth"] > level).sum()) for level in range(int(arrays["tree_depth"].max()))]
+        self.tree_classes = np.eye(self.trees_per_iteration)[order % self.trees_per_iteration]
+        self.model_string = str(arrays["booster"]) if "booster" in arrays else None
+        self._booster = None
+
+    def _raw_scores(self, X):
+        offsets = (np.arange(len(X), dtype=np.int32) * np.int32(X.shape[1]))[:, None]
+        X = X.ravel()
+        # Missing value rules only matter for NaN features or splits that treat zero as missing
+        check_missing = self.zero_missing or bool(np.isnan(X).any())
+        nodes = np.repeat(self.roots[None, :], len(offsets), axis=0)
+        for walking in self.walking:
+            active = nodes[:, :walking]
+            values = X[offsets + self.feature[active]]
+            goes_right = values > self.threshold[active]
+            if check_missing:
+                missing = self.missing[active]
+                nan = np.isnan(values)
+                values = np.where(nan & (missing != MISSING_NAN), 0.0, values)
+                use_default = (((missing == MISSING_ZERO) & (np.abs(values) <= _ZERO_THRESHOLD))
+                               | ((missing == MISSING_NAN) & nan))
+                goes_right = np.where(use_default, ~self.default_left[active], values > self.threshold[active])
+            nodes[:, :walking] = self.left[active] + goes_right
+        scores = self.value[nodes] @ self.tree_classes
+        if self.average_output:
+            scores /= len(self.roots) // self.trees_per_iteration
+        return scores
+
+    def evaluate(self, features):
+        """Raw scores of every class, from the NumPy tree evaluator"""
+        blocks = []
+        for start in range(0, features.shape[0], TREE_BLOCK_ROWS):
+            block = features[start:start + TREE_BLOCK_ROWS]
+            block = block.toarray() if sp.issparse(block) else np.array(block, dtype=np.float64)
+            blocks.append(self._raw_scores(block))
+        return np.concatenate(blocks) if blocks else np.zeros((0, self.trees_per_iteration))
+
+    def _native(self):
+        if self._booster is None and self.model_string is not None:
+            try:
+                import lightgbm
+            except ImportError:
+                self.model_string = None
+                return None
+            self._booster = lightgbm.Booster(model_str=self.model_string)
+        return self._booster
+
+    def predict_proba(self, features):
+        booster = self._native() if features.shape[0] >= NATIVE_MIN_ROWS else None
+        if booster is None:
+            scores = self.evaluate(features)
+        else:
+            scores = booster.predict(features, raw_score=True).reshape(features.shape[0], self.trees_per_iteration)
+        return _probabilities(self.sigmoid * scores, self.link)
+
+
+class _Linear:
+    """A linear classifier's coefficients and link function"""
+
+    def __init__(self, meta, arrays):
+        self.link = meta["link"]
+        self.coef = arrays["coef"]
+        self.intercept = arrays["intercept"]
+
+    def predict_proba(self, features):
+        return _probabilities(np.asarray(features @ self.coef.T) + self.intercept, self.link)
+
+
+class CompiledModel:
+    """A G/L pipeline exported by ``export``, scored without scikit-learn.
+
+    Stands in for the pickled pipeline: ``predict_proba`` and ``classes_``
+    behave the same, ``transform`` and ``classifier`` are the pipeline's
+    preprocessing and classifier steps, and ``label_encoder.classes_`` holds
+    the label encoder's classes.
+    """
+
+    def __init__(self, meta, arrays):
+        self.text_column = meta["text_column"]
+        self.numeric_columns = meta["numeric_columns"]
+        self.text_first = meta["text_first"]
+        self.vectorizer = _Vectorizer(meta["vectorizer"], arrays["idf"] if "idf" in arrays else None)
+        self.statistics = arrays["statistics"]
+        self.classifier = (_Trees if meta["classifier"]["kind"] == "trees" else _Linear)(meta["classifier"], arrays)
+        self.classes_ = arrays["classes"]
+        self.label_encoder = SimpleNamespace(classes_=arrays["labels"])
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files}
+        return cls(json.loads(str(arrays.pop("meta"))), arrays)
+
+    def transform(self, X):
+        """Features of a frame with the pipeline's input columns, as a CSR matrix"""
+        text = self.vectorizer.transform(X[self.text_column].tolist())
+        numeric = np.asarray(X[self.numeric_columns], dtype=np.float64)
+        numeric = np.where(np.isnan(numeric), self.statistics, numeric)
+        parts = [text, sp.csr_matrix(numeric)]
+        return sp.hstack(parts if self.text_first else parts[::-1], format="csr")
+
+    def predict_proba(self, X):
+        return self.classifier.predict_proba(self.transform(X))
+
+
+def _export_vectorizer(vectorizer):
+    if type(vectorizer).__name__ != "TfidfVectorizer":
+        raise ValueError(f"Cannot export text transformer {type(vectorizer).__name__}")
+    if (vectorizer.analyzer != "word" or vectorizer.tokenizer is not None or vectorizer.preprocessor is not None
+            or vectorizer.input != "content" or vectorizer.strip_accents not in (None, "ascii", "unicode")
+            or vectorizer.norm not in (None, "l1", "l2") or re.compile(vectorizer.token_pattern).groups > 1):
+        raise ValueError("Cannot export a TfidfVectorizer with custom analysis or normalization")
+    vocabulary = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+    stop_words = vectorizer.get_stop_words()
+    meta = {
+        "vocabulary": vocabulary,
+        "stop_words": sorted(stop_words) if stop_words else None,
+        "token_pattern": vectorizer.token_pattern,
+        "lowercase": vectorizer.lowercase,
+        "strip_accents": vectorizer.strip_accents,
+        "ngram_range": list(vectorizer.ngram_range),
+        "binary": vectorizer.binary,
+        "sublinear_tf": vectorizer.sublinear_tf,
+        "norm": vectorizer.norm
+    }
+    return meta, ({"idf": np.asarray(vectorizer.idf_, dtype=np.float64)} if vectorizer.use_idf else {})
+
+
+def _export_preprocessor(preprocessor):
+    """Column layout, vectorizer and imputer statistics of the fitted ColumnTransformer"""
+    if type(preprocessor).__name__ != "ColumnTransformer" or preprocessor.transformer_weights:
+        raise ValueError(f"Cannot export preprocessor {type(preprocessor).__name__}")
+    steps = [(transformer, columns) for _, transformer, columns in preprocessor.transformers_
+             if not (isinstance(transformer, str) and transformer == "drop")]
+    names = [type(transformer).__name__ for transformer, _ in steps]
+    if sorted(names) != ["SimpleImputer", "TfidfVectorizer"]:
+        raise ValueError(f"Cannot export preprocessor steps {names}")
+    (vectorizer, text_column), = [step for step in steps if type(step[0]).__name__ == "TfidfVectorizer"]
+    (imputer, numeric_columns), = [step for step in steps if type(step[0]).__name__ == "SimpleImputer"]
+    if not isinstance(text_column, str) or isinstance(numeric_columns, str):
+        raise ValueError("Cannot export column selections other than a text column and a list of numeric columns")
+    missing_values = imputer.missing_values
+    statistics = np.asarray(imputer.statistics_, dtype=np.float64)
+    if (imputer.add_indicator or not isinstance(missing_values, float) or not np.isnan(missing_values)
+            or np.isnan(statistics).any() or len(statistics) != len(numeric_columns)):
+        raise ValueError("Cannot export a SimpleImputer that does not fill NaN with one value per column")
+    vectorizer_meta, arrays = _export_vectorizer(vectorizer)
+    meta = {
+        "text_column": text_column,
+        "numeric_columns": list(numeric_columns),
+        "text_first": names[0] == "TfidfVectorizer",
+        "vectorizer": vectorizer_meta
+    }
+    return meta, {**arrays, "statistics": statistics}
+
+
+def _export_trees(classifier):
+    dump = classifier.booster_.dump_model()
+    objective = dump["objective"].split()
+    params = dict(param.split(":", 1) for param in objective[1:] if ":" in param)
+    if objective[0] not in ("binary", "multiclass"):
+        raise ValueError(f"Cannot export LightGBM objective {dump['objective']}")
+
+    nodes = {name: [] for name in ("feature", "threshold", "left", "value", "default_left", "missing")}
+
+    def allocate(count):
+        index = len(nodes["feature"])
+        for values in nodes.values():
+            values.extend([0] * count)
+        return index
+
+    def fill(node, index, depth):
+        """Store ``node`` at ``index``; returns the depth of its deepest leaf"""
+        if "split_index" not in node:
+            nodes["left"][index], nodes["threshold"][index] = index, np.inf
+            nodes["value"][index] = node["leaf_value"]
+            return depth
+        if node["decision_type"] != "<=":
+            raise ValueError("Cannot export categorical LightGBM splits")
+        children = allocate(2)
+        nodes["feature"][index] = node["split_feature"]
+        nodes["threshold"][index] = node["threshold"]
+        nodes["left"][index] = children
+        nodes["default_left"][index] = node["default_left"]
+        nodes["missing"][index] = _MISSING_TYPES[node["missing_type"]]
+        return max(fill(node["left_child"], children, depth + 1), fill(node["right_child"], children + 1, depth + 1))
+
+    roots, depths = [], []
+    for tree in dump["tree_info"]:
+        if tree.get("is_linear"):
+            raise ValueError("Cannot export linear LightGBM trees")
+        roots.append(allocate(1))
+        depths.append(fill(tree["tree_structure"], roots[-1], 0))
+    meta = {
+        "kind": "trees",
+        "link": "binary" if objective[0] == "binary" else "softmax",
+        "sigmoid": float(params.get("sigmoid", 1.0)) if objective[0] == "binary" else 1.0,
+        "trees_per_iteration": dump["num_tree_per_iteration"],
+        "average_output": bool(dump.get("average_output"))
+    }
+    arrays = {
+        "tree_roots": np.asarray(roots, dtype=np.int64),
+        "tree_depth": np.asarray(depths, dtype=np.int64),
+        "tree_feature": np.asarray(nodes["feature"], dtype=np.int64),
+        "tree_threshold": np.asarray(nodes["threshold"], dtype=np.float64),
+        "tree_left": np.asarray(nodes["left"], dtype=np.int64),
+        "tree_value": np.asarray(nodes["value"], dtype=np.float64),
+        "tree_default_left": np.asarray(nodes["default_left"], dtype=bool),
+        "tree_missing": np.asarray(nodes["missing"], dtype=np.int8),
+        "booster": np.array(classifier.booster_.model_to_string())
+    }
+    return meta, arrays
+
+
+def _export_linear(classifier):
+    coef = np.asarray(classifier.coef_, dtype=np.float64)
+    multi_class = getattr(classifier, "multi_class", "auto")
+    if coef.shape[0] == 1:
+        link = "binary"
+    elif multi_class == "ovr" or (multi_class != "multinomial" and getattr(classifier, "solver", None) == "liblinear"):
+        link = "ovr"
+    else:
+        link = "softmax"
+    return {"kind": "linear", "link": link}, {"coef": coef, "intercept": np.asarray(classifier.intercept_,
+                                                                                   dtype=np.float64)}
+
+
+def _probe_rows(compiled, rows=200, seed=0):
+    """Rows made of vocabulary terms, punctuation and missing amounts, to compare the two scorers on"""
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    words = sorted({word for term in compiled.vectorizer.vocabulary for word in term.split()}) or ["expense"]
+    words += ["THE", "and", "Café", "#1234", "-", ""]
+    texts = [" ".join(rng.choice(words, size=rng.integers(0, 12))) for _ in range(rows)]
+    frame = pd.DataFrame({compiled.text_column: texts})
+    for column in compiled.numeric_columns:
+        frame[column] = np.where(rng.random(rows) < 0.1, np.nan, rng.gamma(2.0, 60.0, rows).round(2))
+    return frame
+
+
+def _plain_array(values):
+    """``values`` as an array np.load reads without pickle (labels as strings if they are objects)"""
+    values = np.asarray(values)
+    return values.astype(str) if values.dtype == object else values
+
+
+def _check_parity(compiled, model, sample):
+    for rows in [_probe_rows(compiled)] + ([] if sample is None else [sample]):
+        expected = model.predict_proba(rows)
+        scored = [compiled.predict_proba(rows)]
+        if isinstance(compiled.classifier, _Trees):
+            # Both tree scorers, whichever one predict_proba picked
+            scores = compiled.classifier.evaluate(compiled.transform(rows))
+            scored.append(_probabilities(compiled.classifier.sigmoid * scores, compiled.classifier.link))
+        difference = max(np.abs(proba - expected).max(initial=0.0) for proba in scored)
+        if not difference <= PARITY_TOLERANCE:
+            raise ValueError(f"Compiled model differs from the pipeline by {difference:.3g}")
+
+
+def export(model, label_encoder, path, sample=None):
+    """Save ``model`` (a fitted pipeline) and ``label_encoder`` as a compiled artifact at ``path``.
+
+    Raises ValueError if the pipeline has steps the compiled scorer does not
+    implement, or if it scores probe rows (and ``sample``, a frame of
+    pipeline input, if given) differently from the pipeline.
+    """
+    steps = getattr(model, "steps", None)
+    if not steps or len(steps) != 2:
+        raise ValueError("Only a (preprocessor, classifier) pipeline can be exported")
+    meta, arrays = _export_preprocessor(steps[0][1])
+    classifier = steps[1][1]
+    if hasattr(classifier, "booster_"):
+        meta["classifier"], classifier_arrays = _export_trees(classifier)
+    elif hasattr(classifier, "coef_") and hasattr(classifier, "predict_proba"):
+        meta["classifier"], classifier_arrays = _export_linear(classifier)
+    else:
+        raise ValueError(f"Cannot export classifier {type(classifier).__name__}")
+    arrays.update(classifier_arrays, classes=_plain_array(model.classes_),
+                  labels=_plain_array(label_encoder.classes_))
+
+    # Written aside, checked as loaded back and renamed, so a watcher never loads a partial file
+    with open(f"{path}.tmp", "wb") as f:
+        np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+    try:
+        _check_parity(CompiledModel.load(f"{path}.tmp"), model, sample)
+    except Exception:
+        os.remove(f"{path}.tmp")
+        raise
+    os.replace(f"{path}.tmp", path)
+    return path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        sys.exit("usage: python -m app.models.compiled MODEL.pkl ENCODER.pkl [OUTPUT.npz]")
+    import joblib
+    from app.models.model import compiled_path
+
+    output = sys.argv[3] if len(sys.argv) == 4 else compiled_path(sys.argv[1])
+    print(f"Exported {export(joblib.load(sys.argv[1]), joblib.load(sys.argv[2]), output)}")
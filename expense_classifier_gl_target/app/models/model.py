@@ -1,10 +1,238 @@
-import joblib
+import hashlib
+import logging
 import os
+import shutil
+import sys
+import threading
+import time
+from collections import namedtuple
 
-# Paths to the saved model and encoder
-MODEL_PATH = os.path.join(os.path.dirname(__file__), "../../models/best_gl_account_model.pkl")
-ENCODER_PATH = os.path.join(os.path.dirname(__file__), "../../models/label_encoder.pkl")
+MODELS_DIR = os.path.join(os.path.dirname(__file__), "../../models")
+MODEL_FILENAME = "best_gl_account_model.pkl"
+ENCODER_FILENAME = "label_encoder.pkl"
 
-# Load the model and encoder
-model = joblib.load(MODEL_PATH)
-label_encoder = joblib.load(ENCODER_PATH)
+# Versioned artifacts live in models/versions/<version>/; models/ACTIVE names the live one
+VERSIONS_DIR = os.path.join(MODELS_DIR, "versions")
+ACTIVE_FILE = os.path.join(MODELS_DIR, "ACTIVE")
+
+# Paths to the saved model and encoder when no versioned artifact is active
+MODEL_PATH = os.getenv("GL_MODEL_PATH", os.path.join(MODELS_DIR, MODEL_FILENAME))
+ENCODER_PATH = os.getenv("GL_ENCODER_PATH", os.path.join(MODELS_DIR, ENCODER_FILENAME))
+
+# Seconds between checks for a new active model (0 disables the watcher)
+WATCH_INTERVAL = float(os.getenv("GL_MODEL_WATCH_INTERVAL", "0"))
+
+# Serve the compiled artifact next to a model pickle when it is up to date (see app.models.compiled)
+USE_COMPILED = os.getenv("GL_USE_COMPILED_MODEL", "true").lower() == "true"
+
+logger = logging.getLogger(__name__)
+
+LoadedModel = namedtuple("LoadedModel", ["model", "label_encoder", "version"])
+
+# joblib, pandas and the compiled scorer (NumPy, SciPy) are imported when a
+# model is first loaded, not when the web process imports the registry
+
+
+def compiled_path(model_path):
+    """Where the compiled artifact of a model pickle is saved (see app.models.compiled)"""
+    return os.path.splitext(model_path)[0] + ".npz"
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+class ModelRegistry:
+    """Versioned G/L model artifacts with atomic hot-swap.
+
+    ``current()`` returns an immutable (model, label_encoder, version)
+    snapshot, loaded on first use rather than at import time. A request keeps
+    the snapshot it started with, so ``activate`` can swap in a new version
+    (loaded and warmed up first) without pausing or mixing models mid-file.
+    Artifacts are loaded with ``mmap_mode="r"`` so the numpy arrays of
+    uncompressed pickles stay in the page cache shared by every worker.
+    A compiled artifact (``app.models.compiled``) newer than the pickles is
+    served in their place, under the same version.
+    """
+
+    def __init__(self, versions_dir=VERSIONS_DIR, active_file=ACTIVE_FILE,
+                 model_path=MODEL_PATH, encoder_path=ENCODER_PATH, use_compiled=USE_COMPILED):
+        self.versions_dir = versions_dir
+        self.active_file = active_file
+        self.model_path = model_path
+        self.encoder_path = encoder_path
+        self.use_compiled = use_compiled
+        self._lock = threading.Lock()
+        self._loaded = None
+        self._watch_signature = None
+        self._watcher = None
+
+    def versions(self):
+        """Published versions, oldest first"""
+        if not os.path.isdir(self.versions_dir):
+            return []
+        return sorted(
+            (name for name in os.listdir(self.versions_dir)
+             if os.path.exists(os.path.join(self.versions_dir, name, MODEL_FILENAME))),
+            key=lambda name: os.path.getmtime(os.path.join(self.versions_dir, name))
+        )
+
+    def active_version(self):
+        """Version named in the ACTIVE pointer, or None for the unversioned model files"""
+        if os.path.exists(self.active_file):
+            with open(self.active_file, "r") as f:
+                version = f.read().strip()
+            return version or None
+        return None
+
+    def _artifact_paths(self, version):
+        if version is None:
+            return self.model_path, self.encoder_path
+        directory = os.path.join(self.versions_dir, version)
+        return os.path.join(directory, MODEL_FILENAME), os.path.join(directory, ENCODER_FILENAME)
+
+    def _compiled_is_current(self, model_path, encoder_path):
+        path = compiled_path(model_path)
+        return (self.use_compiled and os.path.exists(path)
+                and os.path.getmtime(path) >= max(os.path.getmtime(model_path), os.path.getmtime(encoder_path)))
+
+    def _load(self, version):
+        import joblib
+        from app.models.compiled import CompiledModel
+
+        model_path, encoder_path = self._artifact_paths(version)
+        if not os.path.exists(model_path) or not os.path.exists(encoder_path):
+            raise FileNotFoundError(f"Model artifacts not found for version {version or 'default'}")
+        version = version or _file_digest(model_path)
+        if self._compiled_is_current(model_path, encoder_path):
+            model = CompiledModel.load(compiled_path(model_path))
+            loaded = LoadedModel(model=model, label_encoder=model.label_encoder, version=version)
+        else:
+            loaded = LoadedModel(
+                model=joblib.load(model_path, mmap_mode="r"),
+                label_encoder=joblib.load(encoder_path, mmap_mode="r"),
+                version=version
+            )
+        warm_up(loaded)
+        return loaded
+
+    def current(self):
+        """The live model snapshot, loading the active version on first use"""
+        loaded = self._loaded
+        if loaded is None:
+            with self._lock:
+                if self._loaded is None:
+                    self._watch_signature = self._signature()
+                    self._loaded = self._load(self.active_version())
+                loaded = self._loaded
+        return loaded
+
+    def activate(self, version=None):
+        """Load and warm up ``version`` (default: the ACTIVE pointer), then swap it in.
+
+        Naming a version also moves the ACTIVE pointer, so other workers
+        watching the pointer follow. The previous model keeps serving if the
+        new one fails to load.
+        """
+        if version is not None and version not in self.versions():
+            raise ValueError(f"Unknown model version: {version}")
+        loaded = self._load(version if version is not None else self.active_version())
+        with self._lock:
+            if version is not None:
+                _write_atomic(self.active_file, version)
+            self._watch_signature = self._signature()
+            self._loaded = loaded
+        return loaded.version
+
+    def publish(self, model_path, encoder_path, version=None, activate=False):
+        """Copy a trained model/encoder pair into a new version directory.
+
+        The artifacts are re-dumped uncompressed so they can be memory-mapped,
+        and exported as a compiled artifact when the pipeline allows it.
+        """
+        import joblib
+        from app.models.compiled import export
+
+        version = version or time.strftime("%Y%m%d%H%M%S")
+        target = os.path.join(self.versions_dir, version)
+        if os.path.exists(target):
+            raise ValueError(f"Model version already exists: {version}")
+        staging = f"{target}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        model, label_encoder = joblib.load(model_path), joblib.load(encoder_path)
+        joblib.dump(model, os.path.join(staging, MODEL_FILENAME))
+        joblib.dump(label_encoder, os.path.join(staging, ENCODER_FILENAME))
+        try:
+            export(model, label_encoder, compiled_path(os.path.join(staging, MODEL_FILENAME)))
+        except ValueError as e:
+            logger.warning(f"Model version {version} is served from its pickle: {e}")
+        os.replace(staging, target)
+        if activate:
+            self.activate(version)
+        return version
+
+    def _signature(self):
+        # Changes when the pointer moves or the unversioned model files are replaced or exported
+        version = self.active_version()
+        model_path, encoder_path = self._artifact_paths(version)
+        paths = (self.active_file, model_path, encoder_path, compiled_path(model_path))
+        return tuple(os.path.getmtime(path) if os.path.exists(path) else None for path in paths)
+
+    def check_for_update(self):
+        """Reload if the ACTIVE pointer or model files changed since the last load"""
+        if self._loaded is None or self._signature() == self._watch_signature:
+            return False
+        try:
+            self.activate()
+            logger.info(f"Reloaded G/L model version {self._loaded.version}")
+            return True
+        except Exception as e:
+            # Keep serving the current model; the next change triggers another attempt
+            self._watch_signature = self._signature()
+            logger.error(f"Failed to reload G/L model: {e}")
+            return False
+
+    def watch(self, interval=WATCH_INTERVAL):
+        """Poll for a new active model every ``interval`` seconds on a daemon thread"""
+        if interval <= 0 or self._watcher is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                self.check_for_update()
+
+        self._watcher = threading.Thread(target=run, daemon=True)
+        self._watcher.start()
+
+
+def _write_atomic(path, content):
+    with open(f"{path}.tmp", "w") as f:
+        f.write(content)
+    os.replace(f"{path}.tmp", path)
+
+
+def warm_up(loaded):
+    """Run one dummy row through the pipeline so the first request is not the slow one"""
+    import pandas as pd
+
+    loaded.model.predict_proba(pd.DataFrame({"combined_text": ["warm up"], "Amount": [0.0]}))
+
+
+# Global model registry instance
+registry = ModelRegistry()
+
+
+if __name__ == "__main__":
+    # Publish a trained model: python -m app.models.model MODEL.pkl ENCODER.pkl [VERSION] [--activate]
+    args = [arg for arg in sys.argv[1:] if arg != "--activate"]
+    if len(args) < 2:
+        sys.exit("usage: python -m app.models.model MODEL.pkl ENCODER.pkl [VERSION] [--activate]")
+    published = registry.publish(args[0], args[1], args[2] if len(args) > 2 else None,
+                                 activate="--activate" in sys.argv)
+    print(f"Published G/L model version {published}")
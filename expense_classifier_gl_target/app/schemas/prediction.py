@@ -0,0 +1,26 @@
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel
+
+class RankedAccount(BaseModel):
+    gl_account_number: str
+    score: float
+
+class TopKPrediction(BaseModel):
+    row: int
+    predictions: List[RankedAccount]
+    margin: float
+    model_version: str
+
+class ModelStatus(BaseModel):
+    active_version: str
+    versions: List[str]
+
+class ExpenseBatch(BaseModel):
+    expenses: List[Dict[str, Any]]
+
+class ExpensePrediction(BaseModel):
+    row: int
+    gl_account_number: str
+    confidence_score: float
+    alternative_gl_account_number: str
+    model_version: str
@@ -0,0 +1,204 @@
+"""Fitted pipeline features (TF-IDF text features and the imputed Amount) of expense rows seen before.
+
+Rows are keyed by a 64-bit hash of their normalized text columns and Amount,
+per model version. Features are stored as immutable CSR segments,
+FEATURE_CACHE_DIR/<model version>/<segment>/{keys,indptr,indices,data}.npy
+with the keys sorted, and memory-mapped, so every inference worker reads
+them through the shared page cache and a row vectorized by any process is
+not vectorized again. Once a version has more than FEATURE_CACHE_MAX_SEGMENTS
+segments they are merged into one holding the newest FEATURE_CACHE_MAX_ROWS
+rows.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+logger = logging.getLogger(__name__)
+
+FEATURE_CACHE_ENABLED = os.getenv("FEATURE_CACHE_ENABLED", "true").lower() == "true"
+FEATURE_CACHE_DIR = os.getenv("FEATURE_CACHE_DIR", os.path.join(os.path.dirname(__file__), "../../feature_cache"))
+FEATURE_CACHE_MAX_ROWS = int(os.getenv("FEATURE_CACHE_MAX_ROWS", "1000000"))
+FEATURE_CACHE_MAX_SEGMENTS = int(os.getenv("FEATURE_CACHE_MAX_SEGMENTS", "16"))
+# How often a process looks for segments written by the others
+FEATURE_CACHE_RESCAN_SECONDS = float(os.getenv("FEATURE_CACHE_RESCAN_SECONDS", "5"))
+# Directories of other model versions are removed once unused this long
+STALE_VERSION_SECONDS = 24 * 3600
+
+def row_keys(df: pd.DataFrame, text_columns: list) -> np.ndarray:
+    """64-bit hash of each row's text columns (normalized as in combine_text) and Amount"""
+    normalized = pd.DataFrame({column: df[column].fillna("").astype(str) for column in text_columns})
+    normalized["Amount"] = df["Amount"].astype("float64")
+    return pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+
+class _Segment:
+    """One immutable, memory-mapped CSR segment"""
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        load = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        self.path = path
+        self.dense = meta["dense"]
+        self.keys = load("keys")
+        self.matrix = sp.csr_matrix((load("data"), load("indices"), load("indptr")),
+                                    shape=(meta["rows"], meta["features"]), copy=False)
+
+    def find(self, keys):
+        """Positions of ``keys`` in this segment and a mask of the keys it holds"""
+        if not len(self.keys):
+            return np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return positions, self.keys[positions] == keys
+
+class FeatureCache:
+    """Pipeline features of previously scored rows, shared by every process through FEATURE_CACHE_DIR"""
+
+    def __init__(self, directory=FEATURE_CACHE_DIR, enabled=FEATURE_CACHE_ENABLED, max_rows=FEATURE_CACHE_MAX_ROWS,
+                 max_segments=FEATURE_CACHE_MAX_SEGMENTS, rescan_seconds=FEATURE_CACHE_RESCAN_SECONDS):
+        self.directory = directory
+        self.enabled = enabled
+        self.max_rows = max_rows
+        self.max_segments = max_segments
+        self.rescan_seconds = rescan_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._segments = {}  # version -> (segments oldest first, monotonic time of the last scan)
+
+    def _version_dir(self, version):
+        return os.path.join(self.directory, version)
+
+    def segments(self, version, rescan=False):
+        """Segments of ``version``, oldest first, rescanning the directory every ``rescan_seconds``"""
+        with self._lock:
+            known, scanned = self._segments.get(version, ([], None))
+            if not rescan and scanned is not None and time.monotonic() - scanned < self.rescan_seconds:
+                return known
+            known = {segment.path: segment for segment in known}
+            root = self._version_dir(version)
+            segments = []
+            # Segment names start with their creation time, so they sort oldest first
+            for name in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+                path = os.path.join(root, name)
+                if name.startswith(".") or name.endswith(".tmp"):
+                    continue
+                try:
+                    segments.append(known.get(path) or _Segment(path))
+                except (FileNotFoundError, ValueError) as e:
+                    # Merged away by another process since the listing
+                    logger.debug(f"Skipping feature cache segment {path}: {e}")
+            self._segments[version] = (segments, time.monotonic())
+            return segments
+
+    def features(self, version, df, text_columns, vectorize):
+        """Features of every row of ``df``, in row order.
+
+        Rows found in the cache are read back; the rest go through
+        ``vectorize(rows)`` and are stored for next time. The result is dense
+        if ``vectorize`` returns dense arrays (as the classifier expects).
+        """
+        if not self.enabled or not len(df):
+            return vectorize(df)
+        try:
+            keys = row_keys(df, text_columns)
+        except (TypeError, ValueError):
+            # e.g. a non-numeric Amount; the pipeline reports it
+            return vectorize(df)
+
+        found = np.zeros(len(keys), dtype=bool)
+        parts, dense = [], None
+        for segment in reversed(self.segments(version)):
+            pending = np.flatnonzero(~found)
+            if not len(pending):
+                break
+            positions, hit = segment.find(keys[pending])
+            if hit.any():
+                parts.append((pending[hit], segment.matrix[positions[hit]]))
+                found[pending[hit]] = True
+                dense = segment.dense
+
+        missing = np.flatnonzero(~found)
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if len(missing):
+            # Repeated rows are vectorized once
+            unique_keys, first, inverse = np.unique(keys[missing], return_index=True, return_inverse=True)
+            computed = vectorize(df.iloc[missing[first]])
+            dense = not sp.issparse(computed)
+            computed = sp.csr_matrix(computed)
+            parts.append((missing, computed[inverse]))
+            try:
+                self.store(version, unique_keys, computed, dense)
+            except OSError as e:
+                logger.warning(f"Could not store features in {self.directory}: {e}")
+
+        rows = np.concatenate([positions for positions, _ in parts])
+        matrix = sp.vstack([matrix for _, matrix in parts], format="csr")[np.argsort(rows)]
+        return matrix.toarray() if dense else matrix
+
+    def store(self, version, keys, matrix, dense):
+        """Write the features of distinct ``keys`` as a new segment, merging segments once there are too many"""
+        root = self._version_dir(version)
+        os.makedirs(root, exist_ok=True)
+        self._write(root, keys, matrix, dense)
+        if len(self.segments(version, rescan=True)) > self.max_segments:
+            self.compact(version)
+
+    def _write(self, root, keys, matrix, dense):
+        order = np.argsort(keys, kind="stable")
+        keys, matrix = keys[order], sp.csr_matrix(matrix[order])
+        name = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        staging = os.path.join(root, f"{name}.tmp")
+        os.makedirs(staging)
+        for array_name, array in (("keys", keys), ("indptr", matrix.indptr), ("indices", matrix.indices),
+                                  ("data", matrix.data)):
+            np.save(os.path.join(staging, f"{array_name}.npy"), array)
+        with open(os.path.join(staging, "meta.json"), "w") as f:
+            json.dump({"rows": matrix.shape[0], "features": matrix.shape[1], "dense": dense}, f)
+        os.replace(staging, os.path.join(root, name))
+
+    def compact(self, version):
+        """Merge the segments of ``version`` into one with the newest ``max_rows`` distinct rows"""
+        root = self._version_dir(version)
+        marker = os.path.join(root, ".compacting")
+        try:
+            fd = os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            # Another process is merging; a marker left by a crash expires
+            if time.time() - os.path.getmtime(marker) > 600:
+                os.remove(marker)
+            return
+        os.close(fd)
+        try:
+            segments = self.segments(version, rescan=True)[::-1]  # newest first
+            keys = np.concatenate([segment.keys for segment in segments])
+            matrix = sp.vstack([segment.matrix for segment in segments], format="csr")
+            # First occurrence = newest copy of each row; keep the newest max_rows of them
+            _, first = np.unique(keys, return_index=True)
+            first = np.sort(first)[:self.max_rows]
+            self._write(root, keys[first], matrix[first], any(segment.dense for segment in segments))
+            for segment in segments:
+                shutil.rmtree(segment.path, ignore_errors=True)
+            self._remove_stale_versions(version)
+        finally:
+            os.remove(marker)
+        merged = self.segments(version, rescan=True)
+        logger.info(f"Merged {len(segments)} feature cache segments of version {version} "
+                    f"into {len(merged)} ({len(first)} rows)")
+
+    def _remove_stale_versions(self, version):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name != version and os.path.isdir(path) and time.time() - os.path.getmtime(path) > STALE_VERSION_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+
+# Global feature cache instance
+feature_cache = FeatureCache()
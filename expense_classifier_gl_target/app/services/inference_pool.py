@@ -0,0 +1,137 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+
+from app.models.model import registry
+
+# Worker processes running inference, and how many requests may wait for them
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(min(4, os.cpu_count() or 1))))
+INFERENCE_MAX_PENDING = int(os.getenv("INFERENCE_MAX_PENDING", str(INFERENCE_WORKERS * 4)))
+RETRY_AFTER_SECONDS = int(os.getenv("INFERENCE_RETRY_AFTER", "5"))
+
+# Workers are started from a fork server rather than forked from the (threaded)
+# web process, where a fork can copy a lock held by another thread
+START_METHOD = os.getenv(
+    "INFERENCE_START_METHOD",
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+
+class PoolOverloaded(Exception):
+    """The request cannot be queued; ``status_code`` is what the client should see"""
+    status_code = 503
+
+    def __init__(self, message, retry_after=RETRY_AFTER_SECONDS):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PoolBusy(PoolOverloaded):
+    status_code = 429
+
+
+def _init_worker():
+    # Load and warm up the model once per worker, not once per request
+    registry.current()
+
+
+def _call(fn, *args):
+    # Follow model hot-swaps made by the admin endpoint in another process
+    registry.check_for_update()
+    return fn(*args)
+
+
+class InferencePool:
+    """Process pool for CPU-bound inference, with bounded admission.
+
+    Request handlers ``reserve()`` a slot before doing any work; once
+    ``max_pending`` requests are queued or running, further ones are
+    rejected with ``PoolBusy`` instead of piling up, so latency stays bounded
+    under a burst of uploads. The event loop only awaits the worker's future.
+    """
+
+    def __init__(self, workers=INFERENCE_WORKERS, max_pending=INFERENCE_MAX_PENDING, start_method=START_METHOD):
+        self.workers = max(1, workers)
+        self.max_pending = max(self.workers, max_pending)
+        self.start_method = start_method
+        self.pending = 0
+        self.generation = 0  # bumped each time the executor is replaced
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context(self.start_method)
+                if self.start_method == "forkserver":
+                    # Import the inference stack once in the server instead of in every worker
+                    context.set_forkserver_preload(["app.services.prediction"])
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=context, initializer=_init_worker
+                )
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def warm_up(self):
+        """Start every worker now rather than on the first requests; returns futures
+        that complete once each worker has loaded the model"""
+        with self._lock:
+            executor = self._executor
+        if executor is None:
+            raise PoolOverloaded("Inference workers are not running")
+        # Workers are started on demand, one per submission that finds none idle
+        return [executor.submit(_call, os.getpid) for _ in range(self.workers)]
+
+    def _restart(self, generation):
+        # Concurrent requests all see the same broken pool; only the first replaces it
+        with self._lock:
+            if generation != self.generation:
+                return
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            self.generation += 1
+        self.start()
+
+    @asynccontextmanager
+    async def reserve(self):
+        """Hold one of the ``max_pending`` slots for the duration of a request"""
+        if self._executor is None:
+            raise PoolOverloaded("Inference workers are not running")
+        if self.pending >= self.max_pending:
+            raise PoolBusy(f"Server busy: {self.pending} requests already queued")
+        # Only touched from the event loop thread, so no lock is needed
+        self.pending += 1
+        try:
+            yield
+        finally:
+            self.pending -= 1
+
+    async def run(self, fn, *args):
+        """Run ``fn(*args)`` in a worker process and await its result"""
+        with self._lock:
+            executor, generation = self._executor, self.generation
+        if executor is None:
+            raise PoolOverloaded("Inference workers are not running")
+        try:
+            return await asyncio.wrap_future(executor.submit(_call, fn, *args))
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); replace the pool for later requests
+            self._restart(generation)
+            raise PoolOverloaded("Inference worker crashed, please retry")
+
+    def stats(self):
+        return {"workers": self.workers, "pending": self.pending, "max_pending": self.max_pending,
+                "generation": self.generation}
+
+
+# Global inference pool instance
+inference_pool = InferencePool()
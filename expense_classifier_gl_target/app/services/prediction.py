@@ -1,57 +1,162 @@
 import pandas as pd
 import numpy as np
-from app.models.model import model, label_encoder
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.compose import ColumnTransformer
-from sklearn.impute import SimpleImputer
-from sklearn.pipeline import Pipeline
+from app.models.compiled import CompiledModel
+from app.models.model import registry
+from app.services.feature_cache import feature_cache
+from app.services.file_service import iter_file_chunks, read_frame_bytes, StreamingOutput
 
-# Define text columns and preprocessor
+# Define text columns
 text_columns = ["Description", "Extended Details", "Appears On Your Statement As", "Address", "City/State", "Country", "CC Name"]
-preprocessor = ColumnTransformer(
-    transformers=[
-        ("text", TfidfVectorizer(max_features=100, stop_words="english"), "combined_text"),
-        ("num", SimpleImputer(strategy="median"), ["Amount"])
-    ]
-)
 
-def predict_gl_account(input_file_path: str, output_file_path: str):
-    # Load new data
-    new_df = pd.read_excel(input_file_path)
+def combine_text(df: pd.DataFrame) -> pd.Series:
+    """Join the text columns with spaces, column-wise instead of row by row"""
+    columns = [df[col].fillna("").astype(str) for col in text_columns]
+    return columns[0].str.cat(columns[1:], sep=" ")
+
+def top_k(proba: np.ndarray, k: int):
+    """Column indices and probabilities of the k most likely classes, best first.
+
+    Uses argpartition so only the k selected columns are sorted.
+    """
+    k = min(k, proba.shape[1])
+    indices = np.argpartition(proba, -k, axis=1)[:, -k:]
+    scores = np.take_along_axis(proba, indices, axis=1)
+    order = np.argsort(-scores, axis=1)
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+def model_input(new_df: pd.DataFrame) -> pd.DataFrame:
+    """The columns the pipeline was trained on"""
+    return pd.DataFrame({"combined_text": combine_text(new_df), "Amount": new_df["Amount"]})
 
+def predict_proba(new_df: pd.DataFrame, loaded=None) -> np.ndarray:
+    """Validate the input columns and return class probabilities for every row.
+
+    The pipeline runs in two parts: ``model[:-1]`` turns rows into features,
+    which the feature cache keeps for rows it has seen before, and
+    ``model[-1]`` (the classifier) scores them. A compiled model splits the
+    same way into ``transform`` and ``classifier``.
+    """
+    loaded = loaded or registry.current()
     # Check if required columns exist
     required_columns = text_columns + ["Amount"]
     missing_columns = [col for col in required_columns if col not in new_df.columns]
     if missing_columns:
         raise ValueError(f"Missing columns in input data: {missing_columns}")
 
-    # Preprocess new data
-    new_df["combined_text"] = new_df[text_columns].fillna("").agg(" ".join, axis=1)
-    X_new = new_df[["combined_text", "Amount"]]
+    if isinstance(loaded.model, CompiledModel):
+        preprocess, classifier = loaded.model, loaded.model.classifier
+    elif len(getattr(loaded.model, "steps", ())) >= 2:
+        preprocess, classifier = loaded.model[:-1], loaded.model[-1]
+    else:
+        return loaded.model.predict_proba(model_input(new_df))
+    features = feature_cache.features(loaded.version, new_df, text_columns,
+                                      lambda rows: preprocess.transform(model_input(rows)))
+    return classifier.predict_proba(features)
 
-    # Predict G/L Account No
-    y_new_encoded = model.predict(X_new)
-    y_new_proba = model.predict_proba(X_new)
+def class_labels(loaded) -> np.ndarray:
+    """G/L account for each column of predict_proba"""
+    return loaded.label_encoder.classes_[loaded.model.classes_]
 
-    # Get top 2 predictions and their probabilities
-    top2_indices = np.argsort(y_new_proba, axis=1)[:, -2:]
-    top2_proba = np.take_along_axis(y_new_proba, top2_indices, axis=1)
+def predict_top_k(new_df: pd.DataFrame, k: int = 3, loaded=None) -> list:
+    """Top-k G/L accounts with scores, plus the top-1/top-2 margin, for every row"""
+    if k < 1:
+        raise ValueError("k must be at least 1")
+    loaded = loaded or registry.current()
+    # Rank at least two classes so the margin means the same thing for every k
+    indices, scores = top_k(predict_proba(new_df, loaded), max(k, 2))
+    margins = scores[:, 0] - scores[:, 1] if scores.shape[1] > 1 else scores[:, 0]
+    indices, scores = indices[:, :k], scores[:, :k]
+    labels = class_labels(loaded)[indices]
+    return [
+        {
+            "row": row,
+            "predictions": [
+                {"gl_account_number": _label_str(label), "score": round(float(score), 4)}
+                for label, score in zip(labels[row], scores[row])
+            ],
+            "margin": round(float(margins[row]), 4),
+            "model_version": loaded.version
+        }
+        for row in range(len(new_df))
+    ]
+
+def predict_top_k_file(input_file_path: str, k: int = 3) -> list:
+    """predict_top_k over every chunk of a file, numbering rows across chunks"""
+    loaded = registry.current()
+    results = []
+    for chunk in iter_file_chunks(input_file_path):
+        for result in predict_top_k(chunk, k, loaded):
+            result["row"] += chunk.index[0]
+            results.append(result)
+    return results
+
+def _label_str(label) -> str:
+    # G/L accounts are stored as floats by the label encoder (e.g. 61215.0)
+    if isinstance(label, (float, np.floating)) and float(label).is_integer():
+        return str(int(label))
+    return str(label)
 
-    # Inverse transform each column of top2_indices separately
-    top2_labels = np.empty(top2_indices.shape, dtype=object)
-    for i in range(top2_indices.shape[1]):
-        top2_labels[:, i] = label_encoder.inverse_transform(top2_indices[:, i])
+def predict_chunk(new_df: pd.DataFrame, loaded=None) -> pd.DataFrame:
+    # Run the pipeline once; the predicted class is the most probable one
+    loaded = loaded or registry.current()
+    y_new_proba = predict_proba(new_df, loaded)
+
+    # Get top 2 predictions and their probabilities
+    top2_indices, top2_proba = top_k(y_new_proba, 2)
+    top2_labels = class_labels(loaded)[top2_indices]
+    if top2_labels.shape[1] < 2:
+        top2_labels = np.column_stack([top2_labels, np.full(len(top2_labels), "", dtype=object)])
 
     # Add predictions to new DataFrame
-    new_df["Predicted GL Account No"] = label_encoder.inverse_transform(y_new_encoded)
-    new_df["Confidence Score"] = top2_proba[:, 1]
-    new_df["Alternative GL Account No"] = top2_labels[:, 0]
-    new_df["Reasoning"] = new_df.apply(
-        lambda row: f"Predicted as '{row['Predicted GL Account No']}' with {row['Confidence Score']:.2f} confidence. "
-                    f"Alternative: '{row['Alternative GL Account No']}'.",
-        axis=1
+    new_df["Predicted GL Account No"] = top2_labels[:, 0]
+    new_df["Confidence Score"] = top2_proba[:, 0]
+    new_df["Alternative GL Account No"] = top2_labels[:, 1]
+    new_df["Reasoning"] = (
+        "Predicted as '" + pd.Series(top2_labels[:, 0], index=new_df.index).astype(str)
+        + "' with " + pd.Series(np.char.mod("%.2f", top2_proba[:, 0]), index=new_df.index)
+        + " confidence. Alternative: '" + pd.Series(top2_labels[:, 1], index=new_df.index).astype(str) + "'."
     )
+    new_df["Model Version"] = loaded.version
+
+    return new_df
+
+def predict_frame(new_df: pd.DataFrame, loaded=None) -> list:
+    """Predicted and alternative G/L account for every row, as JSON-ready dicts"""
+    if new_df.empty:
+        return []
+    loaded = loaded or registry.current()
+    indices, scores = top_k(predict_proba(new_df, loaded), 2)
+    labels = class_labels(loaded)[indices]
+    return [
+        {
+            "row": row,
+            "gl_account_number": _label_str(labels[row, 0]),
+            "confidence_score": round(float(scores[row, 0]), 4),
+            "alternative_gl_account_number": _label_str(labels[row, 1]) if labels.shape[1] > 1 else "",
+            "model_version": loaded.version
+        }
+        for row in range(len(new_df))
+    ]
+
+def predict_records(records: list) -> list:
+    """predict_frame over a list of expense dicts"""
+    return predict_frame(pd.DataFrame.from_records(records))
+
+def predict_bytes(content: bytes, extension: str) -> list:
+    """predict_frame over an upload held in memory"""
+    return predict_frame(read_frame_bytes(content, extension))
+
+def predict_gl_account(input_file_path: str, output_file_path: str):
+    # Stream new data in row chunks and write each chunk's results as soon as
+    # it is scored; the output format follows the output file extension.
+    # The whole file is scored by the model that was live when it started.
+    loaded = registry.current()
+    output = StreamingOutput(output_file_path)
+    for chunk in iter_file_chunks(input_file_path):
+        output.write(predict_chunk(chunk, loaded))
+    if not output.rows:
+        raise ValueError("Input file contains no rows")
 
     # Save results
-    new_df.to_excel(output_file_path, index=False)
+    output.close()
     return output_file_path
@@ -0,0 +1,80 @@
+"""Cold start and latency of the compiled scoring artifact against the pickled pipeline.
+
+Exports the model (app.models.compiled), then measures for each of the two:
+the time for a fresh interpreter to import the prediction module and load
+the model, single-row predict_proba latency, and predict_proba throughput
+on --rows rows. Without a shipped model a small one is trained on synthetic
+rows.
+
+    python -m benchmarks.bench_compiled --calls 500 --rows 20000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+import joblib
+
+from benchmarks.bench_prediction import ensure_model, MODELS_DIR, synthetic_expenses
+from benchmarks.harness import add_arguments, finish, measure, timed_calls
+
+COLD_START = """
+import time
+start = time.perf_counter()
+from app.services.prediction import registry
+registry.current()
+print(time.perf_counter() - start)
+"""
+
+
+def cold_start(work_dir, use_compiled, runs):
+    env = {**os.environ, "GL_USE_COMPILED_MODEL": str(use_compiled).lower(),
+           "FEATURE_CACHE_DIR": os.path.join(work_dir, "feature_cache")}
+    root = os.path.join(os.path.dirname(__file__), "..")
+    return [float(subprocess.run([sys.executable, "-c", COLD_START], cwd=root, env=env, check=True,
+                                 capture_output=True, text=True).stdout) for _ in range(runs)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=500, help="single-row predict_proba calls")
+    parser.add_argument("--rows", type=int, default=20_000, help="rows scored in one predict_proba call")
+    parser.add_argument("--cold-starts", type=int, default=3)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        ensure_model(work_dir)
+        from app.models.compiled import CompiledModel, export
+        from app.models.model import compiled_path
+        from app.services.prediction import model_input
+
+        model_path = os.getenv("GL_MODEL_PATH", os.path.join(MODELS_DIR, "best_gl_account_model.pkl"))
+        encoder_path = os.getenv("GL_ENCODER_PATH", os.path.join(MODELS_DIR, "label_encoder.pkl"))
+        # Exported next to a copy, so a shipped model directory is left alone
+        os.environ["GL_MODEL_PATH"] = os.path.join(work_dir, "bench_model.pkl")
+        os.environ["GL_ENCODER_PATH"] = os.path.join(work_dir, "bench_encoder.pkl")
+        pipeline, label_encoder = joblib.load(model_path), joblib.load(encoder_path)
+        joblib.dump(pipeline, os.environ["GL_MODEL_PATH"])
+        joblib.dump(label_encoder, os.environ["GL_ENCODER_PATH"])
+        path = export(pipeline, label_encoder, compiled_path(os.environ["GL_MODEL_PATH"]))
+        compiled = CompiledModel.load(path)
+
+        rows = model_input(synthetic_expenses(args.rows, seed=7))
+        single = [(rows.iloc[[i % len(rows)]],) for i in range(args.calls)]
+        results = {}
+        for name, model, use_compiled in (("pickle", pipeline, False), ("compiled", compiled, True)):
+            starts = cold_start(work_dir, use_compiled, args.cold_starts)
+            results[f"{name}_cold_start"] = measure(0, starts, sum(starts))
+            model.predict_proba(rows.iloc[:1])  # warm-up
+            latencies, seconds = timed_calls(model.predict_proba, single)
+            results[f"{name}_single_row"] = measure(args.calls, latencies, seconds)
+            latencies, seconds = timed_calls(model.predict_proba, [(rows,)])
+            results[f"{name}_batch"] = measure(args.rows, latencies, seconds)
+
+    return finish("bench_compiled", results, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""Throughput, latency and memory of gl_target inference, in process and over HTTP.
+
+Measures prediction.predict_gl_account on files of --file-rows rows, and
+/predict-json and /predict-ndjson under --concurrency concurrent clients
+against the app served by uvicorn. Results are stored as JSON; with
+--baseline the run fails if rows/s or p95/p99 latency regressed by more than
+--tolerance. Without a shipped model a small one is trained on synthetic rows.
+
+    python -m benchmarks.bench_load --requests 200 --concurrency 8 --baseline benchmarks/results/main.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from benchmarks.bench_prediction import ensure_model, synthetic_expenses
+from benchmarks.harness import add_arguments, finish, http_load, measure, peak_rss_mb, serve, timed_calls
+
+
+def bench_predict_gl_account(work_dir, file_rows, calls):
+    from app.services.prediction import predict_gl_account
+
+    input_path = os.path.join(work_dir, "expenses.csv")
+    synthetic_expenses(file_rows, seed=2).drop(columns="label").to_csv(input_path, index=False)
+    output_path = os.path.join(work_dir, "predictions.csv")
+    predict_gl_account(input_path, output_path)  # warm-up
+    latencies, seconds = timed_calls(predict_gl_account, [(input_path, output_path)] * calls)
+    return measure(file_rows * calls, latencies, seconds, file_rows=file_rows)
+
+
+def bench_http(base_url, requests, concurrency, batch_rows):
+    records = synthetic_expenses(batch_rows, seed=3).drop(columns="label")
+    records = json.loads(records.to_json(orient="records"))
+    body = "".join(json.dumps(record) + "\n" for record in records)
+
+    async def predict_json(client, i):
+        return await client.post("/predict-json", json={"expenses": records})
+
+    async def predict_ndjson(client, i):
+        return await client.post("/predict-ndjson", content=body, headers={"Content-Type": "application/x-ndjson"})
+
+    results = {}
+    for name, send in (("http_predict_json", predict_json), ("http_predict_ndjson", predict_ndjson)):
+        http_load(base_url, send, concurrency, concurrency)  # warm up every pool worker
+        results[name] = http_load(base_url, send, requests, concurrency, batch_rows)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--file-rows", type=int, default=10_000)
+    parser.add_argument("--calls", type=int, default=10, help="predict_gl_account calls")
+    parser.add_argument("--requests", type=int, default=200, help="HTTP requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-rows", type=int, default=50, help="rows per HTTP request")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        ensure_model(work_dir)
+        results = {"predict_gl_account": bench_predict_gl_account(work_dir, args.file_rows, args.calls)}
+        results["predict_gl_account"].update(peak_rss_mb())
+
+        # Keep uploads and results (and the garbage collector) out of app/static/uploads
+        os.environ["UPLOAD_DIR"] = os.path.join(work_dir, "uploads")
+        from app.main import app
+
+        with serve(app) as base_url:
+            http_results = bench_http(base_url, args.requests, args.concurrency, args.batch_rows)
+        # Inference pool workers count as children once the pool has shut down
+        for result in http_results.values():
+            result.update(peak_rss_mb())
+        results.update(http_results)
+
+    return finish("bench_load", results, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
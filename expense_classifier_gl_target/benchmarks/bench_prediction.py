@@ -0,0 +1,141 @@
+"""Per-row cost of gl_target inference on synthetic expenses.
+
+Compares the previous post-processing (predict + predict_proba, row-wise
+join/apply, per-column inverse_transform) with the vectorized predict_chunk.
+If models/best_gl_account_model.pkl is missing a small LightGBM pipeline is
+trained on synthetic rows so the benchmark runs anywhere.
+
+    python -m benchmarks.bench_prediction --rows 100000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+MODELS_DIR = os.path.join(os.path.dirname(__file__), "..", "models")
+
+MERCHANTS = [
+    ("UBER TRIP", "NEW YORK NY", "61130"),
+    ("DELTA AIR LINES", "ATLANTA GA", "61120"),
+    ("MARRIOTT HOTELS", "BOSTON MA", "61110"),
+    ("STARBUCKS STORE", "SEATTLE WA", "61215"),
+    ("SHELL OIL", "HOUSTON TX", "63100"),
+    ("ADOBE CREATIVE CLOUD", "SAN JOSE CA", "64100"),
+    ("STAPLES", "FRAMINGHAM MA", "65600"),
+    ("VERIZON WIRELESS", "BASKING RIDGE NJ", "65700"),
+    ("HERTZ RENT A CAR", "ESTERO FL", "61131"),
+    ("AMTRAK", "WASHINGTON DC", "61133"),
+]
+
+
+def synthetic_expenses(rows, seed=0):
+    """Rows matching the text_columns + Amount schema, with a known label"""
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(MERCHANTS), rows)
+    names = np.array([m[0] for m in MERCHANTS], dtype=object)[picks]
+    cities = np.array([m[1] for m in MERCHANTS], dtype=object)[picks]
+    refs = rng.integers(100000, 999999, rows).astype(str).astype(object)
+    return pd.DataFrame({
+        "Description": names + " " + refs,
+        "Extended Details": np.where(rng.random(rows) < 0.3, None, "Card purchase " + refs),
+        "Appears On Your Statement As": names,
+        "Address": "1 MAIN ST",
+        "City/State": cities,
+        "Country": "UNITED STATES",
+        "CC Name": "JANE DOE",
+        "Amount": rng.gamma(2.0, 60.0, rows).round(2),
+        "label": np.array([m[2] for m in MERCHANTS])[picks],
+    })
+
+
+def ensure_model(work_dir):
+    """Point GL_MODEL_PATH at a model, training a small one if none is shipped"""
+    if os.path.exists(os.path.join(MODELS_DIR, "best_gl_account_model.pkl")):
+        return
+    from lightgbm import LGBMClassifier
+    from sklearn.compose import ColumnTransformer
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.impute import SimpleImputer
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import LabelEncoder
+
+    train = synthetic_expenses(5000, seed=1)
+    train["combined_text"] = train[["Description", "Extended Details", "Appears On Your Statement As", "Address",
+                                    "City/State", "Country", "CC Name"]].fillna("").agg(" ".join, axis=1)
+    encoder = LabelEncoder().fit(train["label"])
+    model = Pipeline([
+        ("preprocessor", ColumnTransformer([
+            ("text", TfidfVectorizer(max_features=100, stop_words="english"), "combined_text"),
+            ("num", SimpleImputer(strategy="median"), ["Amount"])
+        ])),
+        ("classifier", LGBMClassifier(n_estimators=50, verbose=-1))
+    ]).fit(train[["combined_text", "Amount"]], encoder.transform(train["label"]))
+    os.environ["GL_MODEL_PATH"] = os.path.join(work_dir, "model.pkl")
+    os.environ["GL_ENCODER_PATH"] = os.path.join(work_dir, "encoder.pkl")
+    joblib.dump(model, os.environ["GL_MODEL_PATH"])
+    joblib.dump(encoder, os.environ["GL_ENCODER_PATH"])
+
+
+def legacy_predict_chunk(new_df, model, label_encoder, text_columns):
+    """predict_gl_account post-processing before vectorization, kept for comparison"""
+    new_df["combined_text"] = new_df[text_columns].fillna("").agg(" ".join, axis=1)
+    X_new = new_df[["combined_text", "Amount"]]
+    y_new_encoded = model.predict(X_new)
+    y_new_proba = model.predict_proba(X_new)
+    top2_indices = np.argsort(y_new_proba, axis=1)[:, -2:]
+    top2_proba = np.take_along_axis(y_new_proba, top2_indices, axis=1)
+    top2_labels = np.empty(top2_indices.shape, dtype=object)
+    for i in range(top2_indices.shape[1]):
+        top2_labels[:, i] = label_encoder.inverse_transform(top2_indices[:, i])
+    new_df["Predicted GL Account No"] = label_encoder.inverse_transform(y_new_encoded)
+    new_df["Confidence Score"] = top2_proba[:, 1]
+    new_df["Alternative GL Account No"] = top2_labels[:, 0]
+    new_df["Reasoning"] = new_df.apply(
+        lambda row: f"Predicted as '{row['Predicted GL Account No']}' with {row['Confidence Score']:.2f} confidence. "
+                    f"Alternative: '{row['Alternative GL Account No']}'.",
+        axis=1
+    )
+    return new_df
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        ensure_model(work_dir)
+        os.environ["FEATURE_CACHE_DIR"] = os.path.join(work_dir, "feature_cache")
+        from app.models.model import registry
+        from app.services.prediction import predict_chunk, text_columns
+
+        loaded = registry.current()
+        df = synthetic_expenses(args.rows).drop(columns="label")
+        legacy, legacy_seconds = timed(legacy_predict_chunk, df.copy(), loaded.model, loaded.label_encoder,
+                                       text_columns)
+        current, current_seconds = timed(predict_chunk, df.copy())
+        # Same rows again: features come from the feature cache
+        warm, warm_seconds = timed(predict_chunk, df.copy())
+
+    columns = ["Predicted GL Account No", "Alternative GL Account No", "Reasoning"]
+    assert (legacy[columns].astype(str).values == current[columns].astype(str).values).all(), "outputs differ"
+    assert (warm[columns].astype(str).values == current[columns].astype(str).values).all(), "cached outputs differ"
+    for name, seconds in (("legacy", legacy_seconds), ("vectorized", current_seconds), ("cached", warm_seconds)):
+        print(f"{name:>10}: {seconds:8.2f} s total, {seconds / args.rows * 1e6:8.1f} us/row")
+    print(f"   speedup: {legacy_seconds / current_seconds:.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
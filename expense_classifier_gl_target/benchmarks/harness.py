@@ -0,0 +1,234 @@
+"""Measurement helpers for the benchmarks: latency percentiles, peak RSS,
+concurrent HTTP load, import and startup times, and JSON results checked
+against a baseline.
+
+Kept identical in expense_classifier_gl_target/benchmarks/harness.py and
+expense_classifier_no_target/benchmarks/harness.py: the two services are
+deployed separately and share no package.
+"""
+import asyncio
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def percentiles(latencies):
+    """p50/p95/p99/max of latencies in seconds, reported in milliseconds"""
+    if not latencies:
+        return {}
+    values = sorted(latencies)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(round(q * (len(values) - 1))))] * 1000, 3)
+
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": pick(1.0)}
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process and of its finished children"""
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1024 * 1024 if platform.system() == "Darwin" else 1024
+    return {
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "peak_rss_children_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1)
+    }
+
+
+def measure(rows, latencies, seconds, **extra):
+    """One benchmark result: throughput, latency percentiles and anything in ``extra``"""
+    return {
+        "rows": rows,
+        "calls": len(latencies),
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(rows / seconds, 1) if seconds else None,
+        **percentiles(latencies),
+        **extra
+    }
+
+
+def timed_calls(fn, args_list):
+    """Call ``fn(*args)`` for each entry of ``args_list``; returns (latencies, total seconds)"""
+    latencies = []
+    start = time.perf_counter()
+    for args in args_list:
+        call_start = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - call_start)
+    return latencies, time.perf_counter() - start
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def serve(app, timeout=60):
+    """Run an ASGI app under uvicorn on a background thread; yields its base URL"""
+    import uvicorn
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + timeout
+    while not server.started:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError("uvicorn did not start")
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def import_profile(module, top=15, env=None, cwd=None):
+    """Time for a fresh interpreter to import ``module`` (python -X importtime),
+    with the slowest packages it pulled in by cumulative time"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], env=env, cwd=cwd,
+                            capture_output=True, text=True, check=True)
+    # "import time: self [us] | cumulative | name", nested imports indented two spaces per
+    # level and listed before the import that pulled them in
+    subtree, seconds = [], 0.0
+    for line in result.stderr.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        if not name.startswith("   "):
+            if name.strip() == module:
+                seconds = int(cumulative) / 1e6
+                break
+            # Another top-level import (e.g. site at interpreter startup)
+            subtree = []
+            continue
+        subtree.append((name.strip(), int(cumulative) / 1e6))
+    packages = {}
+    for name, cumulative in subtree:
+        package = name.split(".")[0]
+        if package != module.split(".")[0]:
+            packages[package] = max(packages.get(package, 0.0), cumulative)
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {"import_seconds": round(seconds, 3),
+            "slowest_imports": {name: round(cumulative, 3) for name, cumulative in slowest}}
+
+
+def startup_times(app, live_path, ready_path, env=None, cwd=None, timeout=120):
+    """Start ``uvicorn app`` in a fresh process; seconds until ``live_path`` and then ``ready_path`` answer 200"""
+    import httpx
+
+    port = _free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port),
+                                "--log-level", "warning"], env=env, cwd=cwd)
+    times = {}
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=5) as client:
+            for name, path in (("live_seconds", live_path), ("ready_seconds", ready_path)):
+                while name not in times:
+                    if process.poll() is not None:
+                        raise RuntimeError(f"{app} exited with {process.returncode}")
+                    if time.perf_counter() - start > timeout:
+                        raise RuntimeError(f"{app} did not answer {path} within {timeout}s")
+                    try:
+                        if client.get(path).status_code == 200:
+                            times[name] = time.perf_counter() - start
+                            continue
+                    except httpx.TransportError:
+                        pass
+                    time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+    return times
+
+
+def http_load(base_url, send, requests, concurrency, rows_per_request=1):
+    """Send ``requests`` requests from ``concurrency`` concurrent clients.
+
+    ``send(client, i)`` issues request ``i`` with an ``httpx.AsyncClient`` and
+    returns the response. Only rows of 2xx responses count towards throughput.
+    """
+    import httpx
+
+    async def run():
+        latencies, statuses = [], {}
+        pending = iter(range(requests))
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+            async def worker():
+                for i in pending:
+                    start = time.perf_counter()
+                    response = await send(client, i)
+                    latencies.append(time.perf_counter() - start)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            return latencies, statuses, time.perf_counter() - start
+
+    latencies, statuses, seconds = asyncio.run(run())
+    succeeded = sum(count for status, count in statuses.items() if 200 <= status < 300)
+    return measure(succeeded * rows_per_request, latencies, seconds, concurrency=concurrency,
+                   status_codes={str(status): count for status, count in sorted(statuses.items())})
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of ``results`` against a baseline results file beyond ``tolerance`` (0.2 = 20%)"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        if previous.get("rows_per_second") and (current.get("rows_per_second") or 0) < \
+                previous["rows_per_second"] * (1 - tolerance):
+            regressions.append(f"{name}: rows/s {previous['rows_per_second']} -> {current.get('rows_per_second')}")
+        for key in ("p95_ms", "p99_ms"):
+            if previous.get(key) and current.get(key, 0) > previous[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {previous[key]} -> {current[key]}")
+    return regressions
+
+
+def add_arguments(parser):
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<benchmark>-<time>.json)")
+    parser.add_argument("--baseline", help="earlier results file; exit 1 if this run regressed against it")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression (default 0.2 = 20%%)")
+
+
+def finish(benchmark, results, args):
+    """Print and store ``results``, then check them against ``--baseline``; returns the exit code"""
+    for name, result in results.items():
+        summary = ", ".join(f"{key}={value}" for key, value in result.items() if not isinstance(value, dict))
+        print(f"{name}: {summary}")
+    payload = {
+        "benchmark": benchmark,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": results
+    }
+    path = args.output or os.path.join(
+        RESULTS_DIR, f"{benchmark}-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2)
+    print(f"Results written to {path}")
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
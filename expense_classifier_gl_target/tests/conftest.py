@@ -0,0 +1,34 @@
+import os
+import tempfile
+
+import joblib
+from sklearn.compose import ColumnTransformer
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import LabelEncoder
+
+from benchmarks.bench_prediction import synthetic_expenses
+
+# Train a small model before any app module reads GL_MODEL_PATH. Labels are
+# floats, like the shipped label encoder's classes.
+MODEL_DIR = tempfile.mkdtemp(prefix="gl-target-tests-")
+_train = synthetic_expenses(500, seed=1)
+_train["combined_text"] = _train[["Description", "City/State"]].agg(" ".join, axis=1)
+_encoder = LabelEncoder().fit(_train["label"].astype(float))
+_model = Pipeline([
+    ("preprocessor", ColumnTransformer([
+        ("text", TfidfVectorizer(), "combined_text"),
+        ("num", SimpleImputer(strategy="median"), ["Amount"])
+    ])),
+    ("classifier", LogisticRegression(max_iter=500))
+]).fit(_train[["combined_text", "Amount"]], _encoder.transform(_train["label"].astype(float)))
+# Uploads, results and cached features stay out of the working tree (the app
+# garbage-collects app/static/uploads)
+os.environ["UPLOAD_DIR"] = os.path.join(MODEL_DIR, "uploads")
+os.environ["FEATURE_CACHE_DIR"] = os.path.join(MODEL_DIR, "feature_cache")
+os.environ["GL_MODEL_PATH"] = os.path.join(MODEL_DIR, "model.pkl")
+os.environ["GL_ENCODER_PATH"] = os.path.join(MODEL_DIR, "encoder.pkl")
+joblib.dump(_model, os.environ["GL_MODEL_PATH"])
+joblib.dump(_encoder, os.environ["GL_ENCODER_PATH"])
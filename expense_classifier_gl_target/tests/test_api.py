@@ -0,0 +1,109 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.services.prediction import predict_records
+from benchmarks.bench_prediction import synthetic_expenses
+
+client = TestClient(main.app)
+
+
+def test_admin_endpoints_are_disabled_without_a_token(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", None)
+
+    assert client.get("/admin/model").status_code == 403
+    assert client.post("/admin/model/activate", headers={"X-Admin-Token": ""}).status_code == 403
+
+
+def test_admin_endpoints_require_the_configured_token(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+
+    assert client.get("/admin/model", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    response = client.get("/admin/model", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.json()["active_version"] == main.registry.current().version
+
+
+@pytest.fixture(scope="module")
+def running_client():
+    # The context manager runs startup: model load and the inference workers
+    with TestClient(main.app) as client:
+        yield client
+
+
+def test_ready_once_the_model_and_workers_are_warmed_up(running_client):
+    assert running_client.get("/health").json() == {"status": "ok"}
+    deadline = time.monotonic() + 60
+    while (response := running_client.get("/ready")).status_code == 503 and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+
+
+def test_importing_the_app_does_not_load_the_model_stack():
+    script = "import sys, app.main; print(sorted({'pandas', 'sklearn', 'joblib'} & set(sys.modules)))"
+    loaded = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=os.path.join(os.path.dirname(__file__), ".."), capture_output=True, text=True, check=True
+    ).stdout.strip()
+
+    assert loaded == "[]"
+
+
+def expense_records(rows):
+    return synthetic_expenses(rows, seed=5).drop(columns="label").to_dict(orient="records")
+
+
+def test_predict_json_returns_one_prediction_per_record(running_client):
+    records = expense_records(3)
+
+    response = running_client.post("/predict-json", json={"expenses": records})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [item["row"] for item in body] == [0, 1, 2]
+    assert body == predict_records(records)
+
+
+def test_predict_ndjson_numbers_rows_across_chunks_and_reports_bad_lines(running_client, monkeypatch):
+    monkeypatch.setattr(main, "CHUNK_SIZE", 2)
+    records = expense_records(4)
+    lines = [json.dumps(records[0]), json.dumps(records[1]), "not json", json.dumps(records[2]), json.dumps(records[3])]
+
+    response = running_client.post("/predict-ndjson", content="\n".join(lines) + "\n")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [result["row"] for result in results] == [0, 1, 2, 3, 4]
+    assert "Invalid line" in results[2]["error"]
+    expected = predict_records(records)
+    for result, prediction in zip(results[:2] + results[3:], expected):
+        assert result["gl_account_number"] == prediction["gl_account_number"]
+
+
+def test_identical_uploads_reuse_the_stored_result(running_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(tmp_path))
+    content = synthetic_expenses(20, seed=6).drop(columns="label").to_csv(index=False).encode()
+
+    first = running_client.post("/predict-api/", files={"file": ("march.csv", content)}, data={"output_format": "csv"})
+    copy = running_client.post("/predict-api/", files={"file": ("march (1).csv", content)}, data={"output_format": "csv"})
+
+    assert first.status_code == copy.status_code == 200
+    assert copy.content == first.content
+    assert copy.headers["content-disposition"].endswith("prediction_march%20%281%29.csv")
+    # One stored upload and one stored result, named after the first upload
+    stored = sorted(os.listdir(tmp_path))
+    assert len(stored) == 2 and stored[1].startswith("prediction_march_")
+
+    page = running_client.post("/predict-web/", files={"file": ("april.csv", content)}, data={"output_format": "csv"})
+    assert stored[1] in page.text
+    assert running_client.get(f"/download/{stored[1]}").content == first.content
+    assert sorted(os.listdir(tmp_path)) == stored
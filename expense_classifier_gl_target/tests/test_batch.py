@@ -0,0 +1,89 @@
+import ast
+import json
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from app import batch
+from benchmarks.bench_prediction import synthetic_expenses
+
+
+@pytest.fixture
+def statements(tmp_path):
+    inputs = tmp_path / "statements"
+    (inputs / "jane").mkdir(parents=True)
+    expenses = synthetic_expenses(30, seed=7).drop(columns="label")
+    with pd.ExcelWriter(inputs / "amex.xlsx") as writer:
+        expenses.iloc[:20].to_excel(writer, sheet_name="January", index=False)
+        expenses.iloc[20:].to_excel(writer, sheet_name="February", index=False)
+        pd.DataFrame({"Note": ["totals only"]}).to_excel(writer, sheet_name="Notes", index=False)
+    expenses.iloc[:12].to_csv(inputs / "visa.csv", index=False)
+    shutil.copy(inputs / "visa.csv", inputs / "jane" / "visa_copy.csv")
+    (inputs / "readme.txt").write_text("not a statement")
+    return inputs
+
+
+def test_batch_classifies_every_sheet_and_consolidates(statements, tmp_path):
+    output_dir = tmp_path / "out"
+
+    summary = batch.run([str(statements)], str(output_dir), "csv", workers=2)
+
+    files = {Path(entry["file"]).name: entry for entry in summary["files"]}
+    assert sorted(files) == ["amex.xlsx", "visa.csv", "visa_copy.csv"]
+    assert {entry["status"] for entry in files.values()} == {"classified"}
+    assert [(sheet["sheet"], sheet["rows"]) for sheet in files["amex.xlsx"]["sheets"]] == \
+        [("January", 20), ("February", 10), ("Notes", 0)]
+    assert "Missing columns" in files["amex.xlsx"]["sheets"][2]["skipped"]
+    # The copy has the same content hash and shares the stored results
+    assert files["visa.csv"]["sha256"] == files["visa_copy.csv"]["sha256"]
+    assert len(list((output_dir / ".results").iterdir())) == 2
+
+    result = pd.read_csv(output_dir / "predictions.csv")
+    assert summary["rows"] == len(result) == 30 + 12 + 12
+    assert result.columns[:2].tolist() == ["Source File", "Sheet"]
+    assert result["Predicted GL Account No"].notna().all()
+    assert result.groupby(result["Sheet"].fillna(""))["Description"].count().to_dict() == \
+        {"": 24, "January": 20, "February": 10}
+    assert json.loads((output_dir / "summary.json").read_text())["rows"] == 54
+
+
+def test_rerun_reuses_results_of_unchanged_files(statements, tmp_path, monkeypatch):
+    output_dir = tmp_path / "out"
+    batch.run([str(statements / "*.csv"), str(statements / "*.xlsx")], str(output_dir), "csv", workers=1)
+    (statements / "visa.csv").write_text((statements / "visa.csv").read_text() + (statements / "visa.csv").read_text().splitlines()[1] + "\n")
+
+    summary = batch.run([str(statements / "*.csv"), str(statements / "*.xlsx")], str(output_dir), "csv", workers=1)
+
+    assert {Path(entry["file"]).name: entry["status"] for entry in summary["files"]} == \
+        {"amex.xlsx": "reused", "visa.csv": "classified"}
+    assert summary["rows"] == 30 + 13
+
+
+def test_failed_files_are_reported_and_set_the_exit_code(statements, tmp_path):
+    (statements / "broken.xlsx").write_text("not really a workbook")
+
+    summary = batch.run([str(statements)], str(tmp_path / "out"), "csv", workers=2)
+
+    failed = [entry for entry in summary["files"] if entry["status"] == "failed"]
+    assert [Path(entry["file"]).name for entry in failed] == ["broken.xlsx"]
+    assert failed[0]["error"]
+    assert batch.summarize(summary) == 1
+
+
+def test_shared_batch_helpers_match_the_no_target_copy():
+    here = Path(__file__).resolve().parents[1] / "app" / "batch.py"
+    there = Path(__file__).resolve().parents[2] / "expense_classifier_no_target" / "app" / "batch.py"
+    if not there.exists():
+        pytest.skip("no_target service not checked out")
+
+    def shared(path):
+        return {
+            node.name: ast.dump(node) for node in ast.parse(path.read_text()).body
+            if getattr(node, "name", None) in ("discover", "load_manifest", "store_results", "consolidate",
+                                               "run_batch", "summarize")
+        }
+
+    assert len(shared(here)) == 6
+    assert shared(here) == shared(there)
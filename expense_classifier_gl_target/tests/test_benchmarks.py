@@ -0,0 +1,34 @@
+import argparse
+import json
+
+from benchmarks.harness import add_arguments, compare, finish, measure, percentiles
+
+
+def test_percentiles_are_reported_in_milliseconds():
+    latencies = [i / 1000 for i in range(1, 101)]
+
+    assert percentiles(latencies) == {"p50_ms": 51.0, "p95_ms": 95.0, "p99_ms": 99.0, "max_ms": 100.0}
+    assert percentiles([]) == {}
+
+
+def test_compare_flags_throughput_and_tail_latency_regressions():
+    baseline = {"results": {"http": measure(1000, [0.01] * 90 + [0.02] * 10, 1.0)}}
+
+    assert compare({"http": measure(900, [0.01] * 90 + [0.02] * 10, 1.0)}, baseline, tolerance=0.2) == []
+    regressions = compare({"http": measure(500, [0.05] * 100, 1.0), "new": measure(1, [], 1.0)}, baseline, 0.2)
+    assert regressions == ["http: rows/s 1000.0 -> 500.0", "http: p95_ms 20.0 -> 50.0", "http: p99_ms 20.0 -> 50.0"]
+
+
+def test_finish_stores_results_and_fails_on_regression(tmp_path):
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    baseline_path = tmp_path / "baseline.json"
+    args = parser.parse_args(["--output", str(baseline_path)])
+
+    assert finish("bench", {"http": measure(1000, [0.01], 1.0)}, args) == 0
+    stored = json.loads(baseline_path.read_text())
+    assert stored["benchmark"] == "bench"
+    assert stored["results"]["http"]["rows_per_second"] == 1000.0
+
+    args = parser.parse_args(["--output", str(tmp_path / "run.json"), "--baseline", str(baseline_path)])
+    assert finish("bench", {"http": measure(100, [0.01], 1.0)}, args) == 1
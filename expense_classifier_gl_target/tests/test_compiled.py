@@ -0,0 +1,93 @@
+import os
+
+import joblib
+import numpy as np
+import pytest
+from lightgbm import LGBMClassifier
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import Pipeline
+
+from app.models import compiled
+from app.models.compiled import CompiledModel, export
+from app.models.model import compiled_path, ModelRegistry, registry
+from app.services.prediction import model_input, predict_frame
+from benchmarks.bench_prediction import synthetic_expenses
+
+
+@pytest.fixture(scope="module")
+def rows():
+    rows = model_input(synthetic_expenses(300, seed=11))
+    rows.loc[::9, "Amount"] = np.nan
+    rows.loc[::13, "combined_text"] = ""
+    return rows
+
+
+def fit(classifier, vectorizer=None):
+    train = synthetic_expenses(800, seed=1)
+    labels = registry.current().label_encoder.transform(train["label"].astype(float))
+    return Pipeline([
+        ("preprocessor", ColumnTransformer([
+            ("text", vectorizer or TfidfVectorizer(), "combined_text"),
+            ("num", SimpleImputer(strategy="median"), ["Amount"])
+        ])),
+        ("classifier", classifier)
+    ]).fit(model_input(train), labels)
+
+
+def test_compiled_logistic_regression_matches_the_pickle(tmp_path, rows):
+    loaded = registry.current()
+    path = export(loaded.model, loaded.label_encoder, str(tmp_path / "model.npz"), sample=rows)
+
+    model = CompiledModel.load(path)
+
+    np.testing.assert_allclose(model.predict_proba(rows), loaded.model.predict_proba(rows), atol=1e-9)
+    assert model.classes_.tolist() == loaded.model.classes_.tolist()
+    assert model.label_encoder.classes_.tolist() == loaded.label_encoder.classes_.tolist()
+
+
+@pytest.mark.parametrize("native_min_rows", [1, 10 ** 9])
+def test_compiled_lightgbm_matches_the_pickle(tmp_path, rows, monkeypatch, native_min_rows):
+    # Scored by LightGBM itself or by the NumPy tree evaluator
+    monkeypatch.setattr(compiled, "NATIVE_MIN_ROWS", native_min_rows)
+    pipeline = fit(LGBMClassifier(n_estimators=20, num_leaves=15, verbose=-1),
+                   TfidfVectorizer(max_features=100, stop_words="english", ngram_range=(1, 2)))
+    path = export(pipeline, registry.current().label_encoder, str(tmp_path / "model.npz"), sample=rows)
+
+    model = CompiledModel.load(path)
+
+    np.testing.assert_allclose(model.predict_proba(rows), pipeline.predict_proba(rows), atol=1e-9)
+    np.testing.assert_allclose(model.predict_proba(rows.iloc[:1]), pipeline.predict_proba(rows.iloc[:1]), atol=1e-9)
+
+
+def test_export_rejects_steps_it_cannot_compile(tmp_path):
+    pipeline = fit(RandomForestClassifier(n_estimators=5))
+
+    with pytest.raises(ValueError, match="RandomForestClassifier"):
+        export(pipeline, registry.current().label_encoder, str(tmp_path / "model.npz"))
+    assert not os.listdir(tmp_path)
+
+
+def test_registry_serves_the_compiled_model_only_while_it_is_current(tmp_path):
+    loaded = registry.current()
+    model_path, encoder_path = str(tmp_path / "model.pkl"), str(tmp_path / "encoder.pkl")
+    joblib.dump(loaded.model, model_path)
+    joblib.dump(loaded.label_encoder, encoder_path)
+    export(loaded.model, loaded.label_encoder, compiled_path(model_path))
+    expenses = synthetic_expenses(20, seed=12).drop(columns="label")
+
+    served = ModelRegistry(versions_dir=str(tmp_path / "versions"), active_file=str(tmp_path / "ACTIVE"),
+                           model_path=model_path, encoder_path=encoder_path).current()
+
+    assert isinstance(served.model, CompiledModel)
+    assert predict_frame(expenses.copy(), served) == [
+        {**prediction, "model_version": served.version} for prediction in predict_frame(expenses.copy(), loaded)
+    ]
+
+    # A pickle replaced after the export is served as is
+    os.utime(model_path, (os.path.getmtime(compiled_path(model_path)) + 10,) * 2)
+    reloaded = ModelRegistry(versions_dir=str(tmp_path / "versions"), active_file=str(tmp_path / "ACTIVE"),
+                             model_path=model_path, encoder_path=encoder_path).current()
+    assert not isinstance(reloaded.model, CompiledModel)
@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.models.model import registry
+from app.services import prediction
+from app.services.feature_cache import FeatureCache, row_keys
+from app.services.prediction import model_input, text_columns
+from benchmarks.bench_prediction import synthetic_expenses
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = FeatureCache(directory=str(tmp_path), enabled=True, max_segments=3, rescan_seconds=0)
+    monkeypatch.setattr(prediction, "feature_cache", cache)
+    return cache
+
+
+def uncached_proba(rows):
+    return registry.current().model.predict_proba(model_input(rows))
+
+
+def test_cached_features_score_exactly_like_the_pipeline(cache):
+    rows = synthetic_expenses(30, seed=8).drop(columns="label")
+
+    cold = prediction.predict_proba(rows.copy())
+    warm = prediction.predict_proba(rows.copy())
+
+    assert (cache.hits, cache.misses) == (30, 30)
+    np.testing.assert_array_equal(cold, uncached_proba(rows))
+    np.testing.assert_array_equal(warm, cold)
+
+
+def test_partly_cached_chunks_keep_row_order(cache):
+    rows = synthetic_expenses(40, seed=9).drop(columns="label")
+    prediction.predict_proba(rows.iloc[::2].copy())
+    # Seen and unseen rows interleaved, plus a repeated row
+    mixed = pd.concat([rows, rows.iloc[[5]]], ignore_index=True)
+
+    proba = prediction.predict_proba(mixed.copy())
+
+    # Misses count rows; the repeated unseen row is vectorized once with its chunk
+    assert (cache.hits, cache.misses) == (20, 41)
+    np.testing.assert_array_equal(proba, uncached_proba(mixed))
+
+
+def test_keys_follow_the_normalized_row_and_amount():
+    rows = synthetic_expenses(3, seed=10).drop(columns="label")
+    same = rows.copy()
+    same["Extended Details"] = same["Extended Details"].fillna("")
+    changed = rows.copy()
+    changed.loc[1, "Amount"] += 1
+
+    assert (row_keys(rows, text_columns) == row_keys(same, text_columns)).all()
+    assert (row_keys(rows, text_columns) == row_keys(changed, text_columns)).tolist() == [True, False, True]
+
+
+def test_segments_are_shared_and_merged(cache, tmp_path):
+    version = registry.current().version
+    for seed in range(4):
+        prediction.predict_proba(synthetic_expenses(10, seed=20 + seed).drop(columns="label"))
+
+    # The fourth segment triggered a merge into one
+    assert len(os.listdir(tmp_path / version)) == 1
+    other_process = FeatureCache(directory=str(tmp_path), enabled=True)
+    rows = synthetic_expenses(10, seed=22).drop(columns="label")
+    features = other_process.features(version, rows, text_columns, lambda rows: pytest.fail("vectorized again"))
+    assert features.shape[0] == 10
+    assert other_process.hits == 10
+
+
+def test_merging_keeps_the_newest_rows(tmp_path):
+    cache = FeatureCache(directory=str(tmp_path), enabled=True, max_rows=3, max_segments=1, rescan_seconds=0)
+    vectorize = lambda rows: rows[["Amount"]].to_numpy(dtype=float)
+    first = pd.DataFrame({column: ["a"] * 3 for column in text_columns}).assign(Amount=[1.0, 2.0, 3.0])
+    second = first.assign(Amount=[4.0, 5.0, 1.0])
+
+    cache.features("v1", first, text_columns, vectorize)
+    cache.features("v1", second, text_columns, vectorize)
+
+    segments = cache.segments("v1")
+    assert len(segments) == 1
+    assert sorted(segments[0].matrix.toarray().ravel().tolist()) == [1.0, 4.0, 5.0]
+    # Dense pipeline output comes back dense
+    assert isinstance(cache.features("v1", second, text_columns, vectorize), np.ndarray)
+
+
+def test_disabled_cache_only_vectorizes(tmp_path):
+    cache = FeatureCache(directory=str(tmp_path), enabled=False)
+    rows = synthetic_expenses(2, seed=11).drop(columns="label")
+
+    features = cache.features("v1", rows, text_columns, lambda rows: np.ones((len(rows), 1)))
+
+    assert features.shape == (2, 1)
+    assert not os.listdir(tmp_path)
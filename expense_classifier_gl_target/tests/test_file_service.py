@@ -0,0 +1,91 @@
+import ast
+import asyncio
+import io
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from starlette.datastructures import UploadFile
+
+from app.services.file_service import (
+    collect_garbage, file_digest, iter_file_chunks, read_frame_bytes, store_upload, StreamingOutput
+)
+
+
+@pytest.fixture
+def expenses():
+    return pd.DataFrame({
+        "Description": [f"MERCHANT {i}" for i in range(25)],
+        "Amount": [float(i) for i in range(25)]
+    })
+
+
+@pytest.mark.parametrize("extension", ["xlsx", "csv", "jsonl", "parquet"])
+def test_streaming_output_round_trips_through_chunks(tmp_path, expenses, extension):
+    path = tmp_path / f"predictions.{extension}"
+    output = StreamingOutput(str(path))
+    for start in range(0, len(expenses), 10):
+        output.write(expenses.iloc[start:start + 10])
+    output.close()
+
+    assert output.rows == 25
+    assert not (tmp_path / f"predictions.{extension}.tmp").exists()
+    if extension == "jsonl":
+        written = read_frame_bytes(path.read_bytes(), "jsonl")
+    else:
+        chunks = list(iter_file_chunks(str(path), chunk_size=10))
+        assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+        written = pd.concat(chunks)
+        assert written.index.tolist() == list(range(25))
+    assert written["Description"].tolist() == expenses["Description"].tolist()
+
+
+def test_uploads_are_stored_once_per_content(tmp_path):
+    content = b"Description,Amount\nUBER TRIP,12.5\n"
+
+    path, digest = asyncio.run(store_upload(UploadFile(io.BytesIO(content), filename="march.csv"), str(tmp_path)))
+    again, _ = asyncio.run(store_upload(UploadFile(io.BytesIO(content), filename="march (1).CSV"), str(tmp_path)))
+
+    assert path == again == str(tmp_path / f"{digest}.csv")
+    assert digest == file_digest(path)
+    assert os.listdir(tmp_path) == [f"{digest}.csv"]
+
+
+def test_garbage_collection_removes_expired_then_least_recently_used_entries(tmp_path):
+    now = time.time()
+    for name, age in (("expired.csv", 10_000), ("old.csv", 300), ("in_use.csv", 200), ("new.csv", 100)):
+        (tmp_path / name).write_bytes(b"x" * 100)
+        os.utime(tmp_path / name, (now - age, now - age))
+    (tmp_path / "job.parts").mkdir()
+    (tmp_path / "job.parts" / "part-000000.parquet").write_bytes(b"x" * 100)
+    os.utime(tmp_path / "job.parts", (now - 250, now - 250))
+
+    removed = collect_garbage(str(tmp_path), max_bytes=250, max_age_seconds=3600,
+                              in_use=lambda path: path.endswith("in_use.csv"), now=now)
+
+    assert removed == (3, 300)
+    assert sorted(os.listdir(tmp_path)) == ["in_use.csv", "new.csv"]
+    assert collect_garbage(str(tmp_path / "missing"), 0, 0) == (0, 0)
+
+
+def test_shared_file_helpers_match_the_no_target_copy():
+    # Both services ship their own copy of these helpers; they must not drift apart
+    here = Path(__file__).resolve().parents[1] / "app" / "services" / "file_service.py"
+    there = Path(__file__).resolve().parents[2] / "expense_classifier_no_target" / "app" / "services" / "file_service.py"
+    if not there.exists():
+        pytest.skip("no_target service not checked out")
+
+    def shared(path):
+        tree = ast.parse(path.read_text())
+        return {
+            ast.unparse(node.targets[0]) if isinstance(node, ast.Assign) else node.name: ast.dump(node)
+            for node in tree.body
+            if getattr(node, "name", None) in ("file_digest", "save_upload", "store_upload", "collect_garbage",
+                                               "sheet_names", "_xlsx_chunks", "StreamingOutput")
+            or (isinstance(node, ast.Assign) and ast.unparse(node.targets[0]) == "OUTPUT_FORMATS")
+        }
+
+    assert len(shared(here)) == 8
+    assert shared(here) == shared(there)
@@ -0,0 +1,61 @@
+import asyncio
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.services.inference_pool import InferencePool, PoolBusy, PoolOverloaded, RETRY_AFTER_SECONDS
+
+
+def crash():
+    os._exit(1)
+
+
+def square(x):
+    return x * x
+
+
+@pytest.fixture
+def pool():
+    pool = InferencePool(workers=1, max_pending=1)
+    pool.start()
+    yield pool
+    pool.shutdown()
+
+
+def test_reserve_rejects_requests_beyond_max_pending(pool):
+    async def scenario():
+        async with pool.reserve():
+            with pytest.raises(PoolBusy) as busy:
+                async with pool.reserve():
+                    pass
+            return busy.value
+
+    busy = asyncio.run(scenario())
+    assert busy.status_code == 429
+    assert busy.retry_after > 0
+    assert pool.pending == 0
+
+
+def test_crashed_worker_replaces_the_pool_once(pool):
+    async def scenario():
+        results = await asyncio.gather(*(pool.run(crash) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, PoolOverloaded) for result in results)
+        return await pool.run(square, 7)
+
+    assert asyncio.run(asyncio.wait_for(scenario(), 60)) == 49
+    assert pool.generation == 1
+
+
+def test_full_pool_returns_429_with_retry_after(monkeypatch):
+    pool = InferencePool(workers=1, max_pending=1)
+    monkeypatch.setattr(main, "inference_pool", pool)
+    # Occupy the only slot so the request is rejected before any work is done
+    pool._executor = object()
+    pool.pending = 1
+
+    response = TestClient(main.app).post("/predict-json", json={"expenses": [{"Description": "x"}]})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(RETRY_AFTER_SECONDS)
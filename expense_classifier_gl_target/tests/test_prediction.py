@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from app.models.model import registry
+from app.services.prediction import predict_top_k, top_k
+from benchmarks.bench_prediction import synthetic_expenses
+
+
+def test_top_k_orders_scores_best_first():
+    proba = np.array([[0.1, 0.5, 0.4], [0.7, 0.2, 0.1]])
+
+    indices, scores = top_k(proba, 2)
+
+    assert indices.tolist() == [[1, 2], [0, 1]]
+    assert scores.tolist() == [[0.5, 0.4], [0.7, 0.2]]
+
+
+@pytest.mark.parametrize("k", [1, 2, 5])
+def test_predict_top_k_margin_is_always_top1_minus_top2(k):
+    rows = synthetic_expenses(20, seed=3).drop(columns="label")
+
+    results = predict_top_k(rows.copy(), k=k)
+    reference = predict_top_k(rows.copy(), k=5)
+
+    assert [result["row"] for result in results] == list(range(20))
+    for result, full in zip(results, reference):
+        assert len(result["predictions"]) == k
+        assert result["predictions"] == full["predictions"][:k]
+        top1, top2 = full["predictions"][0]["score"], full["predictions"][1]["score"]
+        assert result["margin"] == pytest.approx(top1 - top2, abs=1e-3)
+        # Accounts come back as account numbers, not the encoder's floats
+        assert "." not in result["predictions"][0]["gl_account_number"]
+        assert result["model_version"] == registry.current().version
+
+
+def test_predict_top_k_rejects_k_below_one():
+    with pytest.raises(ValueError):
+        predict_top_k(synthetic_expenses(1).drop(columns="label"), k=0)
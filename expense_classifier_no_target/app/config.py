@@ -7,6 +7,104 @@ class Config:
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
     LOG_FILE = os.getenv("LOG_FILE", "logs/app.log")
+    # Rows read from an upload at a time
+    INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "1000"))
+    # Default result format: xlsx, csv, jsonl or parquet
+    OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "xlsx")
+    OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
+    # Persistent stores (cache, index, queue, tasks); kept out of app/static,
+    # which is served publicly
+    DATA_DIR = os.getenv("DATA_DIR", "data")
+    # Uploads and results, shared by the web process and the workers
+    UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join(os.path.dirname(__file__), "static", "uploads"))
+
+    # Async classification engine limits
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+    LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+    LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "80000"))
+    # Rows packed into one prompt; 1 disables batching
+    LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "10"))
+    # The fallback model takes over while the primary model's circuit breaker is open
+    LLM_PRIMARY_MODEL = os.getenv("LLM_PRIMARY_MODEL", "gpt-4")
+    LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "gpt-3.5-turbo")
+    # Shared limiter: the per-minute limits above are starting values, replaced by the
+    # x-ratelimit-* response headers (times LLM_RATE_HEADROOM); bursts are capped at
+    # LLM_BURST_SECONDS worth of quota
+    LLM_BURST_SECONDS = float(os.getenv("LLM_BURST_SECONDS", "2"))
+    LLM_RATE_HEADROOM = float(os.getenv("LLM_RATE_HEADROOM", "0.9"))
+    LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+    LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "1"))
+    LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "30"))
+    LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+    LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+    # Extended Details longer than this are truncated in prompts
+    PROMPT_MAX_DETAILS_CHARS = int(os.getenv("PROMPT_MAX_DETAILS_CHARS", "200"))
+    # USD per 1K prompt and completion tokens, for the per-job cost totals
+    LLM_PRICES = {
+        "gpt-4": (0.03, 0.06),
+        "gpt-3.5-turbo": (0.0015, 0.002)
+    }
+
+    # Persistent merchant-level prediction cache
+    PREDICTION_CACHE_ENABLED = os.getenv("PREDICTION_CACHE_ENABLED", "true").lower() == "true"
+    PREDICTION_CACHE_PATH = os.getenv("PREDICTION_CACHE_PATH", os.path.join(DATA_DIR, "cache", "predictions.sqlite3"))
+    PREDICTION_CACHE_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "100000"))
+    PREDICTION_CACHE_TTL_SECONDS = int(os.getenv("PREDICTION_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+    # Local nearest-neighbour pre-classifier built from past results
+    SIMILARITY_INDEX_ENABLED = os.getenv("SIMILARITY_INDEX_ENABLED", "true").lower() == "true"
+    SIMILARITY_INDEX_PATH = os.getenv("SIMILARITY_INDEX_PATH", os.path.join(DATA_DIR, "index"))
+    SIMILARITY_K = int(os.getenv("SIMILARITY_K", "5"))
+    SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.85"))
+
+    # Cascade: gl_target model artifacts scored before the LLM (disabled when unset)
+    GL_MODEL_PATH = os.getenv("GL_MODEL_PATH")
+    GL_ENCODER_PATH = os.getenv("GL_ENCODER_PATH")
+    CASCADE_MIN_CONFIDENCE = float(os.getenv("CASCADE_MIN_CONFIDENCE", "0.8"))
+    CASCADE_MIN_MARGIN = float(os.getenv("CASCADE_MIN_MARGIN", "0.3"))
+
+    # Task status store: finished tasks are kept for TASK_TTL_SECONDS
+    TASK_STORE_PATH = os.getenv("TASK_STORE_PATH", os.path.join(DATA_DIR, "tasks", "tasks.sqlite3"))
+    TASK_TTL_SECONDS = int(os.getenv("TASK_TTL_SECONDS", str(7 * 24 * 3600)))
+    TASK_PROGRESS_FLUSH_SECONDS = float(os.getenv("TASK_PROGRESS_FLUSH_SECONDS", "1"))
+
+    # Uploads are stored once per content hash, and a byte-identical re-upload gets the stored
+    # result of an earlier job run with the same models and GL account map (index in
+    # STORAGE_INDEX_PATH). Uploads, results and leftover result parts not used for
+    # STORAGE_MAX_AGE_SECONDS are removed, then the least recently used until each directory
+    # fits in STORAGE_MAX_BYTES; the web process checks every STORAGE_GC_INTERVAL_SECONDS
+    STORAGE_INDEX_PATH = os.getenv("STORAGE_INDEX_PATH", os.path.join(DATA_DIR, "storage", "results.sqlite3"))
+    STORAGE_MAX_BYTES = int(os.getenv("STORAGE_MAX_BYTES", str(5 << 30)))
+    STORAGE_MAX_AGE_SECONDS = int(os.getenv("STORAGE_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+    STORAGE_GC_INTERVAL_SECONDS = float(os.getenv("STORAGE_GC_INTERVAL_SECONDS", "3600"))
+
+    # Metrics served on /metrics, shared by the web process and the workers
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_PATH = os.getenv("METRICS_PATH", os.path.join(DATA_DIR, "metrics", "metrics.sqlite3"))
+    METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+    # Durable job queue and workers (python -m app.worker); EMBEDDED_WORKERS
+    # runs workers inside the web process so a single container still works
+    JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", os.path.join(DATA_DIR, "queue", "jobs.sqlite3"))
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    JOB_RETRY_BACKOFF_SECONDS = float(os.getenv("JOB_RETRY_BACKOFF_SECONDS", "30"))
+    JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "60"))
+    JOB_MAX_RUNNING_PER_USER = int(os.getenv("JOB_MAX_RUNNING_PER_USER", "2"))
+    # Header carrying the authenticated user, set by a trusted auth proxy; unset means the client address is used
+    JOB_USER_HEADER = os.getenv("JOB_USER_HEADER")
+    # Highest priority a client may request; uploads can always lower their own priority
+    JOB_MAX_CLIENT_PRIORITY = int(os.getenv("JOB_MAX_CLIENT_PRIORITY", "0"))
+    CHUNK_MAX_ATTEMPTS = int(os.getenv("CHUNK_MAX_ATTEMPTS", "3"))
+    WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))
+    WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "1"))
+    WORKER_HEARTBEAT_SECONDS = float(os.getenv("WORKER_HEARTBEAT_SECONDS", "10"))
+    EMBEDDED_WORKERS = int(os.getenv("EMBEDDED_WORKERS", "1"))
+
+    # Progress push (/api/task-events): how often each watched task is re-read,
+    # and how many finished rows are sent along as a preview
+    PROGRESS_POLL_SECONDS = float(os.getenv("PROGRESS_POLL_SECONDS", "1"))
+    PROGRESS_KEEPALIVE_SECONDS = float(os.getenv("PROGRESS_KEEPALIVE_SECONDS", "15"))
+    PROGRESS_PREVIEW_ROWS = int(os.getenv("PROGRESS_PREVIEW_ROWS", "5"))
 
     GL_ACCOUNT_MAP = {
         "54820": "Personal Expenses on Bus. CC",
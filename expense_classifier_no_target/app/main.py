@@ -1,19 +1,71 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request, BackgroundTasks
-from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, BackgroundTasks
+from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from app.services.llm_service import predict_gl_account
-from app.services.file_service import process_excel_file, save_predictions
+from app.schemas.response import TopKRequest, TopKPrediction
+from app.config import Config
+from app.services.file_service import count_rows, file_format, OUTPUT_FORMATS, store_upload
+from app.services.metrics_service import metrics
+from app.services.progress_service import progress_broadcaster
+from app.services.queue_service import job_queue
+from app.services.storage_service import result_store
 from app.services.task_service import task_manager
-from app.utils.helpers import validate_file_extension
+from app.utils.helpers import results_version, validate_file_extension
 from app.utils.logger import logger
 import os
-import uuid
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
 import threading
+import time
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import List
 
-app = FastAPI()
+# The classification stack (openai, aiohttp, pandas, the similarity index) is imported
+# by the warm-up thread after startup and by the handlers that use it, so the app
+# answers /health as soon as the server is up
+
+UPLOAD_DIR = Config.UPLOAD_DIR
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+# Warm-up state reported by /ready
+startup = {"status": "starting", "seconds": None, "error": None}
+
+def warm_up():
+    """Import the classification stack, load the similarity index, then start the embedded workers"""
+    start = time.perf_counter()
+    try:
+        from app.worker import Worker
+        from app.services.similarity_service import similarity_index
+
+        len(similarity_index)
+        if Config.EMBEDDED_WORKERS > 0:
+            Worker(concurrency=Config.EMBEDDED_WORKERS).start()
+        startup.update(status="ready", seconds=round(time.perf_counter() - start, 3))
+        logger.info(f"Ready in {startup['seconds']}s")
+    except Exception as e:
+        startup.update(status="failed", error=str(e))
+        logger.error(f"Warm-up failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app):
+    """Queue jobs left over from before the job queue and start the storage garbage collector,
+    then warm up in the background; /ready answers 200 once the embedded workers are running.
+
+    Jobs interrupted by a restart are picked up again by ``requeue_stale``
+    once their last heartbeat is older than ``Config.JOB_STALE_SECONDS``.
+    """
+    for task in task_manager.unfinished_tasks():
+        if job_queue.get(task["task_id"]) is None:
+            logger.info(f"Queueing interrupted task {task['task_id']}")
+            job_queue.enqueue(task["task_id"], {
+                "upload_path": task.get("upload_path") or "",
+                "original_filename": os.path.splitext(task["filename"])[0],
+                "output_format": task.get("output_format")
+            })
+    result_store.start_collector(UPLOAD_DIR)
+    threading.Thread(target=warm_up, daemon=True).start()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
@@ -21,92 +73,78 @@ app.mount("/static", StaticFiles(directory="app/static"), name="static")
 # Setup templates
 templates = Jinja2Templates(directory="app/templates")
 
-# Directory to save uploaded files temporarily
-UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "static", "uploads")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+def job_user(request: Request):
+    """User a job is scheduled under; client-supplied headers are only trusted when configured"""
+    if Config.JOB_USER_HEADER and request.headers.get(Config.JOB_USER_HEADER):
+        return request.headers[Config.JOB_USER_HEADER]
+    return request.client.host if request.client else "anonymous"
 
-def process_file_background(temp_filepath, original_filename, task_id):
-    """Background task to process the file"""
-    try:
-        # Process the Excel file
-        df = process_excel_file(temp_filepath)
-        total_rows = len(df)
-        
-        # Update task with total rows
-        task_manager.tasks[task_id]["total_rows"] = total_rows
-        
-        # Process rows in batches to update progress
-        predictions = []
-        batch_size = max(1, total_rows // 10)  # Update progress 10 times
-        
-        for i, (idx, row) in enumerate(df.iterrows()):
-            try:
-                prediction = predict_gl_account(row.to_dict())
-                predictions.append(prediction)
-            except Exception as e:
-                logger.error(f"Failed to process row {idx}: {str(e)}")
-                predictions.append({
-                    "gl_account_number": "ERROR",
-                    "confidence_score": "0.0",
-                    "alternative_gl_account_number": "",
-                    "reasoning": f"Error: {str(e)[:100]}"
-                })
-            
-            # Update progress every batch or at the end
-            if (i + 1) % batch_size == 0 or (i + 1) == total_rows:
-                task_manager.update_progress(task_id, i + 1)
-        
-        # Save predictions
-        output_filename = f"prediction_{original_filename}_{task_id}.xlsx"
-        output_filepath = os.path.join(UPLOAD_DIR, output_filename)
-        save_predictions(df, predictions, output_filepath)
-        
-        # Mark task as completed
-        task_manager.complete_task(task_id, output_filename)
-        
-        # Clean up temp file after some time
-        os.remove(temp_filepath)
-        
-    except Exception as e:
-        logger.error(f"Error in background processing: {e}")
-        task_manager.fail_task(task_id, str(e))
+@app.get("/health")
+async def health():
+    """Liveness: the process is up and serving"""
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    """Readiness: 200 once the classification stack is loaded and the embedded workers run, 503 until then"""
+    return JSONResponse(startup, status_code=200 if startup["status"] == "ready" else 503)
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     return templates.TemplateResponse("upload.html", {"request": request})
 
 @app.post("/start-prediction/", response_class=HTMLResponse)
-async def start_prediction(request: Request, file: UploadFile = File(...)):
+async def start_prediction(request: Request, file: UploadFile = File(...), output_format: str = Form(None),
+                           priority: int = Form(0)):
     """Start the prediction process and show progress page"""
     try:
         validate_file_extension(file.filename)
+        output_format = (output_format or Config.OUTPUT_FORMAT).lower()
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Invalid output format. Allowed formats: {list(OUTPUT_FORMATS)}")
         
-        # Save the uploaded file temporarily
-        file_extension = file.filename.split(".")[-1]
-        temp_filename = f"{uuid.uuid4()}.{file_extension}"
-        temp_filepath = os.path.join(UPLOAD_DIR, temp_filename)
-        
-        with open(temp_filepath, "wb") as buffer:
-            buffer.write(await file.read())
-        
-        # Get initial row count for progress tracking
-        try:
-            df = process_excel_file(temp_filepath)
-            total_rows = len(df)
-        except:
-            total_rows = 100  # Default estimate
+        # Store the upload by content hash, hashing it as it is copied
+        temp_filepath, digest = await store_upload(file, UPLOAD_DIR)
+        version = results_version()
+
+        # A byte-identical upload already classified with the same models: answer with its result
+        stored = result_store.find(UPLOAD_DIR, digest, version, output_format)
+        if stored:
+            result_file, rows = stored
+            task_id = task_manager.create_task(file.filename, rows, upload_path=temp_filepath,
+                                               output_format=output_format, upload_sha256=digest,
+                                               results_version=version)
+            task_manager.update_stats(task_id, reused_result=True)
+            task_manager.update_progress(task_id, rows)
+            task_manager.complete_task(task_id, result_file)
+            metrics.inc("upload_results_reused_total")
+            logger.info(f"Task {task_id}: reused the stored result {result_file}")
+            return templates.TemplateResponse("processing.html", {
+                "request": request,
+                "task_id": task_id,
+                "filename": file.filename
+            })
+
+        # Get initial row count for progress tracking without parsing the file
+        total_rows = count_rows(temp_filepath) or 100  # Default estimate
         
         # Create a task
-        task_id = task_manager.create_task(file.filename, total_rows)
-        
-        # Start background processing
-        import threading
-        thread = threading.Thread(
-            target=process_file_background,
-            args=(temp_filepath, os.path.splitext(file.filename)[0], task_id)
+        task_id = task_manager.create_task(
+            file.filename,
+            total_rows,
+            upload_path=temp_filepath,
+            output_format=output_format,
+            chunk_size=Config.INGEST_CHUNK_SIZE,
+            upload_sha256=digest,
+            results_version=version
         )
-        thread.daemon = True
-        thread.start()
+        
+        # Queue the job; workers are scheduled fairly across users
+        job_queue.enqueue(task_id, {
+            "upload_path": temp_filepath,
+            "original_filename": os.path.splitext(file.filename)[0],
+            "output_format": output_format
+        }, user=job_user(request), priority=min(priority, Config.JOB_MAX_CLIENT_PRIORITY))
         
         # Show processing page
         return templates.TemplateResponse("processing.html", {
@@ -154,15 +192,48 @@ async def get_task_status(task_id: str):
         "processed_rows": task.get("processed_rows", 0),
         "total_rows": task.get("total_rows", 0),
         "result_file": task.get("result_file"),
-        "error": task.get("error")
+        "error": task.get("error"),
+        "stats": task.get("stats", {}),
+        "job": job_queue.get(task_id)
     })
 
+@app.get("/api/task-events/{task_id}")
+async def task_events(task_id: str):
+    """Server-Sent Events stream of task progress, ETA, throughput and a preview of finished rows"""
+    return StreamingResponse(
+        progress_broadcaster.stream(task_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/predict-topk", response_model=List[TopKPrediction])
+async def predict_topk(request: TopKRequest):
+    """Top-k G/L accounts with scores and the top-1/top-2 margin for each expense"""
+    from app.services.classifier_service import ClassificationEngine
+    from app.services.llm_service import predict_top_k_async
+
+    engine = ClassificationEngine(
+        batch_size=1,
+        predict=partial(predict_top_k_async, k=request.k),
+        cache=None,
+        index=None
+    )
+    results = await engine.classify(request.expenses)
+    return [{"row": row, **result} for row, result in enumerate(results)]
+
 @app.get("/download/{filename}")
 async def download_file(filename: str):
     file_path = os.path.join(UPLOAD_DIR, filename)
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(file_path, filename=filename, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    media_type = OUTPUT_FORMATS.get(file_format(filename), "application/octet-stream")
+    return FileResponse(file_path, filename=filename, media_type=media_type)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Metrics of the web process and every worker, in the Prometheus text format"""
+    jobs = [({"status": status}, count) for status, count in sorted(job_queue.counts().items())]
+    return PlainTextResponse(metrics.render(gauges={"jobs": jobs}), media_type="text/plain; version=0.0.4")
 
 @app.get("/redirect-to-home")
 async def redirect_to_home():
@@ -180,7 +251,7 @@ async def redirect_to_home():
 # from fastapi.staticfiles import StaticFiles
 # from fastapi.templating import Jinja2Templates
 # from app.services.llm_service import predict_gl_account
-# from app.services.file_service import process_excel_file, save_predictions
+# from app.services.file_service import iter_file_chunks, count_rows, save_predictions
 # from app.utils.helpers import validate_file_extension
 # from app.utils.logger import logger
 # import os
@@ -1,7 +1,23 @@
-from pydantic import BaseModel
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
 
 class PredictionResponse(BaseModel):
     gl_account_number: str
     confidence_score: float
     alternative_gl_account_number: str
     reasoning: str
+
+class TopKRequest(BaseModel):
+    expenses: List[dict]
+    k: int = Field(3, ge=1, le=20)
+
+class RankedAccount(BaseModel):
+    gl_account_number: str
+    score: float
+
+class TopKPrediction(BaseModel):
+    row: int
+    predictions: List[RankedAccount]
+    margin: float
+    error: Optional[str] = None
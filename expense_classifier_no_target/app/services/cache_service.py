@@ -0,0 +1,145 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from app.config import Config
+from app.utils.helpers import expense_fingerprint, gl_map_version
+from app.utils.logger import logger
+
+
+class PredictionCache:
+    """Persistent merchant-level cache of LLM predictions.
+
+    Entries are keyed by the expense fingerprint plus the G/L map version and
+    stored in SQLite so they survive restarts. Entries older than
+    ``ttl_seconds`` are treated as misses; once more than ``max_entries`` are
+    stored the least recently used ones are evicted.
+    """
+
+    def __init__(self, path=None, max_entries=None, ttl_seconds=None, enabled=None):
+        self.path = path or Config.PREDICTION_CACHE_PATH
+        self.max_entries = max_entries or Config.PREDICTION_CACHE_MAX_ENTRIES
+        self.ttl_seconds = Config.PREDICTION_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.enabled = Config.PREDICTION_CACHE_ENABLED if enabled is None else enabled
+        self.version = gl_map_version()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                " key TEXT PRIMARY KEY,"
+                " prediction TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_predictions_last_used ON predictions (last_used)")
+        return self._conn
+
+    def _key(self, expense_details):
+        return f"{self.version}:{expense_fingerprint(expense_details)}"
+
+    def get(self, expense_details):
+        """Return the cached prediction for a row, or None"""
+        return self.get_many([expense_details])[0]
+
+    def get_many(self, rows):
+        """Look up several rows at once; misses are None"""
+        if not self.enabled:
+            return [None] * len(rows)
+
+        keys = [self._key(row) for row in rows]
+        now = time.time()
+        found = {}
+        with self._lock:
+            conn = self._connection()
+            unique_keys = list(set(keys))
+            for start in range(0, len(unique_keys), 500):
+                chunk = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for key, prediction, created_at in conn.execute(
+                    f"SELECT key, prediction, created_at FROM predictions WHERE key IN ({placeholders})", chunk
+                ):
+                    if now - created_at <= self.ttl_seconds:
+                        found[key] = prediction
+            if found:
+                conn.executemany("UPDATE predictions SET last_used = ? WHERE key = ?",
+                                 [(now, key) for key in found])
+                conn.commit()
+
+            results = [json.loads(found[key]) if key in found else None for key in keys]
+            hits = sum(result is not None for result in results)
+            self.hits += hits
+            self.misses += len(rows) - hits
+        return results
+
+    def set(self, expense_details, prediction):
+        self.set_many([expense_details], [prediction])
+
+    def set_many(self, rows, predictions):
+        """Store predictions for rows, skipping ones that are not valid G/L accounts"""
+        if not self.enabled:
+            return
+
+        now = time.time()
+        entries = [
+            (self._key(row), json.dumps(prediction), now, now)
+            for row, prediction in zip(rows, predictions)
+            if is_cacheable(prediction)
+        ]
+        if not entries:
+            return
+        with self._lock:
+            conn = self._connection()
+            conn.executemany("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)", entries)
+            self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM predictions WHERE created_at < ?", (now - self.ttl_seconds,))
+        (count,) = conn.execute("SELECT COUNT(*) FROM predictions").fetchone()
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM predictions WHERE key IN "
+                "(SELECT key FROM predictions ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,)
+            )
+            logger.info(f"Evicted {count - self.max_entries} least recently used cache entries")
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM predictions")
+            conn.commit()
+
+    def stats(self):
+        """Hit/miss counters since startup and current entry count"""
+        size = 0
+        if self.enabled:
+            with self._lock:
+                (size,) = self._connection().execute("SELECT COUNT(*) FROM predictions").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": size, "enabled": self.enabled}
+
+
+def is_cacheable(prediction):
+    """Only real G/L accounts are cached; errors and parse fallbacks are not"""
+    return (
+        prediction is not None
+        and prediction.get("gl_account_number") in Config.GL_ACCOUNT_MAP
+        and str(prediction.get("confidence_score")) not in ("0", "0.0")
+        and not str(prediction.get("reasoning", "")).startswith("Error")
+    )
+
+
+# Global prediction cache instance
+prediction_cache = PredictionCache()
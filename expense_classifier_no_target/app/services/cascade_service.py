@@ -0,0 +1,154 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.config import Config
+from app.services.classifier_service import ClassificationEngine
+from app.services.metrics_service import metrics
+from app.utils.helpers import gl_account_str, TEXT_COLUMNS
+from app.utils.logger import logger
+
+SOURCE = "ml_model"
+
+
+class CascadeClassifier:
+    """Two-tier classifier: the gl_target ML model first, the LLM only for uncertain rows.
+
+    Every row is scored in a single vectorized ``predict_proba`` pass. Rows
+    whose top-1 probability is below ``min_confidence`` or whose top-1/top-2
+    margin is below ``min_margin`` are sent to the LLM engine; the rest keep
+    the model's answer; if no LLM model is available (circuit breakers
+    open) they fall back to it too. Without a configured model every row goes
+    to the LLM.
+    """
+
+    def __init__(self, model_path=None, encoder_path=None, min_confidence=None, min_margin=None, engine=None):
+        self.model_path = model_path or Config.GL_MODEL_PATH
+        self.encoder_path = encoder_path or Config.GL_ENCODER_PATH
+        self.min_confidence = Config.CASCADE_MIN_CONFIDENCE if min_confidence is None else min_confidence
+        self.min_margin = Config.CASCADE_MIN_MARGIN if min_margin is None else min_margin
+        self.engine = engine or ClassificationEngine()
+        self.stats = {}
+        self._model = None
+        self._label_encoder = None
+
+    @property
+    def available(self):
+        return bool(self.model_path and self.encoder_path
+                    and os.path.exists(self.model_path) and os.path.exists(self.encoder_path))
+
+    def _load(self):
+        if self._model is None:
+            import joblib
+
+            self._model = joblib.load(self.model_path)
+            self._label_encoder = joblib.load(self.encoder_path)
+            logger.info(f"Loaded cascade model from {self.model_path}")
+        return self._model, self._label_encoder
+
+    def score(self, df):
+        """Score every row with the ML model.
+
+        Returns one prediction per row, or None where the model is not
+        confident enough.
+        """
+        predictions, confident = self._score(df)
+        return [prediction if confident[i] else None for i, prediction in enumerate(predictions)]
+
+    def _score(self, df):
+        """The model's prediction for every row, and whether each is confident enough to keep"""
+        model, label_encoder = self._load()
+        features = pd.DataFrame({
+            "combined_text": df.reindex(columns=TEXT_COLUMNS).fillna("").astype(str).agg(" ".join, axis=1),
+            "Amount": df["Amount"] if "Amount" in df.columns else np.nan
+        })
+        proba = model.predict_proba(features)
+
+        top2 = np.argpartition(proba, -2, axis=1)[:, -2:] if proba.shape[1] > 1 else np.zeros((len(df), 2), dtype=int)
+        top2_proba = np.take_along_axis(proba, top2, axis=1)
+        order = np.argsort(-top2_proba, axis=1)
+        top2 = np.take_along_axis(top2, order, axis=1)
+        top2_proba = np.take_along_axis(top2_proba, order, axis=1)
+        margin = top2_proba[:, 0] - top2_proba[:, 1]
+        class_names = np.array([gl_account_str(label) for label in label_encoder.classes_.tolist()])
+        labels = class_names[model.classes_[top2]]
+        confident = (top2_proba[:, 0] >= self.min_confidence) & (margin >= self.min_margin)
+
+        return [
+            {
+                "gl_account_number": labels[i, 0],
+                "confidence_score": f"{top2_proba[i, 0]:.2f}",
+                "alternative_gl_account_number": labels[i, 1],
+                "reasoning": f"ML model prediction (margin {margin[i]:.2f} over '{labels[i, 1]}')."
+                             + ("" if confident[i] else " LLM unavailable; low-confidence model answer."),
+                "source": SOURCE
+            }
+            for i in range(len(df))
+        ], confident
+
+    def run(self, df, progress_callback=None, progress_every=1):
+        """Classify every row of ``df``, returning predictions in row order.
+
+        Calling ``run`` once per chunk of a file accumulates job totals in
+        ``self.stats``.
+        """
+        total = len(df)
+        predictions = [None] * total
+        # The model's answers for uncertain rows, used if no LLM model is available
+        guesses = [None] * total
+
+        start = time.perf_counter()
+        if self.available and total:
+            try:
+                guesses, confident = self._score(df)
+                predictions = [guess if confident[i] else None for i, guess in enumerate(guesses)]
+            except Exception as e:
+                logger.error(f"Cascade model failed, sending all rows to the LLM: {e}")
+                predictions = [None] * total
+                guesses = [None] * total
+        ml_seconds = time.perf_counter() - start
+
+        uncertain = [i for i, prediction in enumerate(predictions) if prediction is None]
+        ml_rows = total - len(uncertain)
+        if ml_rows:
+            metrics.inc("rows_classified_total", ml_rows, source=SOURCE)
+        if progress_callback and ml_rows:
+            progress_callback(ml_rows)
+
+        start = time.perf_counter()
+        if uncertain:
+            records = df.iloc[uncertain].to_dict(orient="records")
+            llm_predictions = self.engine.run(
+                records,
+                progress_callback=(lambda done: progress_callback(ml_rows + done)) if progress_callback else None,
+                progress_every=progress_every,
+                fallback=[guesses[i] for i in uncertain]
+            )
+            for i, prediction in zip(uncertain, llm_predictions):
+                predictions[i] = prediction
+        llm_seconds = time.perf_counter() - start
+
+        self._accumulate(
+            self.engine.stats if uncertain else {},
+            {"ml_model": (ml_rows, ml_seconds), "llm": (len(uncertain), llm_seconds)},
+            total
+        )
+        return predictions
+
+    def _accumulate(self, engine_stats, tiers, rows):
+        """Add one run's counts to ``self.stats`` so chunked jobs report job totals"""
+        stats = self.stats
+        stats["rows"] = stats.get("rows", 0) + rows
+        for key, value in engine_stats.items():
+            if key not in ("rows", "dedup_ratio"):
+                stats[key] = stats.get(key, 0) + value
+        if "unique_rows" in stats:
+            passed_on = stats["unique_rows"] + stats.get("duplicate_rows", 0)
+            stats["dedup_ratio"] = round(1 - stats["unique_rows"] / passed_on, 4) if passed_on else 0.0
+        totals = stats.setdefault("tiers", {})
+        for tier, (tier_rows, seconds) in tiers.items():
+            tier_totals = totals.setdefault(tier, {"rows": 0, "seconds": 0.0})
+            tier_totals["rows"] += tier_rows
+            tier_totals["seconds"] = round(tier_totals["seconds"] + seconds, 3)
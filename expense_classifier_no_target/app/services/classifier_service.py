@@ -0,0 +1,192 @@
+import asyncio
+
+import aiohttp
+import openai
+
+from app.config import Config
+from app.services.cache_service import prediction_cache
+from app.services.metrics_service import metrics
+from app.services.similarity_service import similarity_index
+from app.services.llm_service import (
+    ModelUnavailable,
+    predict_gl_account_async,
+    predict_gl_accounts_batch_async,
+)
+from app.utils.helpers import expense_fingerprint, TEXT_COLUMNS
+from app.utils.logger import logger
+
+
+def error_prediction(e):
+    """Placeholder prediction for a row that could not be classified"""
+    return {
+        "gl_account_number": "ERROR",
+        "confidence_score": "0.0",
+        "alternative_gl_account_number": "",
+        "reasoning": f"Error: {str(e)[:100]}"
+    }
+
+
+class ClassificationEngine:
+    """Classify many expense rows concurrently against the LLM.
+
+    Rows are fanned out over one shared aiohttp session, bounded by
+    ``max_concurrency`` in-flight requests; the requests/tokens per minute
+    budget, retries and model fallback are handled process-wide by
+    ``llm_service``. With ``batch_size`` > 1 rows are packed ``batch_size`` to a
+    prompt; rows missing from a batched reply are retried one at a time.
+    Rows found in ``cache``, or confidently matched by the nearest-neighbour
+    ``index``, skip the LLM entirely; new LLM predictions are written back to
+    the cache. Results are returned in the same order as the input
+    rows.
+    """
+
+    def __init__(self, max_concurrency=None, batch_size=None, predict=predict_gl_account_async,
+                 predict_batch=predict_gl_accounts_batch_async, cache=prediction_cache, index=similarity_index):
+        self.max_concurrency = max_concurrency or Config.LLM_MAX_CONCURRENCY
+        self.batch_size = batch_size or Config.LLM_BATCH_SIZE
+        self.predict = predict
+        self.predict_batch = predict_batch
+        self.cache = cache
+        self.index = index
+        self.stats = {}
+
+    async def classify(self, rows, progress_callback=None, progress_every=1, fallback=None):
+        """Classify ``rows`` (a list of dicts) and return predictions in input order.
+
+        Rows with identical normalized text (Amount aside) are classified once
+        and the result is copied to every duplicate. ``progress_callback(done)``
+        is called every ``progress_every`` completed rows and once more when all
+        rows are done. ``fallback`` optionally holds a local prediction per row,
+        used when no LLM model is available (every circuit breaker open).
+        """
+        total = len(rows)
+        if not total:
+            return []
+
+        groups = {}
+        for index, row in enumerate(rows):
+            groups.setdefault(expense_fingerprint(row, TEXT_COLUMNS), []).append(index)
+        members = list(groups.values())
+        unique_rows = [rows[indices[0]] for indices in members]
+
+        done = 0
+        reported = 0
+
+        def rows_done(unique_index):
+            nonlocal done, reported
+            done += len(members[unique_index])
+            if progress_callback and (done - reported >= progress_every or done == total):
+                reported = done
+                progress_callback(done)
+
+        unique_fallback = [fallback[indices[0]] for indices in members] if fallback else None
+        unique_predictions = await self._classify_unique(unique_rows, rows_done, unique_fallback)
+
+        predictions = [None] * total
+        for indices, prediction in zip(members, unique_predictions):
+            for index in indices:
+                predictions[index] = prediction
+
+        self.stats["rows"] = total
+        self.stats["unique_rows"] = len(unique_rows)
+        self.stats["duplicate_rows"] = total - len(unique_rows)
+        self.stats["dedup_ratio"] = round(1 - len(unique_rows) / total, 4)
+
+        stats = self.stats
+        for source, count in (("cache", stats["cache_hits"]), ("index", stats["index_hits"]),
+                              ("llm", stats["llm_rows"] - stats["local_fallback_rows"]),
+                              ("local_fallback", stats["local_fallback_rows"]), ("duplicate", stats["duplicate_rows"])):
+            if count:
+                metrics.inc("rows_classified_total", count, source=source)
+        return predictions
+
+    async def _classify_unique(self, rows, row_done, fallback=None):
+        total = len(rows)
+        predictions = [None] * total
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        local_fallbacks = 0
+
+        async def classify_row(index, row):
+            nonlocal local_fallbacks
+            async with semaphore:
+                try:
+                    predictions[index] = await self.predict(row)
+                except Exception as e:
+                    if isinstance(e, ModelUnavailable) and fallback and fallback[index] is not None:
+                        local_fallbacks += 1
+                        predictions[index] = fallback[index]
+                    else:
+                        logger.error(f"Failed to process row {index}: {str(e)}")
+                        predictions[index] = error_prediction(e)
+            row_done(index)
+
+        async def classify_batch(indices):
+            batch = [rows[index] for index in indices]
+            async with semaphore:
+                try:
+                    results = await self.predict_batch(batch)
+                except Exception as e:
+                    logger.error(f"Failed to process batch at row {indices[0]}: {str(e)}")
+                    results = [None] * len(batch)
+
+            retry_rows = []
+            for index, result in zip(indices, results):
+                if result is None:
+                    retry_rows.append(index)
+                else:
+                    predictions[index] = result
+                    row_done(index)
+            if retry_rows:
+                logger.warning(f"Batch at row {indices[0]}: {len(retry_rows)} rows missing or malformed, retrying per row")
+                await asyncio.gather(*(classify_row(index, rows[index]) for index in retry_rows))
+
+        pending = []
+        cached = self.cache.get_many(rows) if self.cache is not None else [None] * total
+        for index, prediction in enumerate(cached):
+            if prediction is None:
+                pending.append(index)
+            else:
+                predictions[index] = prediction
+                row_done(index)
+        cache_hits = total - len(pending)
+
+        if self.index is not None and pending:
+            matched = self.index.predict([rows[index] for index in pending])
+            still_pending = []
+            for index, prediction in zip(pending, matched):
+                if prediction is None:
+                    still_pending.append(index)
+                else:
+                    predictions[index] = prediction
+                    row_done(index)
+            pending = still_pending
+        self.stats = {
+            "cache_hits": cache_hits,
+            "index_hits": total - cache_hits - len(pending),
+            "llm_rows": len(pending)
+        }
+
+        if self.batch_size > 1:
+            jobs = [classify_batch(pending[start:start + self.batch_size])
+                    for start in range(0, len(pending), self.batch_size)]
+        else:
+            jobs = [classify_row(index, rows[index]) for index in pending]
+
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            token = openai.aiosession.set(session)
+            try:
+                await asyncio.gather(*jobs)
+            finally:
+                openai.aiosession.reset(token)
+
+        self.stats["local_fallback_rows"] = local_fallbacks
+        if self.cache is not None and pending:
+            # Fallback answers are the local model's, not the LLM's: keep them out of the cache
+            answered = [index for index in pending if fallback is None or predictions[index] is not fallback[index]]
+            self.cache.set_many([rows[index] for index in answered], [predictions[index] for index in answered])
+        return predictions
+
+    def run(self, rows, progress_callback=None, progress_every=1, fallback=None):
+        """Blocking entry point for worker threads"""
+        return asyncio.run(self.classify(rows, progress_callback, progress_every, fallback))
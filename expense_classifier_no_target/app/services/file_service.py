@@ -1,8 +1,22 @@
-import pandas as pd
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from starlette.concurrency import run_in_threadpool
+from app.config import Config
 from app.utils.logger import logger
 
+# Bytes copied from an upload to disk at a time
+UPLOAD_CHUNK_BYTES = 1 << 20
+
+def file_format(file_path):
+    return os.path.splitext(file_path)[1].lstrip(".").lower()
+
 def process_excel_file(file_path):
     """Read and process the Excel file."""
+    import pandas as pd
+
     try:
         df = pd.read_excel(file_path)
         logger.info(f"Successfully read Excel file: {file_path}")
@@ -11,16 +25,365 @@ def process_excel_file(file_path):
         logger.error(f"Error reading Excel file: {e}")
         raise
 
-def save_predictions(df, predictions, output_filepath):
-    """Save the DataFrame with predictions to an Excel file."""
+def count_rows(file_path):
+    """Cheap data-row count (header excluded) without parsing the whole file.
+
+    xlsx uses the sheet dimensions, CSV counts newlines (an upper bound when
+    quoted fields span lines) and Parquet reads the footer metadata. Returns
+    None when the count cannot be determined cheaply.
+    """
+    extension = file_format(file_path)
+    try:
+        if extension == "xlsx":
+            from openpyxl import load_workbook
+
+            workbook = load_workbook(file_path, read_only=True)
+            try:
+                max_row = workbook.active.max_row
+            finally:
+                workbook.close()
+            return max(0, max_row - 1) if max_row else None
+        if extension == "csv":
+            lines = 0
+            last = b"\n"
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    lines += block.count(b"\n")
+                    last = block[-1:]
+            if last != b"\n":
+                lines += 1
+            return max(0, lines - 1)
+        if extension == "parquet":
+            import pyarrow.parquet as pq
+
+            return pq.ParquetFile(file_path).metadata.num_rows
+    except Exception as e:
+        logger.warning(f"Could not count rows in {file_path}: {e}")
+    return None
+
+# file_digest, save_upload, store_upload, collect_garbage, sheet_names, _xlsx_chunks,
+# OUTPUT_FORMATS and StreamingOutput are duplicated in
+# expense_classifier_gl_target/app/services/file_service.py: the two services are
+# deployed separately and share no package. Keep the copies identical
+# (tests/test_file_service.py checks this).
+
+def file_digest(file_path):
+    """SHA-256 of a file's content, read in 1 MiB blocks"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+async def save_upload(upload, path):
+    """Copy an UploadFile to ``path`` in fixed-size chunks on a worker thread; returns its SHA-256"""
+    def copy():
+        digest = hashlib.sha256()
+        upload.file.seek(0)
+        with open(path, "wb") as buffer:
+            for block in iter(lambda: upload.file.read(UPLOAD_CHUNK_BYTES), b""):
+                digest.update(block)
+                buffer.write(block)
+        return digest.hexdigest()
+    return await run_in_threadpool(copy)
+
+async def store_upload(upload, directory):
+    """Save an UploadFile under ``directory`` as <sha256>.<extension>, one file per distinct content.
+
+    The content is hashed while it is copied; returns (path, sha256).
+    """
+    temp_path = os.path.join(directory, f"{uuid.uuid4()}.part")
     try:
-        # Add new columns to the DataFrame
-        df["Predicted GL Account"] = [prediction["gl_account_number"] for prediction in predictions]
-        df["Confidence Score"] = [prediction["confidence_score"] for prediction in predictions]
-        df["Alternative GL Account"] = [prediction["alternative_gl_account_number"] for prediction in predictions]
-        df["Reasoning"] = [prediction["reasoning"] for prediction in predictions]
+        digest = await save_upload(upload, temp_path)
+        path = os.path.join(directory, f"{digest}.{file_format(upload.filename)}")
+        # Replacing an identical earlier copy also marks it as recently used
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return path, digest
+
+def collect_garbage(directory, max_bytes, max_age_seconds, in_use=None, now=None):
+    """Bound the disk used by ``directory``.
+
+    Entries (files or directories directly under ``directory``) not modified
+    for ``max_age_seconds`` are removed, then the least recently modified
+    ones until the rest fit in ``max_bytes``; touching an entry marks it as
+    used. Entries for which ``in_use(path)`` is true are never removed.
+    Returns (entries removed, bytes freed).
+    """
+    if not os.path.isdir(directory):
+        return 0, 0
+    now = now or time.time()
+    candidates, total = [], 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                modified = entry.stat(follow_symlinks=False).st_mtime
+                if entry.is_dir(follow_symlinks=False):
+                    size = sum(os.path.getsize(os.path.join(root, name))
+                               for root, _, names in os.walk(entry.path) for name in names)
+                else:
+                    size = entry.stat(follow_symlinks=False).st_size
+            except FileNotFoundError:
+                continue
+            total += size
+            if not (in_use and in_use(entry.path)):
+                candidates.append((modified, size, entry.path))
+
+    removed = freed = 0
+    for modified, size, path in sorted(candidates):
+        if now - modified <= max_age_seconds and total <= max_bytes:
+            break
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+        freed += size
+    return removed, freed
+
+def sheet_names(file_path):
+    """Worksheets of an xlsx/xls file, in workbook order; [None] for single-table formats"""
+    extension = file_format(file_path)
+    if extension == "xlsx":
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(file_path, read_only=True)
+        try:
+            return list(workbook.sheetnames)
+        finally:
+            workbook.close()
+    if extension == "xls":
+        import pandas as pd
+
+        return list(pd.ExcelFile(file_path).sheet_names)
+    return [None]
+
+def _xlsx_chunks(file_path, chunk_size, sheet=None):
+    import pandas as pd
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook.active if sheet is None else workbook[sheet]
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(column) if column is not None else f"Unnamed: {i}" for i, column in enumerate(header)]
+        chunk = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield pd.DataFrame(chunk, columns=columns)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=columns)
+    finally:
+        workbook.close()
+
+def iter_file_chunks(file_path, chunk_size=None, sheet=None):
+    """Yield the rows of an xlsx/xls/csv/parquet file as DataFrames of ``chunk_size`` rows.
+
+    xlsx is read with openpyxl in read-only mode, CSV and Parquet are streamed
+    by pandas/pyarrow, so large files are never fully materialized (legacy .xls
+    is the exception and is read whole). ``sheet`` picks a worksheet by name;
+    the first (active) one is read by default.
+    """
+    import pandas as pd
+
+    chunk_size = chunk_size or Config.INGEST_CHUNK_SIZE
+    extension = file_format(file_path)
+    start = 0
+    try:
+        if extension == "xlsx":
+            chunks = _xlsx_chunks(file_path, chunk_size, sheet)
+        elif extension == "csv":
+            chunks = pd.read_csv(file_path, chunksize=chunk_size)
+        elif extension == "parquet":
+            import pyarrow.parquet as pq
+
+            chunks = (batch.to_pandas() for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunk_size))
+        else:
+            df = pd.read_excel(file_path, sheet_name=0 if sheet is None else sheet)
+            chunks = (df.iloc[i:i + chunk_size] for i in range(0, len(df), chunk_size))
 
-        df.to_excel(output_filepath, index=False)
+        for chunk in chunks:
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk
+        logger.info(f"Successfully streamed {start} rows from: {file_path}")
+    except Exception as e:
+        logger.error(f"Error reading file {file_path}: {e}")
+        raise
+
+OUTPUT_FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet"
+}
+
+def annotate_predictions(df, predictions):
+    """Add the prediction columns to ``df`` (in place) and return it"""
+    df["Predicted GL Account"] = [prediction["gl_account_number"] for prediction in predictions]
+    df["Confidence Score"] = [prediction["confidence_score"] for prediction in predictions]
+    df["Alternative GL Account"] = [prediction["alternative_gl_account_number"] for prediction in predictions]
+    df["Reasoning"] = [prediction["reasoning"] for prediction in predictions]
+    return df
+
+class StreamingOutput:
+    """Append DataFrames to an xlsx/csv/jsonl/parquet file one chunk at a time.
+
+    Rows are written to a temporary file that replaces ``path`` on close, so
+    readers never see a half-written output.
+    """
+
+    def __init__(self, path, output_format=None):
+        self.path = path
+        self.output_format = output_format or file_format(path)
+        if self.output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {self.output_format}")
+        self.temp_path = f"{path}.tmp"
+        self.rows = 0
+        self._workbook = None
+        self._sheet = None
+        self._parquet_writer = None
+
+    def write(self, df):
+        if self.output_format == "xlsx":
+            self._write_xlsx(df)
+        elif self.output_format == "csv":
+            df.to_csv(self.temp_path, mode="a", header=self.rows == 0, index=False)
+        elif self.output_format == "jsonl":
+            with open(self.temp_path, "a", encoding="utf-8") as f:
+                df.to_json(f, orient="records", lines=True, date_format="iso")
+        else:
+            self._write_parquet(df)
+        self.rows += len(df)
+
+    def _write_xlsx(self, df):
+        if self._workbook is None:
+            from openpyxl import Workbook
+
+            self._workbook = Workbook(write_only=True)
+            self._sheet = self._workbook.create_sheet()
+            self._sheet.append([str(column) for column in df.columns])
+        for row in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+            self._sheet.append(row)
+
+    def _write_parquet(self, df):
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # Spreadsheet columns mix types between chunks; pin them to float/string
+        df = df.copy()
+        for column in df.columns:
+            if pd.api.types.is_numeric_dtype(df[column]) and not pd.api.types.is_bool_dtype(df[column]):
+                df[column] = df[column].astype("float64")
+            elif not pd.api.types.is_datetime64_any_dtype(df[column]):
+                df[column] = df[column].map(lambda value: None if pd.isna(value) else str(value))
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(self.temp_path, table.schema)
+        self._parquet_writer.write_table(table.cast(self._parquet_writer.schema))
+
+    def close(self):
+        if self.output_format == "xlsx":
+            if self._workbook is None:
+                import pandas as pd
+
+                self._write_xlsx(pd.DataFrame())
+            self._workbook.save(self.temp_path)
+        elif self._parquet_writer is not None:
+            self._parquet_writer.close()
+        elif not os.path.exists(self.temp_path):
+            open(self.temp_path, "w").close()
+        os.replace(self.temp_path, self.path)
+
+class ResultWriter:
+    """Incremental, resumable writer for a job's annotated results.
+
+    Each finished chunk is flushed straight away to its own Parquet part file
+    under ``parts_root`` (``Config.DATA_DIR/parts`` by default, outside the
+    public static tree); ``finalize`` streams the parts, in order, into the
+    requested output format. A job restarted after a crash only needs to
+    classify the chunks missing from ``completed_chunks()``.
+    """
+
+    def __init__(self, output_filepath, output_format=None, parts_root=None):
+        self.output_filepath = output_filepath
+        self.output_format = output_format or file_format(output_filepath)
+        parts_root = parts_root or os.path.join(Config.DATA_DIR, "parts")
+        self.parts_dir = os.path.join(parts_root, f"{os.path.basename(output_filepath)}.parts")
+        os.makedirs(self.parts_dir, exist_ok=True)
+
+    def _part_path(self, chunk_index):
+        return os.path.join(self.parts_dir, f"part-{chunk_index:06d}.parquet")
+
+    def completed_chunks(self):
+        """Indices of chunks already flushed to disk"""
+        return {
+            int(name[len("part-"):-len(".parquet")])
+            for name in os.listdir(self.parts_dir)
+            if name.startswith("part-") and name.endswith(".parquet")
+        }
+
+    def write_chunk(self, chunk_index, df, predictions):
+        """Annotate a finished chunk and flush it to disk atomically"""
+        import pandas as pd
+
+        part_path = self._part_path(chunk_index)
+        df = annotate_predictions(df, predictions).copy()
+        # Parquet needs one type per column; spreadsheet text columns can mix numbers and strings
+        for column in df.columns[df.dtypes == object]:
+            df[column] = df[column].map(lambda value: None if pd.isna(value) else str(value))
+        df.to_parquet(f"{part_path}.tmp", index=False)
+        os.replace(f"{part_path}.tmp", part_path)
+
+    def finalize(self):
+        """Assemble the parts into the output file and remove them"""
+        import pandas as pd
+
+        try:
+            output = StreamingOutput(self.output_filepath, self.output_format)
+            for chunk_index in sorted(self.completed_chunks()):
+                output.write(pd.read_parquet(self._part_path(chunk_index)))
+            output.close()
+            shutil.rmtree(self.parts_dir, ignore_errors=True)
+            logger.info(f"Successfully saved {output.rows} predictions to: {self.output_filepath}")
+            return output.rows
+        except Exception as e:
+            logger.error(f"Error saving predictions: {e}")
+            raise
+
+def read_result_file(file_path):
+    """Load an output written by StreamingOutput/save_predictions"""
+    import pandas as pd
+
+    extension = file_format(file_path)
+    if extension == "csv":
+        return pd.read_csv(file_path)
+    if extension == "jsonl":
+        return pd.read_json(file_path, lines=True)
+    if extension == "parquet":
+        return pd.read_parquet(file_path)
+    return pd.read_excel(file_path)
+
+def save_predictions(df, predictions, output_filepath):
+    """Save the DataFrame with predictions to an xlsx/csv/jsonl/parquet file."""
+    try:
+        output = StreamingOutput(output_filepath)
+        output.write(annotate_predictions(df, predictions))
+        output.close()
         logger.info(f"Successfully saved predictions to: {output_filepath}")
     except Exception as e:
         logger.error(f"Error saving predictions: {e}")
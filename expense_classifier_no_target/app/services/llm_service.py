@@ -2,152 +2,366 @@
 import openai
 import json
 from app.config import Config
+from app.services import rate_limit_service
+from app.services.cache_service import prediction_cache
+from app.services.metrics_service import metrics
+from app.services.token_service import count_message_tokens, count_tokens, record_usage
+from app.utils.helpers import TEXT_COLUMNS
 from app.utils.logger import logger
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+import asyncio
+import heapq
+import itertools
+import re
 import time
 
 openai.api_key = Config.OPENAI_API_KEY
+openai.api_base = Config.OPENAI_API_BASE
 
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=4, max=10),
-    retry=retry_if_exception_type((openai.error.APIError, openai.error.Timeout, openai.error.RateLimitError))
-)
-def predict_gl_account(expense_details):
-    prompt = f"""
-    You are an expert in GAAP accounting. Based on the following expense details, predict the most appropriate G/L account number from the list below.
-    Only use the provided G/L account numbers and do not make up any new ones.
-
-    G/L Account Numbers and Descriptions:
-    {Config.GL_ACCOUNT_MAP}
-
-    Expense Details:
-    Description: {expense_details.get('Description', '')}
-    Extended Details: {expense_details.get('Extended Details', '')}
-    Appears On Your Statement As: {expense_details.get('Appears On Your Statement As', '')}
-    Address: {expense_details.get('Address', '')}
-    City/State: {expense_details.get('City/State', '')}
-    Country: {expense_details.get('Country', '')}
-    CC Name: {expense_details.get('CC Name', '')}
-    Amount: {expense_details.get('Amount', '')}
-
-    Provide your response in the following format (do not include any additional text or JSON markers):
-    gl_account_number,confidence_score,alternative_gl_account_number,reasoning
-    """
+SYSTEM_PROMPT = "You are an expert in GAAP accounting. Always respond in the exact format requested."
+MAX_RESPONSE_TOKENS = 200
+
+# Expense fields shown to the model, in prompt order
+PROMPT_FIELDS = TEXT_COLUMNS + ["Amount"]
+
+def render_account_table(account_map):
+    """One 'number name' line per G/L account"""
+    return "\n".join(f"{number} {name}" for number, name in account_map.items())
+
+# Rendered once: every prompt embeds the same canonical account table
+ACCOUNT_TABLE = render_account_table(Config.GL_ACCOUNT_MAP)
+
+def _expense_block(expense_details):
+    """'Field: value' lines for the non-empty fields; long Extended Details are truncated"""
+    lines = []
+    for column in PROMPT_FIELDS:
+        value = expense_details.get(column)
+        if value is None or value != value:  # None or NaN
+            continue
+        value = re.sub(r"\s+", " ", str(value)).strip()
+        if not value:
+            continue
+        if column == "Extended Details" and len(value) > Config.PROMPT_MAX_DETAILS_CHARS:
+            value = value[:Config.PROMPT_MAX_DETAILS_CHARS].rstrip() + "..."
+        lines.append(f"{column}: {value}")
+    return "\n".join(lines)
+
+def build_prompt(expense_details):
+    """Build the per-row classification prompt"""
+    return (
+        "Pick the most appropriate G/L account for this expense. Use only these accounts:\n"
+        f"{ACCOUNT_TABLE}\n\n"
+        f"Expense:\n{_expense_block(expense_details)}\n\n"
+        "Reply with one line and nothing else (reasoning under 15 words):\n"
+        "gl_account_number,confidence_score,alternative_gl_account_number,reasoning"
+    )
+
+def build_messages(expense_details):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": build_prompt(expense_details)}
+    ]
+
+def parse_prediction(response_content):
+    """Split a 'gl,confidence,alternative,reasoning' response into a prediction dict"""
+    parts = response_content.split(',', 3)
+    if len(parts) != 4:
+        raise ValueError(f"Expected 4 parts, got {len(parts)}")
 
+    gl_account_number, confidence_score, alternative_gl_account_number, reasoning = parts
+
+    return {
+        "gl_account_number": gl_account_number.strip(),
+        "confidence_score": confidence_score.strip(),
+        "alternative_gl_account_number": alternative_gl_account_number.strip(),
+        "reasoning": reasoning.strip()
+    }
+
+def _parse_or_default(response_content):
     try:
-        logger.info(f"Sending request to OpenAI for expense: {expense_details.get('Description', 'N/A')}")
-        
-        response = openai.ChatCompletion.create(
-            model="gpt-4",  # Make sure you have access to GPT-4
-            messages=[
-                {"role": "system", "content": "You are an expert in GAAP accounting. Always respond in the exact format requested."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            max_tokens=200
-        )
+        return parse_prediction(response_content)
+    except Exception as e:
+        logger.error(f"Error parsing LLM response: {e}. Response was: {response_content}")
+        metrics.inc("llm_parse_errors_total", kind="single")
+        # Return a default response if parsing fails
+        return {
+            "gl_account_number": "67500",  # Default to "Other Costs of Operations"
+            "confidence_score": "0.0",
+            "alternative_gl_account_number": "",
+            "reasoning": f"Error parsing response: {str(e)}"
+        }
 
-        response_content = response.choices[0].message.content.strip()
-        logger.info(f"LLM Response: {response_content}")
+BATCH_RESPONSE_TOKENS_PER_ROW = 80
 
-        # Split the response into components
+def build_batch_prompt(rows):
+    """Build one prompt classifying several expense rows at once"""
+    expense_rows = "\n\n".join(
+        f"Row {number}:\n{_expense_block(row)}" for number, row in enumerate(rows, start=1)
+    )
+    return (
+        "Pick the most appropriate G/L account for each expense row. Use only these accounts:\n"
+        f"{ACCOUNT_TABLE}\n\n"
+        f"{expense_rows}\n\n"
+        "Reply with a JSON array only, one object per row (reasoning under 15 words):\n"
+        '[{"row": 1, "gl_account_number": "...", "confidence_score": 0.0, "alternative_gl_account_number": "...", "reasoning": "..."}]'
+    )
+
+def build_batch_messages(rows):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": build_batch_prompt(rows)}
+    ]
+
+def batch_max_tokens(rows):
+    return BATCH_RESPONSE_TOKENS_PER_ROW * len(rows)
+
+def parse_batch_predictions(response_content, row_count):
+    """Parse a batched JSON reply.
+
+    Returns a list of ``row_count`` predictions in row order; rows that are
+    missing or malformed in the reply are ``None``.
+    """
+    predictions = [None] * row_count
+    start, end = response_content.find("["), response_content.rfind("]")
+    if start == -1 or end <= start:
+        logger.error(f"Batched LLM response is not a JSON array: {response_content[:200]}")
+        metrics.inc("llm_parse_errors_total", kind="batch")
+        return predictions
+    try:
+        items = json.loads(response_content[start:end + 1])
+    except json.JSONDecodeError as e:
+        logger.error(f"Error parsing batched LLM response: {e}")
+        metrics.inc("llm_parse_errors_total", kind="batch")
+        return predictions
+
+    for item in items:
         try:
-            parts = response_content.split(',', 3)
-            if len(parts) != 4:
-                raise ValueError(f"Expected 4 parts, got {len(parts)}")
-            
-            gl_account_number, confidence_score, alternative_gl_account_number, reasoning = parts
-            
-            return {
-                "gl_account_number": gl_account_number.strip(),
-                "confidence_score": confidence_score.strip(),
-                "alternative_gl_account_number": alternative_gl_account_number.strip(),
-                "reasoning": reasoning.strip()
-            }
-        except Exception as e:
-            logger.error(f"Error parsing LLM response: {e}. Response was: {response_content}")
-            # Return a default response if parsing fails
-            return {
-                "gl_account_number": "67500",  # Default to "Other Costs of Operations"
-                "confidence_score": "0.0",
-                "alternative_gl_account_number": "",
-                "reasoning": f"Error parsing response: {str(e)}"
+            index = int(item["row"]) - 1
+            if not 0 <= index < row_count or predictions[index] is not None:
+                continue
+            gl_account_number = str(item["gl_account_number"]).strip()
+            if not gl_account_number:
+                continue
+            predictions[index] = {
+                "gl_account_number": gl_account_number,
+                "confidence_score": str(item.get("confidence_score", "0.0")).strip(),
+                "alternative_gl_account_number": str(item.get("alternative_gl_account_number") or "").strip(),
+                "reasoning": str(item.get("reasoning", "")).strip()
             }
-            
-    except openai.error.InvalidRequestError as e:
+        except (KeyError, TypeError, ValueError):
+            continue
+    return predictions
+
+RETRYABLE_ERRORS = (
+    openai.error.APIError, openai.error.Timeout, openai.error.RateLimitError,
+    openai.error.APIConnectionError, openai.error.ServiceUnavailableError
+)
+
+class ModelUnavailable(Exception):
+    """Every configured model's circuit breaker is open"""
+
+def estimate_request_tokens(messages, max_tokens):
+    """Most tokens a request can use (prompt + completion), reserved from the rate budget"""
+    return count_message_tokens(messages) + max_tokens
+
+def _route():
+    """The primary model unless its breaker is open, then the fallback"""
+    for model in (Config.LLM_PRIMARY_MODEL, Config.LLM_FALLBACK_MODEL):
+        breaker = rate_limit_service.llm_breakers.get(model)
+        if breaker is not None and breaker.allow():
+            if model != Config.LLM_PRIMARY_MODEL:
+                metrics.inc("llm_fallbacks_total", model=model)
+            return model
+    raise ModelUnavailable("All LLM models are failing; try again later")
+
+def _request_params(model, messages, max_tokens):
+    return {"model": model, "messages": messages, "temperature": 0.3, "max_tokens": max_tokens}
+
+def _on_success(model, messages, response, seconds):
+    metrics.observe("llm_request_seconds", seconds, model=model, outcome="ok")
+    rate_limit_service.llm_breakers[model].record_success()
+    # Headers describe the quota of the model that answered; the shared budget tracks the primary's
+    if model == Config.LLM_PRIMARY_MODEL:
+        rate_limit_service.llm_rate_limiter.observe(response._headers)
+    content = response.data["choices"][0]["message"]["content"].strip()
+    # Billed counts when the API reports them, local counts otherwise
+    usage = response.data.get("usage") or {}
+    prompt_tokens = usage.get("prompt_tokens") or count_message_tokens(messages, model)
+    completion_tokens = usage.get("completion_tokens") or count_tokens(content, model)
+    record_usage(model, prompt_tokens, completion_tokens)
+    metrics.inc("llm_tokens_total", prompt_tokens, model=model, kind="prompt")
+    metrics.inc("llm_tokens_total", completion_tokens, model=model, kind="completion")
+    return content
+
+def _on_failure(model, e, attempt, seconds):
+    """Record a failed attempt; returns the seconds to wait before retrying, or raises"""
+    metrics.observe("llm_request_seconds", seconds, model=model, outcome=type(e).__name__)
+    if isinstance(e, openai.error.InvalidRequestError):
+        if model.lower() in str(e).lower():
+            # No access to this model: stop routing to it until the breaker resets
+            logger.error(f"Model {model} rejected the request, switching models: {e}")
+            rate_limit_service.llm_breakers[model].open()
+            return 0.0
         logger.error(f"Invalid request to OpenAI API: {e}")
-        # If it's a model access issue, fall back to gpt-3.5-turbo
-        if "gpt-4" in str(e).lower():
-            logger.info("Falling back to gpt-3.5-turbo")
-            return predict_with_gpt35(expense_details)
         raise Exception(f"OpenAI API error: {e}")
-    except Exception as e:
+    if not isinstance(e, RETRYABLE_ERRORS):
         logger.error(f"Error calling OpenAI API: {e}")
         raise Exception(f"Error calling OpenAI API: {e}")
 
-def predict_with_gpt35(expense_details):
-    """Fallback function using GPT-3.5-turbo"""
-    prompt = f"""
-    You are an expert in GAAP accounting. Based on the following expense details, predict the most appropriate G/L account number from the list below.
-    Only use the provided G/L account numbers and do not make up any new ones.
-
-    G/L Account Numbers and Descriptions:
-    {Config.GL_ACCOUNT_MAP}
-
-    Expense Details:
-    Description: {expense_details.get('Description', '')}
-    Extended Details: {expense_details.get('Extended Details', '')}
-    Appears On Your Statement As: {expense_details.get('Appears On Your Statement As', '')}
-    Address: {expense_details.get('Address', '')}
-    City/State: {expense_details.get('City/State', '')}
-    Country: {expense_details.get('Country', '')}
-    CC Name: {expense_details.get('CC Name', '')}
-    Amount: {expense_details.get('Amount', '')}
-
-    Provide your response in the following format (do not include any additional text or JSON markers):
-    gl_account_number,confidence_score,alternative_gl_account_number,reasoning
+    rate_limit_service.llm_breakers[model].record_failure()
+    headers = getattr(e, "headers", None) or {}
+    if model == Config.LLM_PRIMARY_MODEL:
+        rate_limit_service.llm_rate_limiter.observe(headers)
+    if attempt >= Config.LLM_MAX_RETRIES:
+        raise e
+    try:
+        retry_after = float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        retry_after = None
+    delay = rate_limit_service.llm_rate_limiter.backoff(
+        attempt, retry_after, rate_limited=isinstance(e, openai.error.RateLimitError)
+    )
+    logger.warning(f"{model} request failed ({type(e).__name__}), retry {attempt + 1} in {delay:.1f}s")
+    return delay
+
+def complete(messages, max_tokens):
+    """Send a chat completion and return the reply text.
+
+    Every attempt takes its share of the process-wide rate budget and goes to
+    the primary model, or to the fallback while the primary's circuit breaker
+    is open. Transient failures are retried on the shared backoff schedule.
+    Raises ``ModelUnavailable`` when no model can be tried.
+    """
+    tokens = estimate_request_tokens(messages, max_tokens)
+    for attempt in itertools.count():
+        model = _route()
+        rate_limit_service.llm_rate_limiter.acquire_blocking(tokens)
+        start = time.perf_counter()
+        try:
+            response, _, _ = openai.api_requestor.APIRequestor().request(
+                "post", "/chat/completions", _request_params(model, messages, max_tokens)
+            )
+        except Exception as e:
+            time.sleep(_on_failure(model, e, attempt, time.perf_counter() - start))
+            continue
+        return _on_success(model, messages, response, time.perf_counter() - start)
+
+async def complete_async(messages, max_tokens):
+    """Async variant of complete.
+
+    Uses the aiohttp session registered in ``openai.aiosession`` (if any) so
+    concurrent calls share one connection pool.
+    """
+    tokens = estimate_request_tokens(messages, max_tokens)
+    for attempt in itertools.count():
+        model = _route()
+        await rate_limit_service.llm_rate_limiter.acquire(tokens)
+        start = time.perf_counter()
+        try:
+            response, _, _ = await openai.api_requestor.APIRequestor().arequest(
+                "post", "/chat/completions", _request_params(model, messages, max_tokens)
+            )
+        except Exception as e:
+            await asyncio.sleep(_on_failure(model, e, attempt, time.perf_counter() - start))
+            continue
+        return _on_success(model, messages, response, time.perf_counter() - start)
+
+def predict_gl_account(expense_details, bypass_cache=False):
+    if not bypass_cache:
+        cached = prediction_cache.get(expense_details)
+        if cached is not None:
+            return cached
+
+    logger.debug(f"Sending request to OpenAI for expense: {expense_details.get('Description', 'N/A')}")
+    response_content = complete(build_messages(expense_details), MAX_RESPONSE_TOKENS)
+    logger.debug(f"LLM Response: {response_content}")
+
+    prediction = _parse_or_default(response_content)
+    if not bypass_cache:
+        prediction_cache.set(expense_details, prediction)
+    return prediction
+
+async def predict_gl_account_async(expense_details):
+    """Async variant of predict_gl_account"""
+    logger.debug(f"Sending request to OpenAI for expense: {expense_details.get('Description', 'N/A')}")
+    response_content = await complete_async(build_messages(expense_details), MAX_RESPONSE_TOKENS)
+    logger.debug(f"LLM Response: {response_content}")
+    return _parse_or_default(response_content)
+
+def predict_gl_accounts_batch(rows):
+    """Classify several rows with one request.
+
+    Returns predictions in row order, with ``None`` for rows missing or
+    malformed in the reply so the caller can retry them one by one.
     """
-    
+    logger.info(f"Sending batched request to OpenAI for {len(rows)} expenses")
+    response_content = complete(build_batch_messages(rows), batch_max_tokens(rows))
+    return parse_batch_predictions(response_content, len(rows))
+
+async def predict_gl_accounts_batch_async(rows):
+    """Async variant of predict_gl_accounts_batch"""
+    logger.info(f"Sending batched request to OpenAI for {len(rows)} expenses")
+    response_content = await complete_async(build_batch_messages(rows), batch_max_tokens(rows))
+    return parse_batch_predictions(response_content, len(rows))
+
+TOP_K_RESPONSE_TOKENS_PER_ACCOUNT = 25
+
+def _ranked_accounts(k):
+    # At least two accounts are requested so the margin is always top-1 minus top-2
+    return max(k, 2)
+
+def build_top_k_prompt(expense_details, k):
+    """Build a prompt asking for the ``k`` most likely G/L accounts with scores"""
+    k = _ranked_accounts(k)
+    return (
+        f"For this expense, rank the {k} most appropriate G/L accounts. Use only these accounts:\n"
+        f"{ACCOUNT_TABLE}\n\n"
+        f"Expense:\n{_expense_block(expense_details)}\n\n"
+        "Reply with a JSON object only, scores between 0 and 1:\n"
+        '{"predictions": [{"gl_account_number": "...", "score": 0.0}]}'
+    )
+
+def parse_top_k(response_content, k):
+    """Parse a ranked reply into the ``k`` best known accounts and the top-1/top-2 margin.
+
+    Unknown accounts and duplicates are dropped; the ``k`` best are picked
+    with a heap rather than sorting the whole reply.
+    """
+    start, end = response_content.find("{"), response_content.rfind("}")
+    if start == -1 or end <= start:
+        raise ValueError(f"Top-k response is not a JSON object: {response_content[:200]}")
+    items = json.loads(response_content[start:end + 1]).get("predictions", [])
+
+    scores = {}
+    for item in items:
+        try:
+            gl_account_number = str(item["gl_account_number"]).strip()
+            score = min(1.0, max(0.0, float(item.get("score", 0.0))))
+        except (KeyError, TypeError, ValueError):
+            continue
+        if gl_account_number in Config.GL_ACCOUNT_MAP:
+            scores[gl_account_number] = max(score, scores.get(gl_account_number, 0.0))
+
+    ranked = heapq.nlargest(_ranked_accounts(k), scores.items(), key=lambda item: item[1])
+    predictions = [{"gl_account_number": gl, "score": round(score, 4)} for gl, score in ranked[:k]]
+    margin = ranked[0][1] - (ranked[1][1] if len(ranked) > 1 else 0.0) if ranked else 0.0
+    return {"predictions": predictions, "margin": round(margin, 4)}
+
+async def predict_top_k_async(expense_details, k=3):
+    """Top-k accounts for one row; failures come back as an empty ranking with an ``error``"""
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are an expert in GAAP accounting. Always respond in the exact format requested."},
-                {"role": "user", "content": prompt}
+        response_content = await complete_async(
+            [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": build_top_k_prompt(expense_details, k)}
             ],
-            temperature=0.3,
-            max_tokens=200
+            TOP_K_RESPONSE_TOKENS_PER_ACCOUNT * _ranked_accounts(k)
         )
-        
-        response_content = response.choices[0].message.content.strip()
-        parts = response_content.split(',', 3)
-        
-        if len(parts) == 4:
-            gl_account_number, confidence_score, alternative_gl_account_number, reasoning = parts
-            return {
-                "gl_account_number": gl_account_number.strip(),
-                "confidence_score": confidence_score.strip(),
-                "alternative_gl_account_number": alternative_gl_account_number.strip(),
-                "reasoning": reasoning.strip()
-            }
-        else:
-            # Return default response
-            return {
-                "gl_account_number": "67500",
-                "confidence_score": "0.0",
-                "alternative_gl_account_number": "",
-                "reasoning": "Fallback response due to parsing error"
-            }
+        return parse_top_k(response_content, k)
     except Exception as e:
-        logger.error(f"Error with GPT-3.5 fallback: {e}")
-        # Return a safe default response
-        return {
-            "gl_account_number": "67500",
-            "confidence_score": "0.0",
-            "alternative_gl_account_number": "",
-            "reasoning": f"Error with API: {str(e)[:100]}"
-        }
+        logger.error(f"Error getting top-k predictions: {e}")
+        if isinstance(e, ValueError):
+            metrics.inc("llm_parse_errors_total", kind="top_k")
+        return {"predictions": [], "margin": 0.0, "error": str(e)[:200]}
 
 
 # import openai
@@ -0,0 +1,219 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from app.config import Config
+from app.utils.logger import logger
+
+# Histogram bucket upper bounds in seconds: LLM calls sit in the low buckets, whole jobs in the high ones
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+# Every metric the app reports: name -> (type, help)
+METRICS = {
+    "upload_parse_seconds": ("histogram", "Time to read and parse one chunk of an upload"),
+    "upload_parse_errors_total": ("counter", "Uploads that could not be read"),
+    "upload_results_reused_total": ("counter", "Uploads answered with the stored result of an identical earlier upload"),
+    "storage_removed_bytes_total": ("counter", "Bytes of uploads, results and result parts removed by garbage collection"),
+    "classify_chunk_seconds": ("histogram", "Time to classify one chunk of an upload"),
+    "llm_request_seconds": ("histogram", "Latency of one LLM request, by model and outcome"),
+    "llm_tokens_total": ("counter", "LLM tokens used, by model and kind"),
+    "llm_fallbacks_total": ("counter", "Requests sent to the fallback model while the primary's breaker was open"),
+    "llm_parse_errors_total": ("counter", "LLM replies that could not be parsed, by prompt kind"),
+    "rows_classified_total": ("counter", "Rows classified, by where the answer came from"),
+    "result_write_seconds": ("histogram", "Time to write result rows, by output format and step"),
+    "job_queue_wait_seconds": ("histogram", "Time a job waited in the queue before a worker claimed it"),
+    "job_duration_seconds": ("histogram", "Time a worker spent on one job attempt, by outcome"),
+    "jobs": ("gauge", "Jobs in the queue, by status"),
+}
+
+
+def _labels_key(labels):
+    return json.dumps(labels, sort_keys=True)
+
+
+def _format_labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class MetricsRegistry:
+    """Counters and histograms shared by the web process and the workers.
+
+    Observations are added up in memory and merged into one SQLite (WAL)
+    table at most every ``Config.METRICS_FLUSH_SECONDS``, so recording a
+    metric never waits on disk. ``render`` flushes this process and returns
+    the totals of every process in the Prometheus text format.
+    """
+
+    def __init__(self, path=None, flush_seconds=None, enabled=None):
+        self.path = path or Config.METRICS_PATH
+        self.flush_seconds = Config.METRICS_FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        self.enabled = Config.METRICS_ENABLED if enabled is None else enabled
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pending = {}  # (name, labels key, sample) -> value not yet written
+        self._last_flush = time.monotonic()
+
+    def _connection(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS samples ("
+                " name TEXT NOT NULL,"
+                " labels TEXT NOT NULL,"
+                " sample TEXT NOT NULL,"
+                " value REAL NOT NULL,"
+                " PRIMARY KEY (name, labels, sample))"
+            )
+        return self._conn
+
+    def _add(self, entries):
+        if not self.enabled:
+            return
+        with self._lock:
+            for key, value in entries:
+                self._pending[key] = self._pending.get(key, 0) + value
+            due = time.monotonic() - self._last_flush >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def inc(self, name, value=1, **labels):
+        """Add ``value`` to a counter"""
+        self._add([((name, _labels_key(labels), "total"), value)])
+
+    def observe(self, name, value, **labels):
+        """Record one histogram observation (in seconds)"""
+        bucket = next((str(bound) for bound in BUCKETS if value <= bound), "+Inf")
+        key = _labels_key(labels)
+        self._add([((name, key, bucket), 1), ((name, key, "sum"), value), ((name, key, "count"), 1)])
+
+    @contextmanager
+    def time(self, name, **labels):
+        """Observe the duration of the block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def flush(self):
+        """Merge this process's pending observations into the shared table"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+            if not pending:
+                return
+            try:
+                with self._connection() as conn:
+                    conn.executemany(
+                        "INSERT INTO samples (name, labels, sample, value) VALUES (?, ?, ?, ?)"
+                        " ON CONFLICT (name, labels, sample) DO UPDATE SET value = value + excluded.value",
+                        [(name, labels, sample, value) for (name, labels, sample), value in pending.items()]
+                    )
+            except sqlite3.Error as e:
+                logger.warning(f"Could not store metrics: {e}")
+
+    def snapshot(self):
+        """Stored totals as {(name, labels key): {sample: value}}"""
+        self.flush()
+        with self._lock:
+            rows = self._connection().execute("SELECT name, labels, sample, value FROM samples").fetchall()
+        series = {}
+        for name, labels, sample, value in rows:
+            series.setdefault((name, labels), {})[sample] = value
+        return series
+
+    def render(self, gauges=None):
+        """Every metric in the Prometheus text format.
+
+        ``gauges`` maps a gauge name to [(labels, value)] read at scrape time.
+        """
+        series = self.snapshot() if self.enabled else {}
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            if kind == "gauge":
+                for labels, value in (gauges or {}).get(name, []):
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            for (series_name, key), samples in sorted(series.items()):
+                if series_name != name:
+                    continue
+                labels = json.loads(key)
+                if kind == "counter":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(samples['total'])}")
+                    continue
+                cumulative = 0
+                for bound in [str(bound) for bound in BUCKETS] + ["+Inf"]:
+                    cumulative += samples.get(bound, 0)
+                    lines.append(f"{name}_bucket{_format_labels(labels, le=bound)} {_format_value(cumulative)}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(samples.get('sum', 0))}")
+                lines.append(f"{name}_count{_format_labels(labels)} {_format_value(samples.get('count', 0))}")
+        return "\n".join(lines) + "\n"
+
+
+class StageTimings:
+    """Seconds one job spent in each stage, reported in its task stats.
+
+    Pass the timings of an earlier attempt to keep adding to them. Stages can
+    also feed a histogram of the shared registry.
+    """
+
+    def __init__(self, **seconds):
+        seconds.pop("total", None)
+        self.seconds = seconds
+
+    def add(self, stage, seconds):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, stage, metric=None, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.add(stage, elapsed)
+            if metric:
+                metrics.observe(metric, elapsed, **labels)
+
+    def iterate(self, iterable, stage, metric=None, errors=None, **labels):
+        """Yield from ``iterable``, timing each step (e.g. reading the next chunk of a file).
+
+        A step that raises adds one to the ``errors`` counter, if given.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(stage, metric, **labels):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                except Exception:
+                    if errors:
+                        metrics.inc(errors, **labels)
+                    raise
+            yield item
+
+    def as_dict(self):
+        timings = {stage: round(seconds, 3) for stage, seconds in self.seconds.items()}
+        timings["total"] = round(sum(self.seconds.values()), 3)
+        return timings
+
+
+# Global metrics registry
+metrics = MetricsRegistry()
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import time
+from collections import deque
+
+from app.config import Config
+from app.services.task_service import task_manager
+from app.utils.logger import logger
+
+FINISHED = ("completed", "failed")
+KEEPALIVE = object()
+
+
+class _Channel:
+    """Progress feed for one task, shared by all of its subscribers"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.wake = asyncio.Event()
+        self.subscribers = set()
+        self.samples = deque(maxlen=30)  # (time, processed_rows) for the throughput estimate
+        self.last = None  # last published snapshot without the rate fields, for change detection
+        self.latest = None
+        self.published = False
+        self.poller = None
+
+
+class ProgressBroadcaster:
+    """Fan task progress out to any number of SSE subscribers.
+
+    Each task with at least one subscriber gets a single poller that reads
+    the task store and publishes snapshots that changed, so a hundred open
+    tabs cost one store read per interval rather than a hundred. Progress
+    reported in this process (embedded workers) wakes the poller straight
+    away; workers in other processes are picked up on the next interval.
+    Every subscriber holds only the latest snapshot, so slow clients skip
+    intermediate updates instead of queueing them.
+    """
+
+    def __init__(self, store=None, interval=None):
+        self.store = store or task_manager
+        self.interval = interval or Config.PROGRESS_POLL_SECONDS
+        self._channels = {}
+        self.store.add_listener(self._notify)
+
+    def _notify(self, task_id):
+        # Called from worker threads by TaskManager
+        channel = self._channels.get(task_id)
+        if channel is not None:
+            channel.loop.call_soon_threadsafe(channel.wake.set)
+
+    def snapshot(self, task_id, channel=None):
+        """Task status with throughput (rows/s) and ETA (s) added, or None if unknown"""
+        task = self.store.get_task(task_id)
+        if task is None:
+            return None
+        now = time.time()
+        processed, total = task.get("processed_rows", 0), task.get("total_rows", 0)
+        rate = None
+        if channel is not None:
+            channel.samples.append((now, processed))
+            (first_time, first_rows) = channel.samples[0]
+            if now - first_time >= 1 and processed > first_rows:
+                rate = (processed - first_rows) / (now - first_time)
+        if rate is None and processed and now > task["start_time"]:
+            rate = processed / (now - task["start_time"])
+        return {
+            "status": task["status"],
+            "progress": task["progress"],
+            "processed_rows": processed,
+            "total_rows": total,
+            "rows_per_second": round(rate, 2) if rate else None,
+            "eta_seconds": round(max(0, total - processed) / rate, 1) if rate and task["status"] == "processing" else None,
+            "preview": task.get("preview", []),
+            "result_file": task.get("result_file"),
+            "error": task.get("error"),
+            "stats": task.get("stats", {})
+        }
+
+    def _publish(self, channel, snapshot):
+        channel.latest = snapshot
+        channel.published = True
+        for queue in channel.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(snapshot)
+
+    async def _poll(self, task_id, channel):
+        try:
+            while channel.subscribers:
+                snapshot = await asyncio.to_thread(self.snapshot, task_id, channel)
+                comparable = snapshot and {k: v for k, v in snapshot.items() if k not in ("rows_per_second", "eta_seconds")}
+                # The first snapshot is always sent, including None for an unknown task
+                if not channel.published or comparable != channel.last:
+                    channel.last = comparable
+                    self._publish(channel, snapshot)
+                if snapshot is None or snapshot["status"] in FINISHED:
+                    return
+                channel.wake.clear()
+                try:
+                    await asyncio.wait_for(channel.wake.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+        except Exception as e:
+            logger.error(f"Progress poller for task {task_id} failed: {e}")
+            self._publish(channel, None)
+        finally:
+            if self._channels.get(task_id) is channel:
+                del self._channels[task_id]
+
+    def _join(self, task_id):
+        channel = self._channels.get(task_id)
+        if channel is None:
+            channel = self._channels[task_id] = _Channel(asyncio.get_running_loop())
+        queue = asyncio.Queue(maxsize=1)
+        if channel.published:
+            # Late joiners start from what the others last saw
+            queue.put_nowait(channel.latest)
+        channel.subscribers.add(queue)
+        if channel.poller is None or channel.poller.done():
+            channel.poller = asyncio.create_task(self._poll(task_id, channel))
+        return channel, queue
+
+    async def subscribe(self, task_id, keepalive=None):
+        """Yield snapshots as the task progresses; ends after it finishes (or with None if unknown).
+
+        With ``keepalive`` set, ``KEEPALIVE`` is yielded whenever that many
+        seconds pass without an update.
+        """
+        channel, queue = self._join(task_id)
+        try:
+            while True:
+                try:
+                    snapshot = await asyncio.wait_for(queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield KEEPALIVE
+                    continue
+                yield snapshot
+                if snapshot is None or snapshot["status"] in FINISHED:
+                    return
+        finally:
+            channel.subscribers.discard(queue)
+
+    async def stream(self, task_id, keepalive=None):
+        """Server-Sent Events for ``task_id``, with a comment line as keep-alive"""
+        async for snapshot in self.subscribe(task_id, keepalive or Config.PROGRESS_KEEPALIVE_SECONDS):
+            if snapshot is KEEPALIVE:
+                yield ": keep-alive\n\n"
+            elif snapshot is None:
+                yield f"event: not_found\ndata: {json.dumps({'status': 'not_found'})}\n\n"
+            else:
+                yield f"event: progress\ndata: {json.dumps(snapshot)}\n\n"
+
+
+# Global progress broadcaster instance
+progress_broadcaster = ProgressBroadcaster()
@@ -0,0 +1,176 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from app.config import Config
+from app.services.metrics_service import metrics
+from app.utils.logger import logger
+
+
+class JobQueue:
+    """Durable SQLite job queue shared by the web process and the workers.
+
+    ``claim`` hands out the highest-priority queued job; among equal
+    priorities it prefers the user with the fewest running jobs, then the
+    oldest job, so one large uploader cannot starve everyone else. Workers
+    heartbeat their running jobs; a job whose worker stopped heartbeating
+    (crash, restart) is put back in the queue by ``requeue_stale``. Failed
+    jobs are retried with a linear backoff up to ``max_attempts``.
+    """
+
+    def __init__(self, path=None, max_attempts=None, stale_seconds=None, max_running_per_user=None):
+        self.path = path or Config.JOB_QUEUE_PATH
+        self.max_attempts = max_attempts or Config.JOB_MAX_ATTEMPTS
+        self.stale_seconds = stale_seconds or Config.JOB_STALE_SECONDS
+        self.max_running_per_user = max_running_per_user or Config.JOB_MAX_RUNNING_PER_USER
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # isolation_level=None: transactions are opened explicitly with BEGIN IMMEDIATE
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY,"
+                " user TEXT NOT NULL,"
+                " priority INTEGER NOT NULL DEFAULT 0,"
+                " status TEXT NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " error TEXT,"
+                " worker_id TEXT,"
+                " enqueued_at REAL NOT NULL,"
+                " available_at REAL NOT NULL,"
+                " heartbeat_at REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, priority, enqueued_at)")
+        return self._conn
+
+    def enqueue(self, job_id, payload, user="anonymous", priority=0):
+        now = time.time()
+        with self._lock:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO jobs (job_id, user, priority, status, payload, enqueued_at, available_at)"
+                " VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, user, priority, json.dumps(payload), now, now)
+            )
+        logger.info(f"Queued job {job_id} for {user} (priority {priority})")
+
+    def claim(self, worker_id):
+        """Atomically take the next runnable job; returns (job_id, payload, attempt) or None"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT j.job_id, j.payload, j.attempts, j.available_at FROM jobs j"
+                    " LEFT JOIN (SELECT user, COUNT(*) AS running FROM jobs"
+                    "            WHERE status = 'running' GROUP BY user) r ON r.user = j.user"
+                    " WHERE j.status = 'queued' AND j.available_at <= ? AND COALESCE(r.running, 0) < ?"
+                    " ORDER BY j.priority DESC, COALESCE(r.running, 0) ASC, j.enqueued_at ASC LIMIT 1",
+                    (now, self.max_running_per_user)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                job_id, payload, attempts, available_at = row
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker_id = ?, attempts = attempts + 1, heartbeat_at = ?"
+                    " WHERE job_id = ?",
+                    (worker_id, now, job_id)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        metrics.observe("job_queue_wait_seconds", max(0.0, now - available_at))
+        return job_id, json.loads(payload), attempts + 1
+
+    def heartbeat(self, job_ids):
+        if not job_ids:
+            return
+        with self._lock:
+            self._connection().executemany(
+                "UPDATE jobs SET heartbeat_at = ? WHERE job_id = ? AND status = 'running'",
+                [(time.time(), job_id) for job_id in job_ids]
+            )
+
+    def complete(self, job_id):
+        with self._lock:
+            self._connection().execute(
+                "UPDATE jobs SET status = 'done', error = NULL, heartbeat_at = ? WHERE job_id = ?",
+                (time.time(), job_id)
+            )
+
+    def fail(self, job_id, error, retry=True):
+        """Record a failed attempt; returns True if the job will be retried"""
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT attempts FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            retry = retry and row is not None and row[0] < self.max_attempts
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, available_at = ? WHERE job_id = ?",
+                ("queued" if retry else "failed", str(error)[:1000],
+                 time.time() + Config.JOB_RETRY_BACKOFF_SECONDS * (row[0] if row else 1), job_id)
+            )
+        return retry
+
+    def requeue_stale(self):
+        """Put running jobs whose worker stopped heartbeating back in the queue.
+
+        The claim that started the job counted as an attempt, so a job that
+        keeps killing its worker (out of memory, segfault) is failed once it
+        has used ``max_attempts``. Returns the ids of the jobs failed this way.
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                stale = conn.execute(
+                    "SELECT job_id, attempts FROM jobs WHERE status = 'running' AND heartbeat_at < ?",
+                    (time.time() - self.stale_seconds,)
+                ).fetchall()
+                exhausted = [job_id for job_id, attempts in stale if attempts >= self.max_attempts]
+                conn.executemany(
+                    "UPDATE jobs SET status = ?, worker_id = NULL, error = ? WHERE job_id = ?",
+                    [
+                        ("failed", "Worker stopped while running the job", job_id) if attempts >= self.max_attempts
+                        else ("queued", None, job_id)
+                        for job_id, attempts in stale
+                    ]
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if len(stale) > len(exhausted):
+            logger.info(f"Requeued {len(stale) - len(exhausted)} jobs from stopped workers")
+        if exhausted:
+            logger.error(f"Failed {len(exhausted)} jobs that stopped their worker {self.max_attempts} times: {exhausted}")
+        return exhausted
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT job_id, user, priority, status, attempts, error FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("job_id", "user", "priority", "status", "attempts", "error"), row))
+
+    def counts(self):
+        """Number of jobs per status"""
+        with self._lock:
+            return dict(self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+# Global job queue instance
+job_queue = JobQueue()
@@ -0,0 +1,214 @@
+import asyncio
+import random
+import re
+import threading
+import time
+
+from app.config import Config
+from app.utils.logger import logger
+
+
+def parse_reset(value):
+    """Seconds in an x-ratelimit-reset-* header ("20ms", "1s", "6m0s", "1h2m3.5s")"""
+    if value is None:
+        return None
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", str(value))
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+def _header(headers, name):
+    try:
+        value = headers.get(name) if headers else None
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Per-minute quota refilled continuously and capped at ``burst_seconds`` of quota.
+
+    ``reserve`` takes the cost up front (the level may go negative) and returns
+    how long the caller must wait, so concurrent callers are spaced out in the
+    order they asked instead of all retrying when the window turns over.
+    """
+
+    def __init__(self, per_minute, burst_seconds):
+        self.per_minute = per_minute
+        self.burst_seconds = burst_seconds
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def rate(self):
+        return self.per_minute / 60.0
+
+    @property
+    def capacity(self):
+        return max(1.0, self.rate * self.burst_seconds)
+
+    def reserve(self, cost, now):
+        if now > self.updated:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+        self.level -= cost
+        ready_at = self.updated + max(0.0, -self.level) / self.rate
+        return max(0.0, ready_at - now)
+
+    def pause(self, until):
+        """Hand out nothing before ``until``; quota refills from then on"""
+        self.level = min(self.level, 0.0)
+        self.updated = max(self.updated, until)
+
+
+class AdaptiveRateLimiter:
+    """Requests and tokens per minute budget shared by every LLM call in the process.
+
+    Both budgets start from ``LLM_REQUESTS_PER_MINUTE``/``LLM_TOKENS_PER_MINUTE``
+    and follow the ``x-ratelimit-*`` headers of each response: the limits
+    become the server's (scaled by ``headroom``), and a ``remaining`` count
+    below the local level (other processes share the API key) lowers it. A
+    rate-limited reply pauses every caller until ``Retry-After`` (or an
+    exponential backoff), stretched by a random jitter so processes do not
+    come back in lockstep.
+
+    The lock is a thread lock and waits happen outside it, so callers on
+    different threads and event loops (one ``asyncio.run`` per worker thread)
+    share the same budget.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, burst_seconds=None, headroom=None,
+                 retry_base_seconds=None, retry_max_seconds=None):
+        burst_seconds = burst_seconds or Config.LLM_BURST_SECONDS
+        self.requests = TokenBucket(requests_per_minute or Config.LLM_REQUESTS_PER_MINUTE, burst_seconds)
+        self.tokens = TokenBucket(tokens_per_minute or Config.LLM_TOKENS_PER_MINUTE, burst_seconds)
+        self.headroom = headroom or Config.LLM_RATE_HEADROOM
+        self.retry_base_seconds = retry_base_seconds or Config.LLM_RETRY_BASE_SECONDS
+        self.retry_max_seconds = retry_max_seconds or Config.LLM_RETRY_MAX_SECONDS
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens):
+        """Take one request and ``tokens`` from the budget; returns the seconds to wait before sending"""
+        with self._lock:
+            now = time.monotonic()
+            return max(self.requests.reserve(1, now), self.tokens.reserve(tokens, now))
+
+    async def acquire(self, tokens):
+        delay = self.reserve(tokens)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def acquire_blocking(self, tokens):
+        delay = self.reserve(tokens)
+        if delay:
+            time.sleep(delay)
+
+    def observe(self, headers):
+        """Adjust the budgets to the rate limit headers of a response"""
+        with self._lock:
+            now = time.monotonic()
+            for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+                limit = _header(headers, f"x-ratelimit-limit-{kind}")
+                if limit:
+                    bucket.per_minute = limit * self.headroom
+                remaining = _header(headers, f"x-ratelimit-remaining-{kind}")
+                if remaining is None:
+                    continue
+                if remaining <= 0:
+                    reset = parse_reset(headers.get(f"x-ratelimit-reset-{kind}"))
+                    bucket.pause(now + (reset if reset is not None else self.retry_base_seconds))
+                elif remaining < bucket.level:
+                    bucket.level = remaining
+
+    def backoff(self, attempt, retry_after=None, rate_limited=False):
+        """Schedule the retry of a failed call; returns the seconds the caller should wait.
+
+        A rate-limited failure pauses everybody, not just the caller. Each
+        caller then waits a full-jitter exponential delay so retries are spread
+        out rather than synchronised.
+        """
+        delay = min(self.retry_max_seconds, self.retry_base_seconds * 2 ** attempt)
+        if rate_limited:
+            pause = (retry_after if retry_after is not None else delay) * random.uniform(1.0, 1.25)
+            with self._lock:
+                self.rate_limited += 1
+                until = time.monotonic() + pause
+                self.requests.pause(until)
+                self.tokens.pause(until)
+            logger.warning(f"LLM rate limited; pausing all requests for {pause:.1f}s")
+        return random.uniform(0, delay)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests_per_minute": round(self.requests.per_minute, 1),
+                "tokens_per_minute": round(self.tokens.per_minute, 1),
+                "rate_limited": self.rate_limited
+            }
+
+
+class CircuitBreaker:
+    """Stops calls to a model after ``failure_threshold`` consecutive failures.
+
+    While open, ``allow`` is False so callers route elsewhere; after
+    ``reset_seconds`` a single probe call is let through (half-open) and its
+    outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, name, failure_threshold=None, reset_seconds=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or Config.LLM_BREAKER_FAILURES
+        self.reset_seconds = Config.LLM_BREAKER_RESET_SECONDS if reset_seconds is None else reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info(f"Circuit breaker for {self.name} closed")
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self._open()
+
+    def open(self):
+        with self._lock:
+            self._open()
+
+    def _open(self):
+        if self.state != "open":
+            logger.warning(f"Circuit breaker for {self.name} opened after {self.failures} failures")
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self._probing = False
+
+
+# Global limiter and per-model breakers shared by every LLM call in the process
+llm_rate_limiter = AdaptiveRateLimiter()
+llm_breakers = {model: CircuitBreaker(model) for model in (Config.LLM_PRIMARY_MODEL, Config.LLM_FALLBACK_MODEL) if model}
@@ -0,0 +1,238 @@
+import glob
+import os
+import sqlite3
+import sys
+import threading
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+
+from app.config import Config
+from app.services.cache_service import is_cacheable
+from app.services.file_service import file_format, read_result_file, OUTPUT_FORMATS
+from app.utils.helpers import expense_fingerprint, normalize_text, TEXT_COLUMNS
+from app.utils.logger import logger
+
+# Label column written by file_service.annotate_predictions
+PREDICTED_COLUMN = "Predicted GL Account"
+SOURCE = "similarity"
+
+# Similarity entries materialised at once when scoring a batch of queries
+QUERY_BUDGET = 2_000_000
+
+
+def expense_text(expense_details):
+    # Empty fields and separators would give every pair of rows shared n-grams
+    return " ".join(filter(None, (normalize_text(expense_details.get(column)) for column in TEXT_COLUMNS)))
+
+
+class SimilarityIndex:
+    """Nearest-neighbour index over previously classified expenses.
+
+    Rows are embedded as L2-normalised character n-gram hashing vectors, so the
+    index can grow one job at a time without refitting. A query row takes the
+    similarity-weighted vote of its ``k`` nearest neighbours; it is labelled
+    locally only when the vote confidence reaches ``threshold``.
+
+    Vectors and labels are stored in SQLite (``index.sqlite3`` under
+    ``path``), one row per expense with an increasing sequence number. Each
+    process keeps the matrix in memory and pulls rows written since its last
+    read before every lookup, so worker processes share what the others learn
+    and an update costs one insert rather than a rewrite of the whole index.
+    """
+
+    def __init__(self, path=None, k=None, threshold=None, enabled=None):
+        self.path = path or Config.SIMILARITY_INDEX_PATH
+        self.k = k or Config.SIMILARITY_K
+        self.threshold = threshold or Config.SIMILARITY_THRESHOLD
+        self.enabled = Config.SIMILARITY_INDEX_ENABLED if enabled is None else enabled
+        self.vectorizer = HashingVectorizer(
+            analyzer="char_wb", ngram_range=(3, 5), n_features=2 ** 18,
+            alternate_sign=False, norm="l2", dtype=np.float32
+        )
+        self._lock = threading.Lock()
+        self._conn = None
+        self._seq = 0  # last sequence number read into memory
+        self._matrix = None
+        self._labels = []
+        self._positions = {}  # expense fingerprint -> row in the matrix
+
+    def __len__(self):
+        self._refresh()
+        return len(self._labels)
+
+    def _connection(self):
+        if self._conn is None:
+            os.makedirs(self.path, exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(self.path, "index.sqlite3"), check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS expenses ("
+                " key TEXT PRIMARY KEY,"
+                " label TEXT NOT NULL,"
+                " indices BLOB NOT NULL,"
+                " data BLOB NOT NULL,"
+                " seq INTEGER NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_seq ON expenses (seq)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS ingested_files (name TEXT PRIMARY KEY)")
+        return self._conn
+
+    def _refresh(self):
+        """Read rows added or relabelled (by any process) since the last call"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT key, label, indices, data, seq FROM expenses WHERE seq > ? ORDER BY seq", (self._seq,)
+            ).fetchall()
+            if not rows:
+                return
+            indices, data, indptr = [], [], [0]
+            for key, label, row_indices, row_data, seq in rows:
+                self._seq = max(self._seq, seq)
+                if key in self._positions:
+                    self._labels[self._positions[key]] = label
+                    continue
+                self._positions[key] = len(self._labels)
+                self._labels.append(label)
+                indices.append(np.frombuffer(row_indices, dtype=np.int32))
+                data.append(np.frombuffer(row_data, dtype=np.float32))
+                indptr.append(indptr[-1] + len(indices[-1]))
+            if len(indptr) > 1:
+                vectors = sparse.csr_matrix(
+                    (np.concatenate(data), np.concatenate(indices), np.array(indptr)),
+                    shape=(len(indptr) - 1, self.vectorizer.n_features)
+                )
+                self._matrix = vectors if self._matrix is None else sparse.vstack([self._matrix, vectors], format="csr")
+
+    def add(self, rows, labels, source_file=None):
+        """Add classified rows; a row already in the index gets its label updated"""
+        if not self.enabled:
+            return 0
+
+        latest = {}
+        for row, label in zip(rows, labels):
+            latest[expense_fingerprint(row, TEXT_COLUMNS)] = (row, label)
+        keys = list(latest)
+        vectors = self.vectorizer.transform([expense_text(latest[key][0]) for key in keys]).tocsr() if keys else None
+
+        with self._lock:
+            conn = self._connection()
+            # Take the write lock before reading MAX(seq) so concurrent writers get distinct sequence numbers
+            conn.execute("BEGIN IMMEDIATE")
+            (seq,) = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM expenses").fetchone()
+            known = set()
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                known.update(key for (key,) in conn.execute(
+                    f"SELECT key FROM expenses WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ))
+            conn.executemany(
+                "INSERT INTO expenses (key, label, indices, data, seq) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET label = excluded.label, seq = excluded.seq",
+                [
+                    (key, latest[key][1],
+                     vectors.indices[vectors.indptr[i]:vectors.indptr[i + 1]].astype(np.int32).tobytes(),
+                     vectors.data[vectors.indptr[i]:vectors.indptr[i + 1]].astype(np.float32).tobytes(),
+                     seq + i + 1)
+                    for i, key in enumerate(keys)
+                ]
+            )
+            if source_file:
+                conn.execute("INSERT OR IGNORE INTO ingested_files (name) VALUES (?)", (os.path.basename(source_file),))
+            conn.commit()
+        self._refresh()
+        return len([key for key in keys if key not in known])
+
+    def add_predictions(self, rows, predictions, source_file=None):
+        """Add LLM-labelled rows from a finished job; local and failed predictions are skipped"""
+        pairs = [
+            (row, prediction["gl_account_number"])
+            for row, prediction in zip(rows, predictions)
+            if is_cacheable(prediction) and "source" not in prediction
+        ]
+        return self.add([row for row, _ in pairs], [label for _, label in pairs], source_file)
+
+    def ingest_prediction_file(self, file_path):
+        """Add the rows of a prediction_* output produced by a finished job"""
+        with self._lock:
+            ingested = self._connection().execute(
+                "SELECT 1 FROM ingested_files WHERE name = ?", (os.path.basename(file_path),)
+            ).fetchone()
+        if ingested:
+            return 0
+        df = read_result_file(file_path)
+        if PREDICTED_COLUMN not in df.columns:
+            logger.warning(f"Skipping {file_path}: no '{PREDICTED_COLUMN}' column")
+            return 0
+        labels = df[PREDICTED_COLUMN].astype(str)
+        valid = labels.isin(list(Config.GL_ACCOUNT_MAP))
+        records = df[valid].to_dict(orient="records")
+        added = self.add(records, labels[valid].tolist(), source_file=file_path)
+        logger.info(f"Ingested {added} new expenses from {file_path}")
+        return added
+
+    def ingest_directory(self, directory):
+        """Backfill the index from every prediction_* output in ``directory``"""
+        return sum(
+            self.ingest_prediction_file(file_path)
+            for file_path in sorted(glob.glob(os.path.join(directory, "prediction_*")))
+            if os.path.isfile(file_path) and file_format(file_path) in OUTPUT_FORMATS
+        )
+
+    def predict(self, rows):
+        """Return a prediction for each confidently matched row, None otherwise"""
+        if not self.enabled or not rows:
+            return [None] * len(rows)
+        self._refresh()
+        with self._lock:
+            # Rows are only ever appended, so this snapshot stays consistent
+            matrix, labels = self._matrix, self._labels
+        if matrix is None:
+            return [None] * len(rows)
+
+        queries = self.vectorizer.transform([expense_text(row) for row in rows]).tocsr()
+        # Score a few queries at a time so memory stays bounded however large the index grows
+        batch = max(1, QUERY_BUDGET // matrix.shape[0])
+        history = matrix.T.tocsr()
+        predictions = []
+        for offset in range(0, len(rows), batch):
+            similarities = (queries[offset:offset + batch] @ history).tocsr()
+            for i in range(similarities.shape[0]):
+                start, end = similarities.indptr[i], similarities.indptr[i + 1]
+                predictions.append(self._vote(similarities.data[start:end], similarities.indices[start:end], labels))
+        return predictions
+
+    def _vote(self, scores, neighbours, labels):
+        if not len(scores):
+            return None
+        if len(scores) > self.k:
+            top = np.argpartition(scores, -self.k)[-self.k:]
+            scores, neighbours = scores[top], neighbours[top]
+
+        votes = {}
+        for score, neighbour in zip(scores, neighbours):
+            votes[labels[neighbour]] = votes.get(labels[neighbour], 0.0) + float(score)
+        ranked = sorted(votes.items(), key=lambda item: item[1], reverse=True)
+        best_label, best_votes = ranked[0]
+        best_similarity = max(float(s) for s, n in zip(scores, neighbours) if labels[n] == best_label)
+        confidence = best_votes / sum(votes.values()) * best_similarity
+        if confidence < self.threshold:
+            return None
+        return {
+            "gl_account_number": best_label,
+            "confidence_score": f"{confidence:.2f}",
+            "alternative_gl_account_number": ranked[1][0] if len(ranked) > 1 else "",
+            "reasoning": f"Matched {len(scores)} similar past expenses (best similarity {best_similarity:.2f})",
+            "source": SOURCE
+        }
+
+
+# Global similarity index instance
+similarity_index = SimilarityIndex()
+
+
+if __name__ == "__main__":
+    # Backfill from existing outputs: python -m app.services.similarity_service app/static/uploads
+    directory = sys.argv[1] if len(sys.argv) > 1 else "app/static/uploads"
+    logger.info(f"Added {similarity_index.ingest_directory(directory)} expenses to the similarity index")
@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import threading
+import time
+
+from app.config import Config
+from app.services.file_service import collect_garbage
+from app.services.metrics_service import metrics
+from app.services.task_service import task_manager
+from app.utils.logger import logger
+
+
+class ResultStore:
+    """Results of finished jobs by upload content, and the disk budget of uploads and results.
+
+    Uploads are stored once per content hash (``file_service.store_upload``).
+    A finished job records its result file under (content hash, results
+    version, output format), so a byte-identical re-upload classified with
+    the same models and GL account map is answered with that file straight
+    away. ``collect_garbage`` keeps the upload directory and the result parts
+    within ``max_bytes`` and ``max_age_seconds`` and evicts finished tasks;
+    files of unfinished tasks are never removed.
+    """
+
+    def __init__(self, path=None, max_bytes=None, max_age_seconds=None, parts_dir=None):
+        self.path = path or Config.STORAGE_INDEX_PATH
+        self.max_bytes = max_bytes or Config.STORAGE_MAX_BYTES
+        self.max_age_seconds = Config.STORAGE_MAX_AGE_SECONDS if max_age_seconds is None else max_age_seconds
+        self.parts_dir = parts_dir or os.path.join(Config.DATA_DIR, "parts")
+        self._lock = threading.Lock()
+        self._conn = None
+        self._collector = None
+
+    def _connection(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " sha256 TEXT NOT NULL,"
+                " version TEXT NOT NULL,"
+                " output_format TEXT NOT NULL,"
+                " result_file TEXT NOT NULL,"
+                " rows INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " PRIMARY KEY (sha256, version, output_format))"
+            )
+        return self._conn
+
+    def find(self, directory, sha256, version, output_format):
+        """(result file, rows) stored for this content under ``directory``, or None"""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT result_file, rows FROM results WHERE sha256 = ? AND version = ? AND output_format = ?",
+                (sha256, version, output_format)
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            # Marks the result as recently used, so garbage collection keeps it longer
+            os.utime(os.path.join(directory, row[0]))
+        except FileNotFoundError:
+            return None
+        return row[0], row[1]
+
+    def record(self, sha256, version, output_format, result_file, rows):
+        """Remember the result of a finished job for later uploads of the same content"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO results (sha256, version, output_format, result_file, rows, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (sha256, version, output_format, result_file, rows, time.time())
+            )
+            conn.commit()
+
+    def collect_garbage(self, directory, now=None):
+        """Remove expired and least recently used uploads, results and result parts; returns bytes freed"""
+        now = now or time.time()
+        unfinished = task_manager.unfinished_tasks()
+        uploads = {os.path.abspath(task["upload_path"]) for task in unfinished if task.get("upload_path")}
+        task_ids = [task["task_id"] for task in unfinished]
+
+        def in_use(path):
+            # Results, temporary outputs and parts are all named after their task
+            name = os.path.basename(path)
+            return os.path.abspath(path) in uploads or any(task_id in name for task_id in task_ids)
+
+        removed, freed = collect_garbage(directory, self.max_bytes, self.max_age_seconds, in_use, now)
+        parts_removed, parts_freed = collect_garbage(self.parts_dir, self.max_bytes, self.max_age_seconds,
+                                                     in_use, now)
+        task_manager.evict_finished(now)
+
+        # Forget results whose file is gone
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute("SELECT sha256, version, output_format, result_file FROM results").fetchall()
+            gone = [row[:3] for row in rows if not os.path.exists(os.path.join(directory, row[3]))]
+            conn.executemany("DELETE FROM results WHERE sha256 = ? AND version = ? AND output_format = ?", gone)
+            conn.commit()
+
+        if removed or parts_removed:
+            metrics.inc("storage_removed_bytes_total", freed + parts_freed)
+            logger.info(f"Removed {removed} uploads and results and {parts_removed} result parts "
+                        f"({(freed + parts_freed) / (1 << 20):.1f} MiB)")
+        return freed + parts_freed
+
+    def start_collector(self, directory, interval=None):
+        """Collect garbage under ``directory`` now and every ``interval`` seconds on a daemon thread"""
+        interval = Config.STORAGE_GC_INTERVAL_SECONDS if interval is None else interval
+        if interval <= 0 or self._collector is not None:
+            return
+
+        def run():
+            while True:
+                try:
+                    self.collect_garbage(directory)
+                except Exception as e:
+                    logger.error(f"Storage garbage collection failed: {e}")
+                time.sleep(interval)
+
+        self._collector = threading.Thread(target=run, daemon=True)
+        self._collector.start()
+
+
+# Global result store instance
+result_store = ResultStore()
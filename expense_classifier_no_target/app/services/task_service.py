@@ -1,72 +1,259 @@
+from app.config import Config
 from app.utils.logger import logger
 import uuid
 import json
 import os
+import sqlite3
+import threading
 import time
 
+# Where earlier versions kept one JSON file per task; an empty LEGACY_TASKS_DIR skips the import
+LEGACY_TASKS_DIR = os.getenv("LEGACY_TASKS_DIR",
+                             os.path.join(os.path.dirname(os.path.dirname(__file__)), "static", "tasks"))
+
+# Columns stored as-is; everything else in a task dict lives in the JSON "details" column
+TASK_COLUMNS = ("task_id", "filename", "status", "progress", "total_rows", "processed_rows",
+                "start_time", "updated_at", "result_file", "error")
+
 class TaskManager:
-    def __init__(self):
-        self.tasks = {}
-        self.tasks_dir = "app/static/tasks"
-        os.makedirs(self.tasks_dir, exist_ok=True)
-    
-    def create_task(self, filename, total_rows):
-        """Create a new task and save it to disk"""
+    """Task status store shared by the web process and the workers.
+
+    Tasks live in one SQLite (WAL) table, so status polls are single-row
+    lookups and thousands of historical jobs cost nothing. Progress updates
+    are buffered in memory and written at most every
+    ``Config.TASK_PROGRESS_FLUSH_SECONDS`` per task; status changes are
+    written immediately. Finished tasks older than
+    ``Config.TASK_TTL_SECONDS`` are evicted.
+    """
+
+    def __init__(self, path=None, ttl_seconds=None, flush_seconds=None, legacy_dir=LEGACY_TASKS_DIR):
+        self.path = path or Config.TASK_STORE_PATH
+        self.ttl_seconds = Config.TASK_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.flush_seconds = Config.TASK_PROGRESS_FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        self.tasks_dir = os.path.dirname(self.path) or "."
+        self.legacy_dir = legacy_dir
+        self._lock = threading.RLock()
+        self._conn = None
+        self._pending = {}  # task_id -> processed_rows not yet written
+        self._last_flush = {}
+        self._last_eviction = 0.0
+        self._listeners = []
+
+    def _connection(self):
+        if self._conn is None:
+            os.makedirs(self.tasks_dir, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                " task_id TEXT PRIMARY KEY,"
+                " filename TEXT,"
+                " status TEXT NOT NULL,"
+                " progress INTEGER NOT NULL DEFAULT 0,"
+                " total_rows INTEGER NOT NULL DEFAULT 0,"
+                " processed_rows INTEGER NOT NULL DEFAULT 0,"
+                " start_time REAL NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " result_file TEXT,"
+                " error TEXT,"
+                " stats TEXT NOT NULL DEFAULT '{}',"
+                " details TEXT NOT NULL DEFAULT '{}')"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, updated_at)")
+            self._import_json_tasks()
+        return self._conn
+
+    def _import_json_tasks(self):
+        """Import per-task JSON files written by earlier versions (tasks already stored win).
+
+        Each file is renamed to ``*.json.imported`` once read, so tasks evicted
+        later are not imported (and resumed) again on the next start.
+        """
+        if not self.legacy_dir or not os.path.isdir(self.legacy_dir):
+            return
+        imported = 0
+        for name in os.listdir(self.legacy_dir):
+            if not name.endswith(".json"):
+                continue
+            file_path = os.path.join(self.legacy_dir, name)
+            try:
+                with open(file_path, 'r') as f:
+                    imported += self._insert(json.load(f), replace=False)
+                self._conn.commit()
+                os.replace(file_path, f"{file_path}.imported")
+            except Exception as e:
+                logger.warning(f"Could not import task file {file_path}: {e}")
+        if imported:
+            logger.info(f"Imported {imported} task files into {self.path}")
+
+    def _insert(self, task, replace=True):
+        details = {key: value for key, value in task.items() if key not in TASK_COLUMNS and key != "stats"}
+        cursor = self._conn.execute(
+            f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO tasks (task_id, filename, status, progress, total_rows, processed_rows,"
+            " start_time, updated_at, result_file, error, stats, details) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (task["task_id"], task.get("filename"), task.get("status", "processing"), task.get("progress", 0),
+             task.get("total_rows") or 0, task.get("processed_rows", 0), task.get("start_time", time.time()),
+             task.get("updated_at", time.time()), task.get("result_file"), task.get("error"),
+             json.dumps(task.get("stats", {})), json.dumps(details))
+        )
+        return cursor.rowcount
+
+    def add_listener(self, callback):
+        """Call ``callback(task_id)`` whenever a task in this process changes"""
+        self._listeners.append(callback)
+
+    def _notify(self, task_id):
+        for callback in self._listeners:
+            try:
+                callback(task_id)
+            except Exception as e:
+                logger.warning(f"Task listener failed: {e}")
+
+    def create_task(self, filename, total_rows, **details):
+        """Create a new task and save it.
+
+        ``details`` (upload path, output format, ...) are stored with the task
+        so an interrupted job can be resumed.
+        """
         task_id = str(uuid.uuid4())
-        task_data = {
-            "task_id": task_id,
-            "filename": filename,
-            "status": "processing",
-            "progress": 0,
-            "total_rows": total_rows,
-            "processed_rows": 0,
-            "start_time": time.time(),
-            "result_file": None,
-            "error": None
-        }
-        
-        self.tasks[task_id] = task_data
-        self._save_task(task_id)
+        now = time.time()
+        with self._lock:
+            self._connection()
+            self._insert({
+                "task_id": task_id,
+                "filename": filename,
+                "status": "processing",
+                "progress": 0,
+                "total_rows": total_rows,
+                "processed_rows": 0,
+                "start_time": now,
+                "updated_at": now,
+                "result_file": None,
+                "error": None,
+                "stats": {},
+                **details
+            })
+            self._conn.commit()
+            if now - self._last_eviction > 3600:
+                self.evict_finished(now)
         return task_id
-    
+
     def update_progress(self, task_id, processed_rows):
-        """Update task progress"""
-        if task_id in self.tasks:
-            self.tasks[task_id]["processed_rows"] = processed_rows
-            self.tasks[task_id]["progress"] = int((processed_rows / self.tasks[task_id]["total_rows"]) * 100)
-            self._save_task(task_id)
-    
+        """Update task progress; writes are batched per task"""
+        with self._lock:
+            self._pending[task_id] = processed_rows
+            now = time.monotonic()
+            last_flush = self._last_flush.get(task_id)
+            if last_flush is None or now - last_flush >= self.flush_seconds:
+                self._flush(task_id)
+                self._last_flush[task_id] = now
+        self._notify(task_id)
+
+    def _flush(self, task_id):
+        if task_id not in self._pending:
+            return
+        processed_rows = self._pending.pop(task_id)
+        conn = self._connection()
+        conn.execute(
+            "UPDATE tasks SET processed_rows = ?,"
+            " progress = MIN(100, (? * 100) / MAX(1, total_rows)), updated_at = ? WHERE task_id = ?",
+            (processed_rows, processed_rows, time.time(), task_id)
+        )
+        conn.commit()
+
+    def flush(self, task_id):
+        """Write buffered progress for ``task_id`` now"""
+        with self._lock:
+            self._flush(task_id)
+
+    def _update(self, task_id, **columns):
+        with self._lock:
+            self._flush(task_id)
+            self._last_flush.pop(task_id, None)
+            assignments = ", ".join(f"{column} = ?" for column in columns)
+            conn = self._connection()
+            conn.execute(f"UPDATE tasks SET {assignments}, updated_at = ? WHERE task_id = ?",
+                         (*columns.values(), time.time(), task_id))
+            conn.commit()
+        self._notify(task_id)
+
+    def update_stats(self, task_id, **stats):
+        """Merge processing statistics (dedup ratio, cache hits, ...) into the task"""
+        with self._lock:
+            row = self._connection().execute("SELECT stats FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is not None:
+                self._update(task_id, stats=json.dumps({**json.loads(row[0] or "{}"), **stats}))
+
+    def update_details(self, task_id, **details):
+        """Merge extra fields (e.g. a preview of finished rows) into the task"""
+        with self._lock:
+            row = self._connection().execute("SELECT details FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is not None:
+                self._update(task_id, details=json.dumps({**json.loads(row[0]), **details}))
+
+    def set_total_rows(self, task_id, total_rows):
+        """Replace the upfront row estimate with the actual count"""
+        self._update(task_id, total_rows=total_rows)
+
     def complete_task(self, task_id, result_file):
         """Mark task as completed"""
-        if task_id in self.tasks:
-            self.tasks[task_id]["status"] = "completed"
-            self.tasks[task_id]["result_file"] = result_file
-            self.tasks[task_id]["progress"] = 100
-            self._save_task(task_id)
-    
+        self._update(task_id, status="completed", result_file=result_file, progress=100)
+
     def fail_task(self, task_id, error_message):
         """Mark task as failed"""
-        if task_id in self.tasks:
-            self.tasks[task_id]["status"] = "failed"
-            self.tasks[task_id]["error"] = error_message
-            self._save_task(task_id)
-    
+        self._update(task_id, status="failed", error=error_message)
+
     def get_task(self, task_id):
-        """Get task status"""
-        if task_id in self.tasks:
-            return self.tasks[task_id]
-        # Try to load from disk
-        task_file = os.path.join(self.tasks_dir, f"{task_id}.json")
-        if os.path.exists(task_file):
-            with open(task_file, 'r') as f:
-                return json.load(f)
-        return None
-    
-    def _save_task(self, task_id):
-        """Save task data to disk"""
-        task_file = os.path.join(self.tasks_dir, f"{task_id}.json")
-        with open(task_file, 'w') as f:
-            json.dump(self.tasks[task_id], f, indent=2)
+        """Get task status, including progress not yet flushed by this process"""
+        with self._lock:
+            row = self._connection().execute(
+                f"SELECT {', '.join(TASK_COLUMNS)}, stats, details FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+            pending = self._pending.get(task_id)
+        if row is None:
+            return None
+        task = self._row_to_task(row)
+        if pending is not None:
+            task["processed_rows"] = pending
+            task["progress"] = min(100, int(pending * 100 / max(1, task["total_rows"])))
+        return task
+
+    def _row_to_task(self, row):
+        task = dict(zip(TASK_COLUMNS, row[:len(TASK_COLUMNS)]))
+        task["stats"] = json.loads(row[len(TASK_COLUMNS)])
+        task.update(json.loads(row[len(TASK_COLUMNS) + 1]))
+        return task
+
+    def list_tasks(self, status=None, limit=100):
+        """Most recently updated tasks, optionally only those with ``status``"""
+        query = f"SELECT {', '.join(TASK_COLUMNS)}, stats, details FROM tasks"
+        params = ()
+        if status:
+            query += " WHERE status = ?"
+            params = (status,)
+        query += " ORDER BY updated_at DESC LIMIT ?"
+        with self._lock:
+            rows = self._connection().execute(query, (*params, limit)).fetchall()
+        return [self._row_to_task(row) for row in rows]
+
+    def unfinished_tasks(self):
+        """Tasks left in 'processing' (e.g. by a restart)"""
+        return self.list_tasks("processing", limit=-1)
+
+    def evict_finished(self, now=None):
+        """Delete completed and failed tasks not updated for ``ttl_seconds``"""
+        now = now or time.time()
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(
+                "DELETE FROM tasks WHERE status IN ('completed', 'failed') AND updated_at < ?",
+                (now - self.ttl_seconds,)
+            )
+            conn.commit()
+            self._last_eviction = now
+        if cursor.rowcount:
+            logger.info(f"Evicted {cursor.rowcount} finished tasks")
+        return cursor.rowcount
 
 # Global task manager instance
-task_manager = TaskManager()
\ No newline at end of file
+task_manager = TaskManager()
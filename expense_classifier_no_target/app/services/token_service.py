@@ -0,0 +1,96 @@
+import contextvars
+import re
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+from app.config import Config
+
+# Tokens the chat format adds around every message, and to prime the reply
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text, model=None):
+    """Tokens in ``text`` for ``model``, counted locally.
+
+    Uses tiktoken when it is installed; otherwise words and punctuation are
+    counted, which lands within a few percent for short English text.
+    """
+    encoding = _encoding(model or Config.LLM_PRIMARY_MODEL)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return max(len(re.findall(r"\w+|[^\w\s]", text)), len(text) // 4)
+
+
+def count_message_tokens(messages, model=None):
+    """Prompt tokens of a chat request"""
+    return sum(TOKENS_PER_MESSAGE + count_tokens(message["content"], model) for message in messages) + TOKENS_PER_REPLY
+
+
+class TokenUsage:
+    """Running LLM token and cost totals for one job.
+
+    Pass the totals of an earlier attempt to keep counting where it stopped.
+    """
+
+    def __init__(self, requests=0, prompt_tokens=0, completion_tokens=0, cost_usd=0.0, **_):
+        self.requests = requests
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cost_usd = cost_usd
+        self._lock = threading.Lock()
+
+    def add(self, model, prompt_tokens, completion_tokens):
+        prompt_price, completion_price = Config.LLM_PRICES.get(model, (0.0, 0.0))
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost_usd += (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+    def as_dict(self, rows=None):
+        with self._lock:
+            totals = {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": self.prompt_tokens + self.completion_tokens,
+                "cost_usd": round(self.cost_usd, 6)
+            }
+        if rows:
+            totals["tokens_per_1k_rows"] = round(totals["total_tokens"] * 1000 / rows, 1)
+            totals["cost_per_1k_rows_usd"] = round(self.cost_usd * 1000 / rows, 6)
+        return totals
+
+
+# Usage of the job running in the current thread/task; None outside a job
+current_usage = contextvars.ContextVar("current_usage", default=None)
+
+
+@contextmanager
+def track_usage(usage):
+    """Count the LLM calls made inside the block (including ``asyncio.run`` started from it) into ``usage``"""
+    token = current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        current_usage.reset(token)
+
+
+def record_usage(model, prompt_tokens, completion_tokens):
+    usage = current_usage.get()
+    if usage is not None:
+        usage.add(model, prompt_tokens, completion_tokens)
@@ -1,10 +1,51 @@
 import os
+import re
+import json
+import hashlib
 import tempfile
+from app.config import Config
+
+# Free-text columns of an expense row (everything the prompt uses except Amount)
+TEXT_COLUMNS = ["Description", "Extended Details", "Appears On Your Statement As", "Address", "City/State", "Country", "CC Name"]
+
+# Columns identifying the merchant behind an expense (used for caching predictions)
+MERCHANT_COLUMNS = ["Description", "Appears On Your Statement As", "City/State"]
 
 def create_temp_directory():
     return tempfile.mkdtemp()
 
 def validate_file_extension(filename):
-    allowed_extensions = ['xlsx', 'xls']
+    allowed_extensions = ['xlsx', 'xls', 'csv', 'parquet']
     if not filename.split('.')[-1].lower() in allowed_extensions:
         raise ValueError(f"Invalid file extension. Allowed extensions: {allowed_extensions}")
+
+def normalize_text(value):
+    """Lowercase and collapse whitespace; missing values become ''"""
+    if value is None or value != value:  # None or NaN
+        return ""
+    return re.sub(r"\s+", " ", str(value)).strip().lower()
+
+def gl_account_str(label):
+    """G/L account as a string; label encoders trained on numeric columns hold floats (61215.0)"""
+    if isinstance(label, float) and label.is_integer():
+        return str(int(label))
+    return str(label)
+
+def expense_fingerprint(expense_details, columns=MERCHANT_COLUMNS):
+    """Stable hash of the normalized ``columns`` of an expense row"""
+    key = "\x1f".join(normalize_text(expense_details.get(column)) for column in columns)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def gl_map_version():
+    """Short hash of Config.GL_ACCOUNT_MAP, so cached results expire when the map changes"""
+    payload = json.dumps(Config.GL_ACCOUNT_MAP, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12]
+
+def results_version():
+    """Short hash of everything a whole file's results depend on: the GL account map,
+    the LLM model and the cascade model and thresholds"""
+    model_path = Config.GL_MODEL_PATH
+    model_stamp = os.path.getmtime(model_path) if model_path and os.path.exists(model_path) else None
+    payload = json.dumps([gl_map_version(), Config.LLM_PRIMARY_MODEL, model_path, model_stamp,
+                          Config.CASCADE_MIN_CONFIDENCE, Config.CASCADE_MIN_MARGIN])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12]
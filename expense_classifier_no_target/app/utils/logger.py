@@ -1,9 +1,16 @@
+import sys
+
 from loguru import logger
 from app.config import Config
 
+# The console follows LOG_LEVEL too, so per-row DEBUG lines stay out of production logs
+logger.remove()
+logger.add(sys.stderr, level=Config.LOG_LEVEL)
 logger.add(
     Config.LOG_FILE,
     level=Config.LOG_LEVEL,
     rotation="10 MB",
+    # The file is opened on the first message, not when the app is imported
+    delay=True,
     format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}"
 )
@@ -0,0 +1,239 @@
+"""Job workers: python -m app.worker [--processes N] [--concurrency M]
+
+Workers claim uploads from the durable job queue and classify them. Run as
+many worker processes as needed next to the web tier; the web process also
+runs ``Config.EMBEDDED_WORKERS`` job slots itself so a single container works.
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+
+from app.config import Config
+from app.services.cascade_service import CascadeClassifier
+from app.services.file_service import file_format, iter_file_chunks, ResultWriter
+from app.services.metrics_service import metrics, StageTimings
+from app.services.queue_service import job_queue
+from app.services.similarity_service import similarity_index
+from app.services.storage_service import result_store
+from app.services.task_service import task_manager
+from app.services.token_service import TokenUsage, track_usage
+from app.utils.logger import logger
+
+# Directory holding uploads and results (shared with the web process)
+UPLOAD_DIR = Config.UPLOAD_DIR
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+
+def classify_chunk(cascade, chunk, on_progress, progress_every):
+    """Run the cascade over one chunk, retrying the chunk if it raises"""
+    for attempt in range(1, Config.CHUNK_MAX_ATTEMPTS + 1):
+        try:
+            return cascade.run(chunk, progress_callback=on_progress, progress_every=progress_every)
+        except Exception as e:
+            if attempt == Config.CHUNK_MAX_ATTEMPTS:
+                raise
+            logger.warning(f"Chunk failed (attempt {attempt}/{Config.CHUNK_MAX_ATTEMPTS}), retrying: {e}")
+            time.sleep(2 ** attempt)
+
+
+def process_file_background(temp_filepath, original_filename, task_id, output_format=None):
+    """Process an uploaded file; raises on failure so the queue can retry the job.
+
+    Finished chunks are flushed to disk as they complete, so calling this
+    again for the same task resumes after the last flushed chunk.
+    """
+    task = task_manager.get_task(task_id)
+    output_format = output_format or task.get("output_format") or Config.OUTPUT_FORMAT
+    chunk_size = task.get("chunk_size") or Config.INGEST_CHUNK_SIZE
+    output_filename = f"prediction_{original_filename}_{task_id}.{output_format}"
+    output_filepath = os.path.join(UPLOAD_DIR, output_filename)
+    writer = ResultWriter(output_filepath, output_format)
+    completed = writer.completed_chunks()
+    if completed:
+        logger.info(f"Resuming task {task_id}: {len(completed)} chunks already flushed")
+
+    # Stream the file in row chunks: score rows with the ML model, then
+    # classify uncertain ones concurrently with the LLM
+    cascade = CascadeClassifier()
+    processed_rows = 0
+
+    # LLM tokens and cost, and seconds per stage, carried over from earlier attempts at this job
+    usage = TokenUsage(**task.get("stats", {}).get("llm_usage", {}))
+    timings = StageTimings(**task.get("stats", {}).get("timings", {}))
+    if "queue_wait" not in timings.seconds:
+        timings.add("queue_wait", max(0.0, time.time() - task["start_time"]))
+
+    chunks = timings.iterate(iter_file_chunks(temp_filepath, chunk_size), "parse", "upload_parse_seconds",
+                             errors="upload_parse_errors_total", format=file_format(temp_filepath))
+    with track_usage(usage):
+        for chunk_index, chunk in enumerate(chunks):
+            offset = processed_rows
+            processed_rows += len(chunk)
+            if chunk_index in completed:
+                task_manager.update_progress(task_id, processed_rows)
+                continue
+
+            with timings.stage("classify", "classify_chunk_seconds"):
+                predictions = classify_chunk(
+                    cascade,
+                    chunk,
+                    lambda done: task_manager.update_progress(task_id, offset + done),
+                    max(1, len(chunk) // 10)
+                )
+
+            # Grow the local nearest-neighbour index with this chunk's LLM labels
+            with timings.stage("index"):
+                try:
+                    similarity_index.add_predictions(chunk.to_dict(orient="records"), predictions, output_filepath)
+                except Exception as e:
+                    logger.error(f"Failed to update similarity index: {e}")
+
+            with timings.stage("write", "result_write_seconds", format=output_format, step="chunk"):
+                writer.write_chunk(chunk_index, chunk, predictions)
+            task_manager.flush(task_id)
+            # Latest finished rows, pushed to clients watching /api/task-events
+            first = max(0, len(predictions) - Config.PROGRESS_PREVIEW_ROWS)
+            task_manager.update_details(task_id, preview=[
+                {"row": offset + i, "gl_account_number": predictions[i]["gl_account_number"],
+                 "confidence_score": predictions[i]["confidence_score"]}
+                for i in range(first, len(predictions))
+            ])
+
+            # Running totals, so spend and time per stage are visible while the job runs
+            task_manager.update_stats(task_id, llm_usage=usage.as_dict(processed_rows), timings=timings.as_dict())
+
+    # Update task with the actual row count
+    task_manager.set_total_rows(task_id, processed_rows)
+    task_manager.update_progress(task_id, processed_rows)
+    totals = usage.as_dict(processed_rows)
+    tiers = cascade.stats.get("tiers", {})
+    logger.info(
+        f"Task {task_id}: {tiers.get('ml_model', {}).get('rows', 0)} rows from the ML model, "
+        f"{tiers.get('llm', {}).get('rows', 0)} passed on ({cascade.stats.get('unique_rows', 0)} unique, "
+        f"{cascade.stats.get('cache_hits', 0)} cached, {cascade.stats.get('index_hits', 0)} matched locally, "
+        f"{cascade.stats.get('llm_rows', 0)} sent to the LLM); {totals['total_tokens']} tokens, "
+        f"${totals['cost_usd']:.4f} (${totals.get('cost_per_1k_rows_usd', 0.0):.4f} per 1k rows)"
+    )
+
+    # Assemble the flushed chunks into the output file
+    with timings.stage("finalize", "result_write_seconds", format=output_format, step="finalize"):
+        writer.finalize()
+    task_manager.update_stats(task_id, **cascade.stats, llm_usage=totals, timings=timings.as_dict())
+
+    # Mark task as completed; later uploads of the same content reuse the result
+    task_manager.complete_task(task_id, output_filename)
+    if task.get("upload_sha256"):
+        result_store.record(task["upload_sha256"], task["results_version"], output_format, output_filename,
+                            processed_rows)
+    else:
+        # Uploads from before content addressing; stored uploads are shared by identical
+        # uploads still queued and left to the garbage collector
+        os.remove(temp_filepath)
+
+
+class Worker:
+    """Claims jobs from the queue and runs up to ``concurrency`` of them on threads.
+
+    A poller thread claims work, heartbeats the running jobs and requeues
+    jobs abandoned by workers that died.
+    """
+
+    def __init__(self, concurrency=None, queue=None):
+        self.concurrency = concurrency or Config.WORKER_CONCURRENCY
+        self.queue = queue or job_queue
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._running = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_job(self, job_id, payload, attempt):
+        started = time.monotonic()
+        try:
+            upload_path = payload["upload_path"]
+            if not os.path.exists(upload_path):
+                self.queue.fail(job_id, "Upload no longer available", retry=False)
+                task_manager.fail_task(job_id, "Processing was interrupted and the upload is no longer available")
+                return
+            logger.info(f"Worker {self.worker_id} running job {job_id} (attempt {attempt})")
+            process_file_background(upload_path, payload["original_filename"], job_id, payload.get("output_format"))
+            self.queue.complete(job_id)
+            metrics.observe("job_duration_seconds", time.monotonic() - started, outcome="completed")
+        except Exception as e:
+            retrying = self.queue.fail(job_id, e)
+            metrics.observe("job_duration_seconds", time.monotonic() - started, outcome="retry" if retrying else "failed")
+            if retrying:
+                logger.warning(f"Job {job_id} failed on attempt {attempt}, will retry: {e}")
+            else:
+                logger.error(f"Error in background processing: {e}")
+                task_manager.fail_task(job_id, str(e))
+        finally:
+            # Workers may run in their own process: publish this job's metrics now
+            metrics.flush()
+            with self._lock:
+                self._running.discard(job_id)
+
+    def run(self):
+        last_heartbeat = 0.0
+        while not self._stop.is_set():
+            if time.monotonic() - last_heartbeat >= Config.WORKER_HEARTBEAT_SECONDS:
+                with self._lock:
+                    running = list(self._running)
+                self.queue.heartbeat(running)
+                for job_id in self.queue.requeue_stale():
+                    task_manager.fail_task(job_id, "Processing stopped the worker repeatedly and was abandoned")
+                last_heartbeat = time.monotonic()
+
+            claimed = None
+            with self._lock:
+                has_slot = len(self._running) < self.concurrency
+            if has_slot:
+                claimed = self.queue.claim(self.worker_id)
+            if claimed is None:
+                self._stop.wait(Config.WORKER_POLL_SECONDS)
+                continue
+
+            with self._lock:
+                self._running.add(claimed[0])
+            threading.Thread(target=self.run_job, args=claimed, daemon=True).start()
+
+    def start(self):
+        """Run the poller on a daemon thread (used for workers embedded in the web process)"""
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+def _run_worker(concurrency):
+    logger.info(f"Worker process {os.getpid()} started with {concurrency} job slots")
+    Worker(concurrency).run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run expense classification workers")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes to start")
+    parser.add_argument("--concurrency", type=int, default=Config.WORKER_CONCURRENCY, help="jobs per process")
+    args = parser.parse_args(argv)
+
+    if args.processes <= 1:
+        _run_worker(args.concurrency)
+        return
+    processes = [
+        multiprocessing.Process(target=_run_worker, args=(args.concurrency,), daemon=True)
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Throughput, latency, memory and token usage of no_target classification.
+
+Runs against the local fake OpenAI server (tests/fake_llm_server.py) with
+--latency seconds per reply and --error-rate failed replies, so results do
+not depend on (or pay for) the real API. Measures
+llm_service.predict_gl_account from --concurrency threads, the batched
+ClassificationEngine, /api/predict-topk under concurrent clients and whole
+upload jobs through /start-prediction/ and the embedded workers. The cache
+and similarity index are off so every row reaches the LLM. Results are
+stored as JSON; with --baseline the run fails if rows/s or p95/p99 latency
+regressed by more than --tolerance.
+
+    python -m benchmarks.bench_llm --rows 500 --concurrency 16 --baseline benchmarks/results/main.json
+"""
+import argparse
+import contextvars
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.harness import add_arguments, finish, http_load, measure, peak_rss_mb, serve
+
+MERCHANTS = [
+    ("UBER TRIP", "NEW YORK NY"),
+    ("DELTA AIR LINES", "ATLANTA GA"),
+    ("MARRIOTT HOTELS", "BOSTON MA"),
+    ("STARBUCKS STORE", "SEATTLE WA"),
+    ("SHELL OIL", "HOUSTON TX"),
+    ("ADOBE CREATIVE CLOUD", "SAN JOSE CA"),
+    ("STAPLES", "FRAMINGHAM MA"),
+    ("VERIZON WIRELESS", "BASKING RIDGE NJ"),
+]
+
+
+def synthetic_expenses(rows, seed=0):
+    """Rows matching the TEXT_COLUMNS + Amount schema; every Description is distinct"""
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(MERCHANTS), rows)
+    names = np.array([m[0] for m in MERCHANTS], dtype=object)[picks]
+    refs = np.arange(100000, 100000 + rows).astype(str).astype(object)
+    return pd.DataFrame({
+        "Description": names + " " + refs,
+        "Extended Details": np.where(rng.random(rows) < 0.3, None, "Card purchase " + refs),
+        "Appears On Your Statement As": names,
+        "Address": "1 MAIN ST",
+        "City/State": np.array([m[1] for m in MERCHANTS], dtype=object)[picks],
+        "Country": "UNITED STATES",
+        "CC Name": "JANE DOE",
+        "Amount": rng.gamma(2.0, 60.0, rows).round(2),
+    })
+
+
+def configure(work_dir, job_workers, api_base):
+    """Environment for the app modules; must run before any of them is imported"""
+    os.environ.update({
+        "OPENAI_API_BASE": api_base,
+        "OPENAI_API_KEY": "benchmark",
+        "DATA_DIR": work_dir,
+        # Keep uploads and results (and the garbage collector) out of app/static/uploads
+        "UPLOAD_DIR": os.path.join(work_dir, "uploads"),
+        "EMBEDDED_WORKERS": str(job_workers),
+        "PREDICTION_CACHE_ENABLED": "false",
+        "SIMILARITY_INDEX_ENABLED": "false",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+        # The fake server has no quota; keep the limiter out of the measurement
+        "LLM_REQUESTS_PER_MINUTE": "1000000",
+        "LLM_TOKENS_PER_MINUTE": "1000000000",
+        "LLM_RETRY_BASE_SECONDS": "0.05",
+    })
+
+
+def with_usage(result, usage):
+    result.update({f"llm_{key}": value for key, value in usage.as_dict(result["rows"]).items()})
+    result.update(peak_rss_mb())
+    return result
+
+
+def bench_predict_gl_account(rows, concurrency):
+    from app.services.llm_service import predict_gl_account
+    from app.services.token_service import TokenUsage, track_usage
+
+    usage = TokenUsage()
+    latencies = []
+
+    def call(row):
+        start = time.perf_counter()
+        predict_gl_account(row, bypass_cache=True)
+        latencies.append(time.perf_counter() - start)
+
+    with track_usage(usage), ThreadPoolExecutor(concurrency) as pool:
+        start = time.perf_counter()
+        # Threads do not inherit context variables; run each call in a copy of this one
+        futures = [pool.submit(contextvars.copy_context().run, call, row) for row in rows]
+        for future in futures:
+            future.result()
+        seconds = time.perf_counter() - start
+    return with_usage(measure(len(rows), latencies, seconds, concurrency=concurrency), usage)
+
+
+def bench_engine(rows, concurrency):
+    from app.config import Config
+    from app.services.classifier_service import ClassificationEngine
+    from app.services.token_service import TokenUsage, track_usage
+
+    usage = TokenUsage()
+    engine = ClassificationEngine(max_concurrency=concurrency, cache=None, index=None)
+    with track_usage(usage):
+        start = time.perf_counter()
+        engine.run(rows)
+        seconds = time.perf_counter() - start
+    return with_usage(measure(len(rows), [], seconds, concurrency=concurrency, batch_size=Config.LLM_BATCH_SIZE),
+                      usage)
+
+
+def bench_http_topk(base_url, rows, requests, concurrency, batch_rows):
+    async def predict_topk(client, i):
+        start = (i * batch_rows) % max(1, len(rows) - batch_rows)
+        return await client.post("/api/predict-topk", json={"expenses": rows[start:start + batch_rows], "k": 3})
+
+    return http_load(base_url, predict_topk, requests, concurrency, batch_rows)
+
+
+def bench_http_jobs(base_url, jobs, job_rows, concurrency):
+    """Upload ``jobs`` files and wait for every task to finish"""
+    import asyncio
+
+    # Distinct content per job: identical uploads would reuse the first job's result
+    contents = [synthetic_expenses(job_rows, seed=4 + i).to_csv(index=False).encode() for i in range(jobs)]
+
+    async def run_job(client, i):
+        response = await client.post("/start-prediction/",
+                                     files={"file": (f"statement_{i}.csv", contents[i], "text/csv")})
+        task_id = re.search(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", response.text).group(0)
+        while True:
+            status = await client.get(f"/api/task-status/{task_id}")
+            if status.json()["status"] in ("completed", "failed"):
+                return status
+            await asyncio.sleep(0.05)
+
+    return http_load(base_url, run_job, jobs, concurrency, job_rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake LLM seconds per reply")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake LLM replies that fail")
+    parser.add_argument("--requests", type=int, default=50, help="/api/predict-topk requests")
+    parser.add_argument("--batch-rows", type=int, default=10, help="rows per /api/predict-topk request")
+    parser.add_argument("--jobs", type=int, default=4, help="upload jobs")
+    parser.add_argument("--job-rows", type=int, default=200)
+    parser.add_argument("--job-workers", type=int, default=2, help="embedded worker job slots")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    from tests.fake_llm_server import FakeLLMServer
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        server = FakeLLMServer(latency=args.latency, error_rate=args.error_rate).start()
+        configure(work_dir, args.job_workers, server.url)
+        try:
+            rows = synthetic_expenses(args.rows).to_dict(orient="records")
+            results = {
+                "llm_predict_gl_account": bench_predict_gl_account(rows, args.concurrency),
+                "engine_batched": bench_engine(synthetic_expenses(args.rows, seed=1).to_dict(orient="records"),
+                                               args.concurrency)
+            }
+
+            from app import main as web
+            from app.services.task_service import task_manager
+
+            # Leave the legacy task files under app/static/tasks alone
+            task_manager.legacy_dir = None
+            with serve(web.app) as base_url:
+                results["http_predict_topk"] = bench_http_topk(base_url, rows, args.requests, args.concurrency,
+                                                               args.batch_rows)
+                results["http_predict_topk"].update(peak_rss_mb())
+                results["http_jobs"] = bench_http_jobs(base_url, args.jobs, args.job_rows, args.concurrency)
+                results["http_jobs"].update(peak_rss_mb())
+        finally:
+            server.stop()
+
+    return finish("bench_llm", results, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
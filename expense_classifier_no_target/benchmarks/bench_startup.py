@@ -0,0 +1,44 @@
+"""Cold start of the no_target web process.
+
+Profiles ``import app.main`` in a fresh interpreter (python -X importtime),
+then starts the app under uvicorn --runs times and measures the time until
+/health answers (the process serves) and until /ready answers (the
+classification stack and similarity index are loaded and the embedded
+workers run). Stores go to a temporary DATA_DIR; the legacy task files under
+app/static/tasks are left alone.
+
+    python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+from benchmarks.harness import add_arguments, finish, import_profile, measure, startup_times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="server starts")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    root = os.path.join(os.path.dirname(__file__), "..")
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = {**os.environ, "DATA_DIR": work_dir, "UPLOAD_DIR": os.path.join(work_dir, "uploads"),
+               "LOG_FILE": os.path.join(work_dir, "app.log"), "LEGACY_TASKS_DIR": ""}
+        profile = import_profile("app.main", env=env, cwd=root)
+        runs = [startup_times("app.main:app", "/health", "/ready", env=env, cwd=root) for _ in range(args.runs)]
+
+    live, ready = [run["live_seconds"] for run in runs], [run["ready_seconds"] for run in runs]
+    results = {
+        "import": measure(0, [profile["import_seconds"]], profile["import_seconds"],
+                          slowest_imports=profile["slowest_imports"]),
+        "live": measure(0, live, sum(live)),
+        "ready": measure(0, ready, sum(ready))
+    }
+    return finish("bench_startup", results, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
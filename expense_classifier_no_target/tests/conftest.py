@@ -0,0 +1,43 @@
+import os
+import tempfile
+
+import openai
+import pytest
+
+# Keep the stores out of the working tree and the job workers out of the web
+# app; both are read when the app modules are first imported
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="no-target-tests-")
+os.environ["UPLOAD_DIR"] = os.path.join(os.environ["DATA_DIR"], "uploads")
+os.environ["EMBEDDED_WORKERS"] = "0"
+
+from app.config import Config  # noqa: E402
+# Imported up front: importing llm_service resets openai.api_base/api_key from Config
+from app.services import llm_service, rate_limit_service  # noqa: E402,F401
+from app.services.rate_limit_service import AdaptiveRateLimiter, CircuitBreaker  # noqa: E402
+from app.services.task_service import task_manager  # noqa: E402
+from tests.fake_llm_server import FakeLLMServer  # noqa: E402
+
+# The legacy task files under app/static/tasks are renamed once imported
+task_manager.legacy_dir = None
+
+
+@pytest.fixture
+def fresh_limits(monkeypatch):
+    """A process-wide limiter and breakers of the test's own, with short backoffs"""
+    monkeypatch.setattr(rate_limit_service, "llm_rate_limiter", AdaptiveRateLimiter(
+        requests_per_minute=10 ** 6, tokens_per_minute=10 ** 9, retry_base_seconds=0.01
+    ))
+    monkeypatch.setattr(rate_limit_service, "llm_breakers", {
+        model: CircuitBreaker(model, failure_threshold=2, reset_seconds=60)
+        for model in (Config.LLM_PRIMARY_MODEL, Config.LLM_FALLBACK_MODEL)
+    })
+
+
+@pytest.fixture
+def fake_llm():
+    server = FakeLLMServer(latency=0.05).start()
+    api_base, api_key = openai.api_base, openai.api_key
+    openai.api_base, openai.api_key = server.url, "test-key"
+    yield server
+    openai.api_base, openai.api_key = api_base, api_key
+    server.stop()
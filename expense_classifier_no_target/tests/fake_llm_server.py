@@ -0,0 +1,123 @@
+"""Minimal OpenAI-compatible chat completions server for local testing."""
+import asyncio
+import json
+import random
+import re
+import threading
+
+from aiohttp import web
+
+
+class FakeLLMServer:
+    """Serves /v1/chat/completions on a background thread.
+
+    The reply echoes the row's Description as the G/L account so callers can
+    check results come back in the right order. ``latency`` delays every reply.
+    Batched prompts get a JSON array; rows whose Description is in ``drop``
+    are left out of it. Top-k prompts get a ranking led by the Description.
+    The first ``rate_limited`` requests get a 429 with ``Retry-After``;
+    requests for a model in ``failing_models`` always get a 500, and any
+    request fails with a 500 with probability ``error_rate``. Successful
+    replies carry ``headers`` (e.g. x-ratelimit-*).
+    """
+
+    def __init__(self, latency=0.0, drop=(), rate_limited=0, retry_after=0.05, failing_models=(), headers=None,
+                 error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self.drop = set(drop)
+        self.rate_limited = rate_limited
+        self.retry_after = retry_after
+        self.failing_models = set(failing_models)
+        self.headers = headers or {}
+        self.models = []
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.url = None
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    def reply_for(self, prompt):
+        if '"predictions"' in prompt:
+            match = re.search(r"Description: (.*)", prompt)
+            description = match.group(1).strip() if match else "67500"
+            return json.dumps({"predictions": [
+                {"gl_account_number": "67500", "score": 0.1},
+                {"gl_account_number": description, "score": 0.8},
+                {"gl_account_number": "NOT-AN-ACCOUNT", "score": 0.9},
+                {"gl_account_number": "61110", "score": 0.05}
+            ]})
+        rows = re.findall(r"Row (\d+):\s*Description: (.*)", prompt)
+        if rows:
+            return json.dumps([
+                {"row": int(number), "gl_account_number": description.strip(), "confidence_score": 0.9,
+                 "alternative_gl_account_number": "67500", "reasoning": "Echoed from description"}
+                for number, description in rows if description.strip() not in self.drop
+            ])
+        match = re.search(r"Description: (.*)", prompt)
+        description = match.group(1).strip() if match else "67500"
+        return f"{description},0.9,67500,Echoed from description"
+
+    async def _handle(self, request):
+        body = await request.json()
+        self.requests += 1
+        self.models.append(body.get("model"))
+        if self.rate_limited:
+            self.rate_limited -= 1
+            return web.json_response({"error": {"message": "Rate limit reached", "type": "requests"}},
+                                     status=429, headers={"Retry-After": str(self.retry_after)})
+        if body.get("model") in self.failing_models or self._random.random() < self.error_rate:
+            return web.json_response({"error": {"message": "The server had an error", "type": "server_error"}},
+                                     status=500)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            content = self.reply_for(body["messages"][-1]["content"])
+        finally:
+            self.in_flight -= 1
+        return web.json_response({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "model": body.get("model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        }, headers=self.headers)
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/v1"
+
+    def start(self):
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start())
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
@@ -0,0 +1,146 @@
+import io
+import os
+import re
+import subprocess
+import sys
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main, worker
+from app.config import Config
+from app.services.queue_service import job_queue
+from app.services.task_service import task_manager
+
+client = TestClient(main.app)
+
+
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(tmp_path))
+    return tmp_path
+
+
+def upload(filename="statement.csv", **form):
+    content = b"Description,Amount\nUBER TRIP,12.5\nDELTA AIR LINES,420\n"
+    return client.post("/start-prediction/", files={"file": (filename, io.BytesIO(content), "text/csv")},
+                       data=form, headers={"X-User": "someone-else"})
+
+
+def task_of(response):
+    task_id = re.search(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", response.text).group(0)
+    return task_manager.get_task(task_id)
+
+
+def test_ready_once_the_classification_stack_is_loaded():
+    # Runs the lifespan: startup queueing, garbage collection and warm-up (no embedded workers here)
+    with TestClient(main.app) as running:
+        assert running.get("/health").json() == {"status": "ok"}
+        deadline = time.monotonic() + 60
+        while (response := running.get("/ready")).status_code == 503 and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+
+
+def test_importing_the_app_does_not_load_the_classification_stack():
+    script = "import sys, app.main; print(sorted({'openai', 'pandas', 'sklearn'} & set(sys.modules)))"
+    loaded = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=os.path.join(os.path.dirname(__file__), ".."), env={**os.environ, "EMBEDDED_WORKERS": "0"},
+        capture_output=True, text=True, check=True
+    ).stdout.strip()
+
+    assert loaded == "[]"
+
+
+@pytest.mark.usefixtures("fresh_limits")
+def test_predict_topk_ranks_accounts_per_row(fake_llm):
+    response = client.post("/api/predict-topk", json={"expenses": [{"Description": "61110"}, {"Description": "64100"}],
+                                                      "k": 2})
+
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["row"] for result in results] == [0, 1]
+    assert [result["predictions"][0]["gl_account_number"] for result in results] == ["61110", "64100"]
+    assert all(len(result["predictions"]) == 2 for result in results)
+
+
+def test_predict_topk_rejects_out_of_range_k():
+    assert client.post("/api/predict-topk", json={"expenses": [], "k": 0}).status_code == 422
+
+
+def test_upload_is_queued_under_the_client_with_clamped_priority(upload_dir):
+    response = upload(priority="50")
+
+    assert response.status_code == 200
+    task = task_of(response)
+    job = job_queue.get(task["task_id"])
+    # X-User is only trusted when JOB_USER_HEADER is configured
+    assert job["user"] == "testclient"
+    assert job["priority"] == Config.JOB_MAX_CLIENT_PRIORITY
+    assert task["total_rows"] == 2
+    assert len(list(upload_dir.iterdir())) == 1
+
+
+def test_upload_user_comes_from_the_configured_header(upload_dir, monkeypatch):
+    monkeypatch.setattr(Config, "JOB_USER_HEADER", "X-User")
+
+    response = upload(priority="-5")
+
+    job = job_queue.get(task_of(response)["task_id"])
+    assert (job["user"], job["priority"]) == ("someone-else", -5)
+
+
+def test_upload_with_an_unsupported_extension_is_refused(upload_dir):
+    response = upload("statement.pdf")
+
+    assert response.status_code == 200
+    assert "Invalid file extension" in response.text
+    assert not list(upload_dir.iterdir())
+
+
+def test_task_status_of_an_unknown_task():
+    assert client.get("/api/task-status/does-not-exist").json() == {"status": "not_found"}
+
+
+def test_download_of_a_missing_file_is_404(upload_dir):
+    assert client.get("/download/missing.xlsx").status_code == 404
+
+
+@pytest.mark.usefixtures("fresh_limits")
+def test_metrics_report_llm_latency_tokens_and_jobs(fake_llm, upload_dir):
+    client.post("/api/predict-topk", json={"expenses": [{"Description": "61110"}]})
+    upload()
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert f'llm_request_seconds_count{{model="{Config.LLM_PRIMARY_MODEL}",outcome="ok"}}' in text
+    assert f'llm_tokens_total{{kind="completion",model="{Config.LLM_PRIMARY_MODEL}"}}' in text
+    assert 'jobs{status="queued"}' in text
+
+
+@pytest.mark.usefixtures("fresh_limits")
+def test_identical_upload_reuses_the_stored_result(upload_dir, monkeypatch, fake_llm):
+    monkeypatch.setattr(worker, "UPLOAD_DIR", str(upload_dir))
+    first = task_of(upload("march.csv", output_format="csv"))
+    worker.process_file_background(first["upload_path"], "march", first["task_id"])
+    requests = fake_llm.requests
+
+    response = upload("march (1).csv", output_format="csv")
+
+    task = task_of(response)
+    assert task["status"] == "completed"
+    assert task["result_file"] == task_manager.get_task(first["task_id"])["result_file"]
+    assert task["stats"]["reused_result"] is True
+    assert job_queue.get(task["task_id"]) is None
+    assert fake_llm.requests == requests
+    assert client.get(f"/download/{task['result_file']}").status_code == 200
+    # One stored copy of the upload next to the result
+    assert sorted(path.name for path in upload_dir.iterdir()) == sorted([task["result_file"],
+                                                                         f"{task['upload_sha256']}.csv"])
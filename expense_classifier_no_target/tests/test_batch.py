@@ -0,0 +1,61 @@
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from app import batch
+from benchmarks.bench_llm import synthetic_expenses
+
+pytestmark = pytest.mark.usefixtures("fresh_limits")
+
+
+@pytest.fixture
+def statements(tmp_path):
+    inputs = tmp_path / "statements"
+    (inputs / "jane").mkdir(parents=True)
+    expenses = synthetic_expenses(12, seed=5)
+    with pd.ExcelWriter(inputs / "amex.xlsx") as writer:
+        expenses.iloc[:8].to_excel(writer, sheet_name="January", index=False)
+        expenses.iloc[8:].to_excel(writer, sheet_name="February", index=False)
+        pd.DataFrame({"Note": ["totals only"]}).to_excel(writer, sheet_name="Notes", index=False)
+    synthetic_expenses(5, seed=6).to_csv(inputs / "visa.csv", index=False)
+    shutil.copy(inputs / "visa.csv", inputs / "jane" / "visa_copy.csv")
+    return inputs
+
+
+def test_batch_classifies_every_sheet_and_reuses_stored_results(fake_llm, statements, tmp_path):
+    output_dir = tmp_path / "out"
+
+    summary = batch.run([str(statements)], str(output_dir), "csv", workers=2)
+
+    files = {Path(entry["file"]).name: entry for entry in summary["files"]}
+    assert {name: entry["status"] for name, entry in files.items()} == \
+        {"amex.xlsx": "classified", "visa.csv": "classified", "visa_copy.csv": "classified"}
+    assert [(sheet["sheet"], sheet["rows"]) for sheet in files["amex.xlsx"]["sheets"]] == \
+        [("January", 8), ("February", 4), ("Notes", 0)]
+    result = pd.read_csv(output_dir / "predictions.csv")
+    assert summary["rows"] == len(result) == 12 + 5 + 5
+    assert result.columns[:2].tolist() == ["Source File", "Sheet"]
+    assert result["Predicted GL Account"].notna().all()
+    # The copy shares the stored results, so its rows reached the LLM once
+    assert fake_llm.requests > 0
+    requests = fake_llm.requests
+
+    summary = batch.run([str(statements)], str(output_dir), "csv", workers=2)
+
+    assert {entry["status"] for entry in summary["files"]} == {"reused"}
+    assert summary["rows"] == 22
+    assert fake_llm.requests == requests
+
+
+def test_worker_processes_split_the_rate_budget(monkeypatch):
+    monkeypatch.setattr(batch.rate_limit_service, "llm_rate_limiter", batch.rate_limit_service.AdaptiveRateLimiter(
+        requests_per_minute=600, tokens_per_minute=90000, headroom=0.9
+    ))
+
+    batch._init_worker(3)
+
+    limiter = batch.rate_limit_service.llm_rate_limiter
+    assert (limiter.requests.per_minute, limiter.tokens.per_minute) == (200, 30000)
+    assert limiter.headroom == pytest.approx(0.3)
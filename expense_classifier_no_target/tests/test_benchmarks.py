@@ -0,0 +1,35 @@
+import filecmp
+import os
+
+import pytest
+
+from benchmarks.bench_llm import bench_engine, synthetic_expenses
+from benchmarks.harness import compare, import_profile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def test_harness_is_kept_identical_in_both_services():
+    assert filecmp.cmp(os.path.join(ROOT, "expense_classifier_no_target", "benchmarks", "harness.py"),
+                       os.path.join(ROOT, "expense_classifier_gl_target", "benchmarks", "harness.py"), shallow=False)
+
+
+@pytest.mark.usefixtures("fresh_limits")
+def test_engine_benchmark_reports_throughput_and_token_usage(fake_llm):
+    result = bench_engine(synthetic_expenses(20).to_dict(orient="records"), concurrency=4)
+
+    assert result["rows"] == 20
+    assert result["rows_per_second"] > 0
+    assert result["llm_requests"] == fake_llm.requests == 2
+    assert result["llm_total_tokens"] > 0
+    assert result["llm_tokens_per_1k_rows"] == result["llm_total_tokens"] * 50
+    assert not compare({"engine_batched": result}, {"results": {"engine_batched": result}}, tolerance=0.2)
+
+
+def test_import_profile_reports_the_slowest_packages_a_module_imports():
+    profile = import_profile("app.config", cwd=os.path.join(ROOT, "expense_classifier_no_target"))
+
+    assert profile["import_seconds"] > 0
+    assert "dotenv" in profile["slowest_imports"]
+    assert "site" not in profile["slowest_imports"]
+    assert "app" not in profile["slowest_imports"]
@@ -0,0 +1,54 @@
+import time
+
+from app.services.cache_service import PredictionCache
+
+MEALS = {
+    "gl_account_number": "61215",
+    "confidence_score": "0.9",
+    "alternative_gl_account_number": "61200",
+    "reasoning": "Restaurant"
+}
+
+
+def make_cache(tmp_path, **kwargs):
+    return PredictionCache(path=str(tmp_path / "cache.sqlite3"), enabled=True, **kwargs)
+
+
+def test_cache_survives_restart_and_ignores_amount(tmp_path):
+    make_cache(tmp_path).set({"Description": "Joe's  Diner", "Amount": 12}, MEALS)
+
+    cache = make_cache(tmp_path)
+    assert cache.get({"Description": "joe's diner", "Amount": 40}) == MEALS
+    assert cache.get({"Description": "Other"}) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_cache_skips_errors_and_honours_bypass(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set({"Description": "x"}, {**MEALS, "gl_account_number": "ERROR"})
+    assert cache.get({"Description": "x"}) is None
+
+    disabled = PredictionCache(path=str(tmp_path / "cache.sqlite3"), enabled=False)
+    disabled.set({"Description": "y"}, MEALS)
+    assert cache.get({"Description": "y"}) is None
+
+
+def test_cache_evicts_least_recently_used_and_expired(tmp_path):
+    cache = make_cache(tmp_path, max_entries=2)
+    cache.set({"Description": "a"}, MEALS)
+    time.sleep(0.01)
+    cache.set({"Description": "b"}, MEALS)
+    time.sleep(0.01)
+    cache.get({"Description": "a"})
+    cache.set({"Description": "c"}, MEALS)
+
+    assert cache.get({"Description": "b"}) is None
+    assert cache.get({"Description": "a"}) == MEALS
+
+    expiring = make_cache(tmp_path, ttl_seconds=0.01)
+    time.sleep(0.02)
+    assert expiring.get({"Description": "a"}) is None
+    # An explicit TTL of 0 disables reuse instead of falling back to the default
+    make_cache(tmp_path).set({"Description": "d"}, MEALS)
+    assert make_cache(tmp_path, ttl_seconds=0).get({"Description": "d"}) is None
@@ -0,0 +1,97 @@
+import joblib
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import LabelEncoder
+
+from app.services.cascade_service import CascadeClassifier
+from app.services.classifier_service import ClassificationEngine
+from app.services.llm_service import ModelUnavailable
+
+
+def train_model(tmp_path, labels=None):
+    texts = ["uber trip ride"] * 20 + ["delta air lines flight"] * 20
+    labels = labels or ["61130"] * 20 + ["61120"] * 20
+    encoder = LabelEncoder().fit(labels)
+    model = Pipeline([
+        ("preprocessor", ColumnTransformer([
+            ("text", TfidfVectorizer(), "combined_text"),
+            ("num", SimpleImputer(strategy="median"), ["Amount"])
+        ])),
+        ("classifier", LogisticRegression(C=100))
+    ]).fit(pd.DataFrame({"combined_text": texts, "Amount": 10.0}), encoder.transform(labels))
+    joblib.dump(model, tmp_path / "model.pkl")
+    joblib.dump(encoder, tmp_path / "encoder.pkl")
+    return str(tmp_path / "model.pkl"), str(tmp_path / "encoder.pkl")
+
+
+def test_cascade_sends_only_uncertain_rows_to_llm(tmp_path):
+    model_path, encoder_path = train_model(tmp_path)
+    sent = []
+
+    async def llm(row):
+        sent.append(row["Description"])
+        return {"gl_account_number": "64100", "confidence_score": "0.9",
+                "alternative_gl_account_number": "", "reasoning": "LLM"}
+
+    engine = ClassificationEngine(batch_size=1, predict=llm, cache=None, index=None)
+    cascade = CascadeClassifier(model_path, encoder_path, min_confidence=0.7, min_margin=0.4, engine=engine)
+    df = pd.DataFrame({
+        "Description": ["UBER TRIP", "DELTA AIR LINES", "ADOBE"],
+        "Extended Details": ["ride", "flight", None],
+        "Amount": [12.0, 300.0, 50.0]
+    })
+    progress = []
+
+    predictions = cascade.run(df, progress_callback=progress.append)
+
+    assert [p["gl_account_number"] for p in predictions] == ["61130", "61120", "64100"]
+    assert sent == ["ADOBE"]
+    assert cascade.stats["tiers"]["ml_model"]["rows"] == 2
+    assert cascade.stats["tiers"]["llm"]["rows"] == 1
+    assert progress[-1] == 3
+
+
+def test_cascade_keeps_model_answers_when_no_llm_is_available(tmp_path):
+    model_path, encoder_path = train_model(tmp_path)
+
+    async def llm(row):
+        raise ModelUnavailable("All LLM models are failing")
+
+    engine = ClassificationEngine(batch_size=1, predict=llm, cache=None, index=None)
+    cascade = CascadeClassifier(model_path, encoder_path, min_confidence=1.0, min_margin=1.0, engine=engine)
+
+    predictions = cascade.run(pd.DataFrame({"Description": ["UBER TRIP"], "Extended Details": ["ride"], "Amount": [12.0]}))
+
+    assert predictions[0]["gl_account_number"] == "61130"
+    assert predictions[0]["source"] == "ml_model"
+    assert "LLM unavailable" in predictions[0]["reasoning"]
+    assert cascade.stats["local_fallback_rows"] == 1
+
+
+def test_cascade_without_model_uses_llm_for_every_row():
+    async def llm(row):
+        return {"gl_account_number": "64100", "confidence_score": "0.9",
+                "alternative_gl_account_number": "", "reasoning": "LLM"}
+
+    engine = ClassificationEngine(batch_size=1, predict=llm, cache=None, index=None)
+    cascade = CascadeClassifier(model_path="missing.pkl", encoder_path="missing.pkl", engine=engine)
+
+    predictions = cascade.run(pd.DataFrame({"Description": ["a", "b"], "Amount": [1, 2]}))
+
+    assert [p["gl_account_number"] for p in predictions] == ["64100", "64100"]
+    assert cascade.stats["tiers"]["llm"]["rows"] == 2
+
+
+def test_cascade_reports_float_encoded_accounts_as_account_numbers(tmp_path):
+    # The shipped encoder was fitted on a numeric column, so its classes are floats
+    model_path, encoder_path = train_model(tmp_path, labels=[61130.0] * 20 + [61120.0] * 20)
+    cascade = CascadeClassifier(model_path, encoder_path, min_confidence=0.5, min_margin=0.0)
+
+    prediction = cascade.score(pd.DataFrame({"Description": ["UBER TRIP"], "Extended Details": ["ride"], "Amount": [12.0]}))[0]
+
+    assert prediction["gl_account_number"] == "61130"
+    assert prediction["alternative_gl_account_number"] == "61120"
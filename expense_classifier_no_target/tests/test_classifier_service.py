@@ -0,0 +1,136 @@
+import pytest
+
+from app.config import Config
+from app.services import rate_limit_service
+from app.services.cache_service import PredictionCache
+from app.services.classifier_service import ClassificationEngine
+
+# Each test gets its own process-wide limiter and breakers, with short backoffs
+pytestmark = pytest.mark.usefixtures("fresh_limits")
+
+
+def test_engine_keeps_row_order_and_limits_concurrency(fake_llm):
+    rows = [{"Description": str(61000 + i), "Amount": i} for i in range(30)]
+    progress = []
+
+    engine = ClassificationEngine(max_concurrency=4, batch_size=1, cache=None, index=None)
+    predictions = engine.run(rows, progress_callback=progress.append, progress_every=10)
+
+    assert [p["gl_account_number"] for p in predictions] == [r["Description"] for r in rows]
+    assert fake_llm.requests == 30
+    assert 1 < fake_llm.max_in_flight <= 4
+    assert progress == [10, 20, 30]
+
+
+def test_batched_engine_falls_back_to_per_row_requests(fake_llm):
+    rows = [{"Description": str(61000 + i), "Amount": i} for i in range(25)]
+    fake_llm.drop = {"61003", "61017"}
+
+    predictions = ClassificationEngine(batch_size=10, cache=None, index=None).run(rows)
+
+    assert [p["gl_account_number"] for p in predictions] == [r["Description"] for r in rows]
+    # 3 batched requests plus one retry per dropped row
+    assert fake_llm.requests == 5
+
+
+def test_engine_marks_failed_rows():
+    async def failing(row):
+        raise RuntimeError("boom")
+
+    engine = ClassificationEngine(batch_size=1, predict=failing, cache=None, index=None)
+    predictions = engine.run([{"Description": "x"}])
+
+    assert predictions[0]["gl_account_number"] == "ERROR"
+    assert "boom" in predictions[0]["reasoning"]
+
+
+def test_engine_serves_repeat_merchants_from_cache(fake_llm, tmp_path):
+    cache = PredictionCache(path=str(tmp_path / "cache.sqlite3"), enabled=True)
+    rows = [{"Description": "61215", "City/State": "Austin TX", "Amount": i} for i in range(3)]
+
+    ClassificationEngine(batch_size=1, cache=cache, index=None).run(rows[:1])
+    engine = ClassificationEngine(batch_size=1, cache=cache, index=None)
+    predictions = engine.run(rows)
+
+    assert fake_llm.requests == 1
+    assert engine.stats["cache_hits"] == 1
+    assert engine.stats["llm_rows"] == 0
+    assert all(p["gl_account_number"] == "61215" for p in predictions)
+
+
+def test_engine_classifies_duplicate_rows_once(fake_llm):
+    rows = [{"Description": str(61000 + i % 4), "Amount": i} for i in range(20)]
+    progress = []
+
+    engine = ClassificationEngine(batch_size=1, cache=None, index=None)
+    predictions = engine.run(rows, progress_callback=progress.append, progress_every=1)
+
+    assert [p["gl_account_number"] for p in predictions] == [r["Description"] for r in rows]
+    assert fake_llm.requests == 4
+    assert engine.stats["unique_rows"] == 4
+    assert engine.stats["dedup_ratio"] == 0.8
+    assert progress[-1] == 20
+
+
+def test_engine_returns_top_k_rankings(fake_llm):
+    from functools import partial
+    from app.services.llm_service import predict_top_k_async
+
+    rows = [{"Description": "61120"}, {"Description": "61215"}]
+    engine = ClassificationEngine(batch_size=1, predict=partial(predict_top_k_async, k=2), cache=None, index=None)
+    results = engine.run(rows)
+
+    assert [[p["gl_account_number"] for p in r["predictions"]] for r in results] == [["61120", "67500"],
+                                                                                    ["61215", "67500"]]
+    assert results[0]["margin"] == pytest.approx(0.7)
+
+
+def test_top_k_margin_uses_the_runner_up_even_for_k_1():
+    from app.services.llm_service import build_top_k_prompt, parse_top_k
+
+    reply = '{"predictions": [{"gl_account_number": "61120", "score": 0.5}, {"gl_account_number": "61130", "score": 0.4}]}'
+
+    assert "rank the 2 most appropriate" in build_top_k_prompt({"Description": "x"}, 1)
+    assert parse_top_k(reply, 1) == {"predictions": [{"gl_account_number": "61120", "score": 0.5}], "margin": 0.1}
+
+
+def test_rate_limited_requests_are_retried_after_a_shared_pause(fake_llm):
+    rows = [{"Description": str(61000 + i)} for i in range(6)]
+    fake_llm.rate_limited = 3
+    fake_llm.headers = {"x-ratelimit-limit-requests": "3000", "x-ratelimit-remaining-requests": "2999"}
+
+    predictions = ClassificationEngine(batch_size=1, cache=None, index=None).run(rows)
+
+    assert [p["gl_account_number"] for p in predictions] == [r["Description"] for r in rows]
+    assert fake_llm.requests == 9
+    limiter = rate_limit_service.llm_rate_limiter
+    assert limiter.rate_limited == 3
+    # The limit learned from the headers replaces the configured starting value
+    assert limiter.requests.per_minute == pytest.approx(3000 * limiter.headroom)
+
+
+def test_open_breaker_routes_to_the_fallback_model(fake_llm):
+    rows = [{"Description": str(61000 + i)} for i in range(8)]
+    fake_llm.failing_models = {Config.LLM_PRIMARY_MODEL}
+
+    engine = ClassificationEngine(max_concurrency=1, batch_size=1, cache=None, index=None)
+    predictions = engine.run(rows)
+
+    assert [p["gl_account_number"] for p in predictions] == [r["Description"] for r in rows]
+    # Two failures open the primary's breaker; every later request goes straight to the fallback
+    assert fake_llm.models.count(Config.LLM_PRIMARY_MODEL) == 2
+    assert rate_limit_service.llm_breakers[Config.LLM_PRIMARY_MODEL].state == "open"
+
+
+def test_rows_fall_back_to_local_answers_when_no_model_is_available(fake_llm):
+    rows = [{"Description": "61215"}, {"Description": "61120"}]
+    fake_llm.failing_models = {Config.LLM_PRIMARY_MODEL, Config.LLM_FALLBACK_MODEL}
+    local = {"gl_account_number": "61110", "confidence_score": "0.40",
+             "alternative_gl_account_number": "", "reasoning": "local", "source": "ml_model"}
+
+    engine = ClassificationEngine(max_concurrency=1, batch_size=1, cache=None, index=None)
+    predictions = engine.run(rows, fallback=[local, None])
+
+    assert predictions[0] is local
+    assert predictions[1]["gl_account_number"] == "ERROR"
+    assert engine.stats["local_fallback_rows"] == 1
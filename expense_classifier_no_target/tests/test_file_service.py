@@ -0,0 +1,85 @@
+import ast
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from app.services.file_service import count_rows, iter_file_chunks, read_result_file, ResultWriter
+
+
+@pytest.fixture
+def expenses():
+    return pd.DataFrame({
+        "Description": [f"MERCHANT {i}" for i in range(25)],
+        "Amount": [float(i) for i in range(25)]
+    })
+
+
+@pytest.mark.parametrize("extension", ["xlsx", "csv", "parquet"])
+def test_chunks_cover_every_row_in_order(tmp_path, expenses, extension):
+    path = tmp_path / f"expenses.{extension}"
+    if extension == "xlsx":
+        expenses.to_excel(path, index=False)
+    elif extension == "csv":
+        expenses.to_csv(path, index=False)
+    else:
+        expenses.to_parquet(path)
+
+    chunks = list(iter_file_chunks(str(path), chunk_size=10))
+
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    assert count_rows(str(path)) == 25
+    combined = pd.concat(chunks)
+    assert combined.index.tolist() == list(range(25))
+    assert combined["Description"].tolist() == expenses["Description"].tolist()
+
+
+def predictions_for(chunk):
+    return [{"gl_account_number": "61215", "confidence_score": "0.9",
+             "alternative_gl_account_number": "", "reasoning": row} for row in chunk["Description"]]
+
+
+@pytest.mark.parametrize("output_format", ["xlsx", "csv", "jsonl", "parquet"])
+def test_result_writer_resumes_from_flushed_chunks(tmp_path, expenses, output_format):
+    output = str(tmp_path / f"prediction_expenses.{output_format}")
+    chunks = [expenses.iloc[i:i + 10].copy() for i in range(0, 25, 10)]
+
+    parts_root = str(tmp_path / "data" / "parts")
+    first_run = ResultWriter(output, parts_root=parts_root)
+    first_run.write_chunk(0, chunks[0], predictions_for(chunks[0]))
+    first_run.write_chunk(2, chunks[2], predictions_for(chunks[2]))
+    # Parts are Parquet files outside the output's (publicly served) directory
+    assert sorted(p.name for p in (tmp_path / "data" / "parts").rglob("part-*")) == [
+        "part-000000.parquet", "part-000002.parquet"
+    ]
+
+    resumed = ResultWriter(output, parts_root=parts_root)
+    assert resumed.completed_chunks() == {0, 2}
+    resumed.write_chunk(1, chunks[1], predictions_for(chunks[1]))
+    assert resumed.finalize() == 25
+
+    result = read_result_file(output)
+    assert result["Description"].tolist() == expenses["Description"].tolist()
+    assert result["Reasoning"].tolist() == expenses["Description"].tolist()
+    assert not (tmp_path / "data" / "parts" / f"prediction_expenses.{output_format}.parts").exists()
+
+
+def test_shared_file_helpers_match_the_gl_target_copy():
+    # Both services ship their own copy of these helpers; they must not drift apart
+    here = Path(__file__).resolve().parents[1] / "app" / "services" / "file_service.py"
+    there = Path(__file__).resolve().parents[2] / "expense_classifier_gl_target" / "app" / "services" / "file_service.py"
+    if not there.exists():
+        pytest.skip("gl_target service not checked out")
+
+    def shared(path):
+        tree = ast.parse(path.read_text())
+        return {
+            ast.unparse(node.targets[0]) if isinstance(node, ast.Assign) else node.name: ast.dump(node)
+            for node in tree.body
+            if getattr(node, "name", None) in ("file_digest", "save_upload", "store_upload", "collect_garbage",
+                                               "sheet_names", "_xlsx_chunks", "StreamingOutput")
+            or (isinstance(node, ast.Assign) and ast.unparse(node.targets[0]) == "OUTPUT_FORMATS")
+        }
+
+    assert len(shared(here)) == 8
+    assert shared(here) == shared(there)
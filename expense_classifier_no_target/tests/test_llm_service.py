@@ -0,0 +1,62 @@
+import asyncio
+
+import openai
+import pytest
+
+from app.config import Config
+from app.services import rate_limit_service
+from app.services.llm_service import build_batch_prompt, build_prompt, predict_gl_account_async
+from app.services.rate_limit_service import AdaptiveRateLimiter, CircuitBreaker
+from app.services.token_service import count_message_tokens, TokenUsage, track_usage
+from tests.fake_llm_server import FakeLLMServer
+
+
+def test_prompt_lists_accounts_compactly_and_skips_empty_fields(monkeypatch):
+    monkeypatch.setattr(Config, "PROMPT_MAX_DETAILS_CHARS", 20)
+    prompt = build_prompt({
+        "Description": "UBER   TRIP", "Extended Details": "word " * 50, "Address": None,
+        "Country": float("nan"), "CC Name": "  ", "Amount": 12.5
+    })
+
+    assert "61130 Taxi Fares\n" in prompt
+    assert "{" not in prompt and "    " not in prompt
+    assert "Description: UBER TRIP\nExtended Details: word word word word...\nAmount: 12.5" in prompt
+    assert "Address" not in prompt and "Country" not in prompt and "CC Name" not in prompt
+
+
+def test_batch_prompt_is_cheaper_per_row_than_single_prompts():
+    rows = [{"Description": f"MERCHANT {i}", "City/State": "AUSTIN TX", "Amount": i} for i in range(10)]
+
+    def tokens(prompt):
+        return count_message_tokens([{"role": "user", "content": prompt}])
+
+    assert tokens(build_batch_prompt(rows)) < sum(tokens(build_prompt(row)) for row in rows) / 3
+
+
+def test_usage_and_cost_are_recorded_for_the_current_job(monkeypatch):
+    monkeypatch.setattr(rate_limit_service, "llm_rate_limiter", AdaptiveRateLimiter())
+    monkeypatch.setattr(rate_limit_service, "llm_breakers", {
+        model: CircuitBreaker(model) for model in (Config.LLM_PRIMARY_MODEL, Config.LLM_FALLBACK_MODEL)
+    })
+    prompt_price, completion_price = Config.LLM_PRICES[Config.LLM_PRIMARY_MODEL]
+    server = FakeLLMServer().start()
+    monkeypatch.setattr(openai, "api_base", server.url)
+    monkeypatch.setattr(openai, "api_key", "test-key")
+    try:
+        # Totals of an earlier attempt at the job
+        usage = TokenUsage(requests=1, prompt_tokens=100, completion_tokens=10,
+                           cost_usd=(100 * prompt_price + 10 * completion_price) / 1000)
+        with track_usage(usage):
+            asyncio.run(predict_gl_account_async({"Description": "61215"}))
+        # Outside the job nothing is counted
+        asyncio.run(predict_gl_account_async({"Description": "61215"}))
+    finally:
+        server.stop()
+
+    totals = usage.as_dict(rows=2)
+    assert totals["requests"] == 2
+    assert totals["prompt_tokens"] > 100 and totals["completion_tokens"] > 10
+    assert totals["cost_usd"] == pytest.approx(
+        (totals["prompt_tokens"] * prompt_price + totals["completion_tokens"] * completion_price) / 1000, abs=1e-6
+    )
+    assert totals["tokens_per_1k_rows"] == totals["total_tokens"] * 500
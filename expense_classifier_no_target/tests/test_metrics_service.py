@@ -0,0 +1,77 @@
+import pytest
+
+from app.services import metrics_service
+from app.services.metrics_service import MetricsRegistry, StageTimings
+
+
+def test_observations_of_every_process_are_rendered_together(tmp_path):
+    path = str(tmp_path / "metrics.sqlite3")
+    web, worker = MetricsRegistry(path, flush_seconds=60), MetricsRegistry(path, flush_seconds=60)
+
+    worker.observe("llm_request_seconds", 0.2, model="gpt-4", outcome="ok")
+    worker.observe("llm_request_seconds", 7, model="gpt-4", outcome="ok")
+    worker.inc("llm_tokens_total", 120, model="gpt-4", kind="prompt")
+    worker.flush()
+    web.inc("llm_tokens_total", 30, model="gpt-4", kind="prompt")
+
+    text = web.render(gauges={"jobs": [({"status": "queued"}, 3)]})
+    assert 'llm_request_seconds_bucket{model="gpt-4",outcome="ok",le="0.1"} 0' in text
+    assert 'llm_request_seconds_bucket{model="gpt-4",outcome="ok",le="0.25"} 1' in text
+    assert 'llm_request_seconds_bucket{model="gpt-4",outcome="ok",le="10"} 2' in text
+    assert 'llm_request_seconds_bucket{model="gpt-4",outcome="ok",le="+Inf"} 2' in text
+    assert 'llm_request_seconds_sum{model="gpt-4",outcome="ok"} 7.2' in text
+    assert 'llm_request_seconds_count{model="gpt-4",outcome="ok"} 2' in text
+    assert 'llm_tokens_total{kind="prompt",model="gpt-4"} 150' in text
+    assert 'jobs{status="queued"} 3' in text
+    assert "# TYPE job_duration_seconds histogram" in text
+
+
+def test_pending_observations_are_written_once_the_flush_interval_passes(tmp_path):
+    path = str(tmp_path / "metrics.sqlite3")
+    registry = MetricsRegistry(path, flush_seconds=0)
+
+    registry.inc("upload_parse_errors_total", format="csv")
+
+    reader = MetricsRegistry(path)
+    assert reader.snapshot() == {("upload_parse_errors_total", '{"format": "csv"}'): {"total": 1}}
+
+
+def test_disabled_registry_records_nothing(tmp_path):
+    registry = MetricsRegistry(str(tmp_path / "metrics.sqlite3"), enabled=False)
+
+    registry.inc("llm_fallbacks_total")
+
+    assert "llm_fallbacks_total{" not in registry.render()
+    assert not (tmp_path / "metrics.sqlite3").exists()
+
+
+def test_stage_timings_add_to_earlier_attempts_and_feed_histograms(tmp_path, monkeypatch):
+    registry = MetricsRegistry(str(tmp_path / "metrics.sqlite3"))
+    monkeypatch.setattr(metrics_service, "metrics", registry)
+    timings = StageTimings(parse=1.0, classify=2.0, total=3.0)
+
+    chunks = list(timings.iterate(iter(["a", "b"]), "parse", "upload_parse_seconds", format="csv"))
+    with timings.stage("write"):
+        pass
+
+    assert chunks == ["a", "b"]
+    result = timings.as_dict()
+    assert set(result) == {"parse", "classify", "write", "total"}
+    assert 1.0 <= result["parse"] < 1.5
+    assert result["total"] == pytest.approx(result["parse"] + result["classify"] + result["write"], abs=0.002)
+    # One observation per chunk read, plus the final read that ends the file
+    assert registry.snapshot()[("upload_parse_seconds", '{"format": "csv"}')]["count"] == 3
+
+
+def test_failed_reads_count_as_parse_errors(tmp_path, monkeypatch):
+    registry = MetricsRegistry(str(tmp_path / "metrics.sqlite3"))
+    monkeypatch.setattr(metrics_service, "metrics", registry)
+
+    def broken_file():
+        yield "a"
+        raise ValueError("bad row")
+
+    with pytest.raises(ValueError):
+        list(StageTimings().iterate(broken_file(), "parse", errors="upload_parse_errors_total", format="xlsx"))
+
+    assert registry.snapshot()[("upload_parse_errors_total", '{"format": "xlsx"}')] == {"total": 1}
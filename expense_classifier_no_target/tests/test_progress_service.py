@@ -0,0 +1,118 @@
+import asyncio
+import json
+import threading
+from types import SimpleNamespace
+
+from app.services import progress_service
+from app.services.progress_service import ProgressBroadcaster
+from app.services.task_service import TaskManager
+
+# Every async scenario is bounded so a regression fails instead of hanging the run
+TIMEOUT = 5
+
+
+class CountingStore(TaskManager):
+    """Task manager that counts status reads"""
+
+    reads = 0
+
+    def get_task(self, task_id):
+        self.reads += 1
+        return super().get_task(task_id)
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, TIMEOUT))
+
+
+def test_subscribers_share_one_poller_and_see_completion(tmp_path):
+    tasks = CountingStore(path=str(tmp_path / "tasks.sqlite3"), legacy_dir=None, flush_seconds=0)
+    broadcaster = ProgressBroadcaster(store=tasks, interval=0.05)
+    task_id = tasks.create_task("expenses.xlsx", 100)
+
+    async def watch():
+        return [snapshot async for snapshot in broadcaster.subscribe(task_id)]
+
+    async def scenario():
+        watchers = [asyncio.ensure_future(watch()) for _ in range(20)]
+        await asyncio.sleep(0.2)
+        reads_while_idle = tasks.reads
+
+        # Progress reported from a worker thread wakes the poller
+        worker = threading.Thread(target=lambda: (tasks.update_progress(task_id, 60),
+                                                  tasks.complete_task(task_id, "prediction.csv")))
+        worker.start()
+        worker.join()
+        return reads_while_idle, await asyncio.gather(*watchers)
+
+    reads_while_idle, results = run(scenario())
+
+    # One poller for twenty subscribers: a handful of reads, not twenty per interval
+    assert reads_while_idle < 20
+    for snapshots in results:
+        assert snapshots[0]["status"] == "processing"
+        assert snapshots[-1]["status"] == "completed"
+        assert snapshots[-1]["result_file"] == "prediction.csv"
+    assert not broadcaster._channels
+
+
+def test_snapshot_reports_throughput_eta_and_preview(tmp_path, monkeypatch):
+    tasks = TaskManager(path=str(tmp_path / "tasks.sqlite3"), legacy_dir=None, flush_seconds=0)
+    broadcaster = ProgressBroadcaster(store=tasks)
+    task_id = tasks.create_task("expenses.xlsx", 1000)
+    tasks.update_progress(task_id, 250)
+    tasks.update_details(task_id, preview=[{"row": 249, "gl_account_number": "61110", "confidence_score": 0.9}])
+
+    started = tasks.get_task(task_id)["start_time"]
+    monkeypatch.setattr(progress_service, "time", SimpleNamespace(time=lambda: started + 25))
+
+    snapshot = broadcaster.snapshot(task_id)
+
+    assert snapshot["progress"] == 25
+    assert snapshot["rows_per_second"] == 10
+    assert snapshot["eta_seconds"] == 75
+    assert snapshot["preview"][0]["gl_account_number"] == "61110"
+
+
+def test_stream_formats_server_sent_events(tmp_path):
+    tasks = TaskManager(path=str(tmp_path / "tasks.sqlite3"), legacy_dir=None)
+    broadcaster = ProgressBroadcaster(store=tasks, interval=0.05)
+    task_id = tasks.create_task("expenses.xlsx", 10)
+    tasks.fail_task(task_id, "boom")
+
+    async def collect(task):
+        return [event async for event in broadcaster.stream(task)]
+
+    events = run(collect(task_id))
+    assert len(events) == 1 and events[0].startswith("event: progress\ndata: ")
+    assert json.loads(events[0].split("data: ", 1)[1])["error"] == "boom"
+
+    # An unknown task ends the stream instead of sending keep-alives forever
+    assert run(collect("missing")) == ['event: not_found\ndata: {"status": "not_found"}\n\n']
+    assert not broadcaster._channels
+
+
+def test_disconnect_while_waiting_releases_the_subscriber(tmp_path):
+    tasks = TaskManager(path=str(tmp_path / "tasks.sqlite3"), legacy_dir=None)
+    broadcaster = ProgressBroadcaster(store=tasks, interval=0.05)
+    task_id = tasks.create_task("expenses.xlsx", 10)
+
+    async def scenario():
+        events = broadcaster.stream(task_id, keepalive=0.1)
+        first = await events.__anext__()
+        assert await events.__anext__() == ": keep-alive\n\n"
+        # A second client joining mid-stream gets the last published snapshot straight away
+        late = broadcaster.subscribe(task_id)
+        assert (await late.__anext__())["status"] == "processing"
+        await late.aclose()
+        # Client goes away while the stream waits for the next update
+        waiting = asyncio.ensure_future(events.__anext__())
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        await events.aclose()
+        await asyncio.sleep(0.2)
+        return first
+
+    assert run(scenario()).startswith("event: progress")
+    assert not broadcaster._channels
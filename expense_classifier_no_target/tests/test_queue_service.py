@@ -0,0 +1,74 @@
+import time
+
+from app.services.queue_service import JobQueue
+
+
+def make_queue(tmp_path, **kwargs):
+    return JobQueue(path=str(tmp_path / "jobs.sqlite3"), **kwargs)
+
+
+def test_claim_prefers_priority_then_least_busy_user(tmp_path):
+    queue = make_queue(tmp_path, max_running_per_user=5)
+    queue.enqueue("a1", {"n": 1}, user="alice")
+    queue.enqueue("a2", {"n": 2}, user="alice")
+    queue.enqueue("b1", {"n": 3}, user="bob")
+    queue.enqueue("urgent", {"n": 4}, user="alice", priority=10)
+
+    claimed = [queue.claim("w")[0] for _ in range(4)]
+
+    # Priority first; then bob's job goes ahead of alice's second one
+    assert claimed == ["urgent", "b1", "a1", "a2"]
+    assert queue.claim("w") is None
+
+
+def test_claim_caps_running_jobs_per_user(tmp_path):
+    queue = make_queue(tmp_path, max_running_per_user=1)
+    queue.enqueue("a1", {}, user="alice")
+    queue.enqueue("a2", {}, user="alice")
+
+    assert queue.claim("w")[0] == "a1"
+    assert queue.claim("w") is None
+    queue.complete("a1")
+    assert queue.claim("w")[0] == "a2"
+
+
+def test_failed_jobs_are_retried_until_max_attempts(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.config.Config.JOB_RETRY_BACKOFF_SECONDS", 0)
+    queue = make_queue(tmp_path, max_attempts=2)
+    queue.enqueue("job", {"upload_path": "x"})
+
+    job_id, payload, attempt = queue.claim("w")
+    assert (job_id, payload, attempt) == ("job", {"upload_path": "x"}, 1)
+    assert queue.fail("job", "boom") is True
+    assert queue.claim("w")[2] == 2
+    assert queue.fail("job", "boom again") is False
+    assert queue.get("job")["status"] == "failed"
+    assert queue.claim("w") is None
+
+
+def test_jobs_of_dead_workers_are_requeued(tmp_path):
+    queue = make_queue(tmp_path, stale_seconds=0.05)
+    queue.enqueue("job", {})
+    queue.claim("dead-worker")
+
+    assert queue.requeue_stale() == []
+    time.sleep(0.1)
+    assert queue.requeue_stale() == []
+
+    assert queue.get("job")["status"] == "queued"
+    assert queue.claim("new-worker")[0] == "job"
+
+
+def test_job_that_keeps_killing_its_worker_is_failed(tmp_path):
+    queue = make_queue(tmp_path, stale_seconds=0.01, max_attempts=2)
+    queue.enqueue("poison", {})
+
+    queue.claim("worker-1")
+    time.sleep(0.02)
+    assert queue.requeue_stale() == []
+    queue.claim("worker-2")
+    time.sleep(0.02)
+
+    assert queue.requeue_stale() == ["poison"]
+    assert queue.get("poison")["status"] == "failed"
+    assert queue.claim("worker-3") is None
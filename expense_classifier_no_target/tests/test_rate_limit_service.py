@@ -0,0 +1,62 @@
+import pytest
+
+from app.services.rate_limit_service import AdaptiveRateLimiter, CircuitBreaker, parse_reset, TokenBucket
+
+
+def test_token_bucket_spaces_out_reservations_after_a_burst():
+    bucket = TokenBucket(per_minute=60, burst_seconds=2)
+
+    delays = [bucket.reserve(1, now=bucket.updated) for _ in range(4)]
+
+    # Two requests fit in the burst, then one per second
+    assert delays == [0.0, 0.0, pytest.approx(1.0), pytest.approx(2.0)]
+
+
+def test_limiter_follows_rate_limit_headers():
+    limiter = AdaptiveRateLimiter(requests_per_minute=60, tokens_per_minute=6000, burst_seconds=1, headroom=0.5)
+
+    limiter.observe({"x-ratelimit-limit-requests": "600", "x-ratelimit-limit-tokens": "120000",
+                     "x-ratelimit-remaining-tokens": "10"})
+
+    assert limiter.requests.per_minute == 300
+    assert limiter.tokens.per_minute == 60000
+    # Another process used most of the window: local bursts shrink to what is left
+    assert limiter.tokens.level == 10
+
+    limiter.observe({"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "2s"})
+    assert limiter.reserve(1) > 1.5
+
+
+def test_rate_limited_backoff_pauses_every_caller():
+    limiter = AdaptiveRateLimiter(requests_per_minute=6000, tokens_per_minute=10 ** 6, retry_base_seconds=0.5)
+
+    delay = limiter.backoff(0, retry_after=2, rate_limited=True)
+
+    assert 0 <= delay <= 0.5
+    assert 2 <= limiter.reserve(1) <= 2.5 + 0.1
+    assert limiter.stats()["rate_limited"] == 1
+
+
+def test_parse_reset():
+    assert parse_reset("20ms") == pytest.approx(0.02)
+    assert parse_reset("6m0s") == 360
+    assert parse_reset("1h2m3.5s") == pytest.approx(3723.5)
+    assert parse_reset(None) is None
+
+
+def test_breaker_opens_then_lets_one_probe_through():
+    breaker = CircuitBreaker("gpt-4", failure_threshold=2, reset_seconds=0)
+
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    assert breaker.allow() is True  # reset elapsed: half-open probe
+    assert breaker.allow() is False  # only one probe at a time
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    assert breaker.allow() is True
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
@@ -0,0 +1,66 @@
+import pandas as pd
+
+from app.services import similarity_service
+from app.services.similarity_service import expense_text, SimilarityIndex
+
+
+def prediction(gl_account_number):
+    return {
+        "gl_account_number": gl_account_number,
+        "confidence_score": "0.9",
+        "alternative_gl_account_number": "",
+        "reasoning": "LLM"
+    }
+
+
+def test_index_labels_close_matches_and_defers_unknown_rows(tmp_path):
+    index = SimilarityIndex(path=str(tmp_path), k=3, threshold=0.6, enabled=True)
+    history = [{"Description": f"UBER TRIP {i}", "City/State": "NEW YORK NY"} for i in range(3)]
+    history.append({"Description": "DELTA AIR LINES", "City/State": "ATLANTA GA"})
+    index.add_predictions(history, [prediction("61130")] * 3 + [prediction("61120")])
+
+    matched = index.predict([
+        {"Description": "UBER TRIP 7", "City/State": "NEW YORK NY"},
+        {"Description": "ADOBE CREATIVE CLOUD", "City/State": "SAN JOSE CA"}
+    ])
+
+    assert matched[0]["gl_account_number"] == "61130"
+    assert matched[0]["source"] == "similarity"
+    assert matched[1] is None
+
+
+def test_index_persists_and_ingests_prediction_files(tmp_path):
+    output = tmp_path / "prediction_statement_1.xlsx"
+    pd.DataFrame({
+        "Description": ["STAPLES STORE 1", "STAPLES STORE 2", "bad row"],
+        "City/State": ["BOSTON MA"] * 3,
+        "Predicted GL Account": ["65600", "65600", "ERROR"]
+    }).to_excel(output, index=False)
+
+    index = SimilarityIndex(path=str(tmp_path / "index"), enabled=True)
+    assert index.ingest_directory(str(tmp_path)) == 2
+    assert index.ingest_directory(str(tmp_path)) == 0
+
+    reloaded = SimilarityIndex(path=str(tmp_path / "index"), threshold=0.5, enabled=True)
+    assert len(reloaded) == 2
+    assert reloaded.predict([{"Description": "STAPLES STORE 3", "City/State": "BOSTON MA"}])[0]["gl_account_number"] == "65600"
+
+
+def test_index_is_shared_between_processes_and_scores_in_batches(tmp_path, monkeypatch):
+    writer = SimilarityIndex(path=str(tmp_path), k=3, threshold=0.6, enabled=True)
+    reader = SimilarityIndex(path=str(tmp_path), k=3, threshold=0.6, enabled=True)
+    uber = [{"Description": f"UBER TRIP {i}", "City/State": "NEW YORK NY"} for i in range(3)]
+    assert len(reader) == 0
+
+    writer.add_predictions(uber, [prediction("61130")] * 3)
+    # Another process relabels the same expenses; both see the latest label
+    reader.add_predictions(uber, [prediction("61120")] * 3)
+    assert len(writer) == 3
+
+    monkeypatch.setattr(similarity_service, "QUERY_BUDGET", 1)
+    queries = [{"Description": f"UBER TRIP {i}", "City/State": "NEW YORK NY"} for i in range(5, 9)]
+    assert [match["gl_account_number"] for match in writer.predict(queries)] == ["61120"] * 4
+
+
+def test_expense_text_skips_empty_fields():
+    assert expense_text({"Description": " Uber  Trip ", "Address": None, "City/State": "NY"}) == "uber trip ny"
@@ -0,0 +1,47 @@
+import os
+import time
+
+from app.services.storage_service import ResultStore
+from app.services.task_service import task_manager
+
+
+def age(path, seconds):
+    stamp = time.time() - seconds
+    os.utime(path, (stamp, stamp))
+
+
+def test_find_returns_recorded_results_while_their_file_exists(tmp_path):
+    store = ResultStore(path=str(tmp_path / "results.sqlite3"))
+    (tmp_path / "prediction_march_1.csv").write_text("rows")
+    store.record("abc", "v1", "csv", "prediction_march_1.csv", 12)
+
+    assert store.find(str(tmp_path), "abc", "v1", "csv") == ("prediction_march_1.csv", 12)
+    assert store.find(str(tmp_path), "abc", "v2", "csv") is None
+    assert store.find(str(tmp_path), "abc", "v1", "xlsx") is None
+    os.remove(tmp_path / "prediction_march_1.csv")
+    assert store.find(str(tmp_path), "abc", "v1", "csv") is None
+
+
+def test_garbage_collection_keeps_files_of_unfinished_tasks(tmp_path):
+    uploads, parts = tmp_path / "uploads", tmp_path / "parts"
+    uploads.mkdir()
+    parts.mkdir()
+    store = ResultStore(path=str(tmp_path / "results.sqlite3"), max_age_seconds=3600, parts_dir=str(parts))
+    running = task_manager.create_task("april.csv", 10, upload_path=str(uploads / "running.csv"))
+    for name in ("running.csv", f"prediction_april_{running}.csv.tmp", "old.csv", "prediction_march_1.csv",
+                 "recent.csv"):
+        (uploads / name).write_bytes(b"x" * 10)
+    (parts / f"prediction_april_{running}.csv.parts").mkdir()
+    (parts / "prediction_failed_2.csv.parts").mkdir()
+    for path in [*uploads.iterdir(), *parts.iterdir()]:
+        if path.name != "recent.csv":
+            age(path, 7200)
+    store.record("abc", "v1", "csv", "prediction_march_1.csv", 12)
+
+    store.collect_garbage(str(uploads))
+
+    assert sorted(os.listdir(uploads)) == ["prediction_april_" + running + ".csv.tmp", "recent.csv", "running.csv"]
+    assert os.listdir(parts) == [f"prediction_april_{running}.csv.parts"]
+    (uploads / "prediction_march_1.csv").write_text("a new file under the old name")
+    assert store.find(str(uploads), "abc", "v1", "csv") is None
+    task_manager.fail_task(running, "done with the test")
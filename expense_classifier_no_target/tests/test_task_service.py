@@ -0,0 +1,70 @@
+import json
+
+from app.services.task_service import TaskManager
+
+
+def make_manager(tmp_path, **kwargs):
+    return TaskManager(path=str(tmp_path / "tasks.sqlite3"), legacy_dir=str(tmp_path), **kwargs)
+
+
+def test_task_lifecycle_round_trips_details_and_stats(tmp_path):
+    tasks = make_manager(tmp_path)
+    task_id = tasks.create_task("expenses.xlsx", 200, upload_path="/tmp/x.xlsx", output_format="csv")
+
+    tasks.update_progress(task_id, 50)
+    tasks.update_stats(task_id, cache_hits=3)
+    tasks.update_stats(task_id, llm_rows=7)
+    tasks.complete_task(task_id, "prediction_expenses.csv")
+
+    task = tasks.get_task(task_id)
+    assert task["status"] == "completed"
+    assert task["progress"] == 100
+    assert task["upload_path"] == "/tmp/x.xlsx"
+    assert task["stats"] == {"cache_hits": 3, "llm_rows": 7}
+    # A second process sees the same task
+    assert make_manager(tmp_path).get_task(task_id)["result_file"] == "prediction_expenses.csv"
+
+
+def test_progress_writes_are_batched(tmp_path):
+    tasks = make_manager(tmp_path, flush_seconds=3600)
+    other_process = make_manager(tmp_path)
+    task_id = tasks.create_task("expenses.xlsx", 100)
+
+    tasks.update_progress(task_id, 10)
+    tasks.update_progress(task_id, 40)
+
+    assert tasks.get_task(task_id)["progress"] == 40
+    assert other_process.get_task(task_id)["progress"] == 10
+    tasks.flush(task_id)
+    assert other_process.get_task(task_id)["processed_rows"] == 40
+
+
+def test_list_by_status_and_evict_finished(tmp_path):
+    tasks = make_manager(tmp_path, ttl_seconds=60)
+    done = tasks.create_task("a.xlsx", 1)
+    failed = tasks.create_task("b.xlsx", 1)
+    running = tasks.create_task("c.xlsx", 1)
+    tasks.complete_task(done, "out.xlsx")
+    tasks.fail_task(failed, "boom")
+
+    assert [task["task_id"] for task in tasks.unfinished_tasks()] == [running]
+    assert [task["task_id"] for task in tasks.list_tasks("failed")] == [failed]
+
+    assert tasks.evict_finished(now=tasks.get_task(done)["updated_at"] + 120) == 2
+    assert tasks.get_task(done) is None
+    assert tasks.get_task(running) is not None
+
+
+def test_imports_legacy_json_task_files(tmp_path):
+    legacy = {"task_id": "old", "filename": "a.xlsx", "status": "processing", "progress": 5,
+              "total_rows": 10, "processed_rows": 1, "start_time": 1.0, "result_file": None,
+              "error": None, "upload_path": "/tmp/a.xlsx"}
+    (tmp_path / "old.json").write_text(json.dumps(legacy))
+
+    task = make_manager(tmp_path).get_task("old")
+
+    assert task["status"] == "processing"
+    assert task["upload_path"] == "/tmp/a.xlsx"
+    # Imported once: evicting the task later must not bring it back on restart
+    assert not (tmp_path / "old.json").exists()
+    assert (tmp_path / "old.json.imported").exists()